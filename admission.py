@@ -0,0 +1,120 @@
+import asyncio
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Iterator, TypeVar
+
+T = TypeVar("T")
+
+_DONE = object()
+
+
+class Overloaded(Exception):
+    """Raised when a pool's wait queue is full; `retry_after` is a hint in whole seconds."""
+
+    def __init__(self, pool: str, retry_after: int):
+        super().__init__(f"{pool} is overloaded")
+        self.pool = pool
+        self.retry_after = retry_after
+
+
+class AdmissionPool:
+    """Bounded concurrency plus a bounded wait queue for one class of heavy requests.
+
+    At most `workers` requests hold a slot at once and at most `queue_depth`
+    more wait for one; anything beyond that is rejected immediately with
+    `Overloaded`, so a burst turns into fast 429s instead of a stalled server.
+    Blocking work run through `run` / `iterate` goes to the pool's own
+    threads, never to the event loop or the shared default executor.
+    """
+
+    def __init__(self, name: str, workers: int, queue_depth: int):
+        self.name = name
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self._slots = asyncio.Semaphore(workers)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self._active = 0
+        self._waiting = 0
+        self._rejected = 0
+        self._completed = 0
+        # moving average of how long a request holds its slot, for Retry-After
+        self._avg_seconds = 1.0
+
+    def load(self) -> float:
+        """Requests holding or waiting for a slot, per worker."""
+        return (self._active + self._waiting) / self.workers
+
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self.load() * self._avg_seconds))
+
+    def check(self):
+        """Raise `Overloaded` if a request arriving now would be turned away.
+
+        For streams, which take their slot only once the response has started
+        but should still answer 429 up front when the pool is full.
+        """
+        if self._active + self._waiting >= self.workers + self.queue_depth:
+            self._rejected += 1
+            raise Overloaded(self.name, self.retry_after())
+
+    async def acquire(self):
+        self.check()
+        self._waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self._waiting -= 1
+        self._active += 1
+        return time.perf_counter()
+
+    def release(self, started: float):
+        self._active -= 1
+        self._completed += 1
+        self._avg_seconds = 0.9 * self._avg_seconds + 0.1 * (time.perf_counter() - started)
+        self._slots.release()
+
+    @asynccontextmanager
+    async def admit(self):
+        started = await self.acquire()
+        try:
+            yield
+        finally:
+            self.release(started)
+
+    async def offload(self, fn: Callable[..., T], *args) -> T:
+        """Run blocking `fn(*args)` on this pool's threads, for callers already admitted."""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    async def run(self, fn: Callable[..., T], *args) -> T:
+        """Run blocking `fn(*args)` on this pool's threads once admitted."""
+        async with self.admit():
+            return await self.offload(fn, *args)
+
+    async def iterate(self, items: Iterator[T], started: float) -> AsyncIterator[T]:
+        """Drive a blocking iterator on this pool's threads, releasing the slot taken by
+        `acquire` (returned as `started`) when it is exhausted or abandoned."""
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                item = await loop.run_in_executor(self._executor, next, items, _DONE)
+                if item is _DONE:
+                    break
+                yield item
+        finally:
+            self.release(started)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "queue_depth": self.queue_depth,
+            "active": self._active,
+            "waiting": self._waiting,
+            "completed": self._completed,
+            "rejected": self._rejected,
+            "avg_seconds": round(self._avg_seconds, 3),
+        }
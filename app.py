@@ -1,27 +1,60 @@
-from fastapi import FastAPI, HTTPException, Depends, File, UploadFile, Form, Body, status
+from fastapi import FastAPI, HTTPException, Depends, File, UploadFile, Form, Body, Query, Request, Response, status
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel, ValidationError
 from typing import Optional, List
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from passlib.context import CryptContext
 from uuid import uuid4
 import motor.motor_asyncio
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import BulkWriteError
 from contextlib import asynccontextmanager
-from search_explain import search, load_and_storage
-from summarize_agent import summarize
-from summary_text import getDicOfChapterContent
-from translate import ContextualLlamaTranslator
+from concurrent.futures import ThreadPoolExecutor
+from search_explain import search, search_stream, retrieve, retrieve_rankings, merge_rankings, candidates, synthesize, SEARCH_MODES, load_documents, build_index, persist_index, persist_keyword_index, has_index, query_engines, keyword_indexes, embed_model, INDEX_DIR, legacy_persist_dir
+from summarize_agent import asummarize, asummarize_stream
+from summary_text import iterChapters
+from translate import get_translator
+from jobs import IngestionQueue
+from chapter_store import ChapterStore, CHAPTER_STORE_DIR
+from summary_cache import SummaryCache, summary_key
+from auth import hash_password, verify_password, SessionTokens, RevocationCache
+from admission import AdmissionPool, Overloaded
+from prefetch import PrefetchScheduler, parse_progression
+from epub_archive import EpubArchives, resource_etag, etag_matches, parse_range
+from lifecycle import StorageLifecycle
+from singleflight import SingleFlight, flight_key
+import zipfile
+from datetime import datetime, timezone
+import asyncio
+import hashlib
+import json
+import logging
 import os
+import re
+import time
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from metrics import REQUEST_LATENCY, MongoCommandTimer, configure_logging, register_stats
+
+configure_logging()
+logger = logging.getLogger("app")
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Code to execute at startup
-    print("Server is starting!")
+    logger.info("server starting")
     await initialize_database()
+    await ingestion_queue.start(db.ingestion_jobs)
+    await prefetcher.start()
+    revocation_task = asyncio.create_task(refresh_revocations())
+    lifecycle_task = asyncio.create_task(run_storage_lifecycle())
     yield  # This point marks when the server starts accepting requests
     # Code to execute at shutdown
-    print("Server is shutting down!")
+    logger.info("server shutting down")
+    revocation_task.cancel()
+    lifecycle_task.cancel()
     await cleanup_resources()
 
 app = FastAPI(lifespan=lifespan)
@@ -29,6 +62,9 @@ app = FastAPI(lifespan=lifespan)
 # Directory to store uploaded files
 UPLOAD_DIR = "uploads"
 
+# Uploads are read and written in chunks of this size, so a book is never held in memory whole
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
 # Ensure the upload directory exists
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
@@ -37,7 +73,7 @@ app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
 
 # MongoDB connection setup
 MONGO_DETAILS = "mongodb://localhost:27017/"  # Change to your MongoDB URI
-client = motor.motor_asyncio.AsyncIOMotorClient(MONGO_DETAILS)
+client = motor.motor_asyncio.AsyncIOMotorClient(MONGO_DETAILS, event_listeners=[MongoCommandTimer()])
 db = client.file_management  # Database name
 
 # Models
@@ -54,6 +90,8 @@ class BookMark(BaseModel):
     resourceTitle: str
     location: str
     locatorText: str
+    itemId: str = None
+    rev: int = 0
 
 class HighLight(BaseModel):
     bookId: str
@@ -66,6 +104,8 @@ class HighLight(BaseModel):
     totalProgression: str = "0" #double
     #location, text
     annotation: str = ""
+    itemId: str = None
+    rev: int = 0
 
 class FileInfo(BaseModel):
     creation: str #long
@@ -76,28 +116,203 @@ class FileInfo(BaseModel):
     author: str = None
     progression: str = None
     rawMediaType: str
-    bookmarks: list[BookMark]
-    highlights: list[HighLight]
+    bookmarks: list[BookMark] = []
+    highlights: list[HighLight] = []
     cover: str = None
+    rev: int = 0
+
+class TranslateItem(BaseModel):
+    text: str
+    before: str = ""
+    after: str = ""
+
+class TranslateBatch(BaseModel):
+    src_lang: str
+    des_lang: str
+    items: list[TranslateItem]
+
+class SyncOp(BaseModel):
+    op: str  # add | update | delete
+    kind: str  # bookmark | highlight
+    itemId: str = None  # assigned by the server for adds that leave it out
+    item: dict = {}  # whole item for add, changed fields for update
+
+class SyncBatch(BaseModel):
+    identifier: str
+    ops: list[SyncOp]
 
-# Password hashing context
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-bookContent: dict = {}
+# Signed session tokens, checked without a database round trip; revocations are kept
+# in Mongo and mirrored in memory, refreshed every REVOCATION_REFRESH seconds
+sessions = SessionTokens()
+revocations = RevocationCache()
+REVOCATION_REFRESH = float(os.getenv("REVOCATION_REFRESH", "30"))
+
+# Chapter texts and their summaries, persisted on disk and loaded on demand
+chapter_store = ChapterStore()
+
+# Summaries shared across users and books, keyed by chapter text and summarize() parameters
+summary_cache = SummaryCache()
+SUMMARY_PARAMS = {"detail": 0.75, "model": "gpt-4o-mini"}
+
+# Background ingestion (parse, chapter extraction, embedding, persisting)
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+INGEST_MAX_RETRIES = int(os.getenv("INGEST_MAX_RETRIES", "3"))
+# a job whose worker hasn't renewed it for this long is taken over by the next upload of the book
+INGEST_JOB_LEASE = float(os.getenv("INGEST_JOB_LEASE", "60"))
+ingestion_queue = IngestionQueue(workers=INGEST_WORKERS, max_retries=INGEST_MAX_RETRIES, lease=INGEST_JOB_LEASE)
+
+# LLM-backed endpoints each get their own worker slots and a bounded wait queue;
+# past that they answer 429 right away so the CRUD endpoints stay responsive
+search_pool = AdmissionPool("search", int(os.getenv("SEARCH_WORKERS", "4")), int(os.getenv("SEARCH_QUEUE", "16")))
+summarize_pool = AdmissionPool("summarize", int(os.getenv("SUMMARIZE_WORKERS", "4")),
+                               int(os.getenv("SUMMARIZE_QUEUE", "16")))
+translate_pool = AdmissionPool("translate", int(os.getenv("TRANSLATE_WORKERS", "8")),
+                               int(os.getenv("TRANSLATE_QUEUE", "64")))
+
+# /search-library queries every book of the user, one shard per book, on its own threads
+# and at most LIBRARY_SEARCH_FANOUT shards at a time per request
+LIBRARY_SEARCH_FANOUT = int(os.getenv("LIBRARY_SEARCH_FANOUT", "8"))
+library_executor = ThreadPoolExecutor(max_workers=LIBRARY_SEARCH_FANOUT, thread_name_prefix="library")
+
+# Summaries of the chapters just ahead of each reader are computed in the background,
+# paused while any LLM pool is at least PREFETCH_PAUSE_LOAD busy (requests per worker)
+PREFETCH_PAUSE_LOAD = float(os.getenv("PREFETCH_PAUSE_LOAD", "0.5"))
+
+def interactive_busy() -> bool:
+    return any(pool.load() >= PREFETCH_PAUSE_LOAD for pool in (search_pool, summarize_pool, translate_pool))
+
+# Open EPUB zips, for serving single resources out of stored books
+epub_archives = EpubArchives()
+
+# Every artifact of a book (upload, indexes, chapters and summaries, cold archive) is
+# tracked by the storage lifecycle; a sweep every LIFECYCLE_INTERVAL seconds collects
+# orphans, moves unused indexes to cold storage and enforces the quotas
+LIFECYCLE_INTERVAL = float(os.getenv("LIFECYCLE_INTERVAL", "3600"))
+
+def forget_book(fileName: str):
+    query_engines.invalidate(fileName)
+    keyword_indexes.invalidate(fileName)
+    chapter_store.forget(fileName)
+
+lifecycle = StorageLifecycle(UPLOAD_DIR, INDEX_DIR, CHAPTER_STORE_DIR, forget=forget_book,
+                             legacy_index=legacy_persist_dir)
+index_restores = {}
+
+# Identical concurrent summarize / search / translate calls share one computation,
+# across the server's worker processes too
+summary_flights = SingleFlight("summarize")
+search_flights = SingleFlight("search")
+translate_flights = SingleFlight("translate")
+
+# Largest page /files will return in one request
+FILES_PAGE_MAX = int(os.getenv("FILES_PAGE_MAX", "500"))
+# Most records /files/bulk accepts in one request
+FILES_BULK_MAX = int(os.getenv("FILES_BULK_MAX", "500"))
+# Items per /translate-batch request; the whole batch runs on one translate slot
+TRANSLATE_BATCH_MAX = int(os.getenv("TRANSLATE_BATCH_MAX", "100"))
+# Deletions remembered per book for /sync; a device further behind gets a full resync
+SYNC_TOMBSTONES_MAX = int(os.getenv("SYNC_TOMBSTONES_MAX", "500"))
+# Times /sync re-reads a book that changed between validating a batch and applying it
+SYNC_RETRIES = 3
 
 # Dependency
-async def get_current_user(token: str = Depends(oauth2_scheme)) -> str:
-    user = await get_user(token)
-    if not user:
-        return {"status: -1", "message: Invalid User"}
-    return token
+async def get_current_session(token: str = Depends(oauth2_scheme)) -> dict:
+    claims = sessions.verify(token)
+    if claims is None or revocations.is_revoked(claims):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid or expired session",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return claims
+
+async def get_current_user(claims: dict = Depends(get_current_session)) -> str:
+    return claims["sub"]
+
+async def revoke(entry: dict):
+    entry["expireAt"] = datetime.fromtimestamp(entry["expires"], timezone.utc)
+    await db.revocations.insert_one(entry)
+
+async def refresh_revocations():
+    # picks up logouts and password changes made through other server processes
+    while True:
+        try:
+            revocations.load(await db.revocations.find({}, {"_id": 0}).to_list(None))
+        except Exception as e:
+            logger.warning("refreshing revocations failed", extra={"error": str(e)})
+        await asyncio.sleep(REVOCATION_REFRESH)
+
+async def run_storage_lifecycle():
+    while True:
+        try:
+            books, files = set(), set()
+            async for file_info in db.files.find({}, {"pathOnServer": 1, "cover": 1}):
+                if file_info.get("pathOnServer"):
+                    books.add(os.path.splitext(os.path.basename(file_info["pathOnServer"]))[0])
+                    files.add(file_info["pathOnServer"])
+                if file_info.get("cover"):
+                    files.add(file_info["cover"])
+            report = await asyncio.to_thread(lifecycle.sweep, books, files, await ingestion_queue.active_books())
+            logger.info("storage sweep", extra=report)
+        except Exception as e:
+            logger.warning("storage sweep failed", extra={"error": str(e)})
+        await asyncio.sleep(LIFECYCLE_INTERVAL)
 
 async def initialize_database():
-    print("Initializing the database...")
+    logger.info("initializing the database")
+    await db.users.create_index([("username", ASCENDING)], unique=True)
+    await db.files.create_index([("username", ASCENDING), ("identifier", ASCENDING)])
+    # /summarize and /search look books up by identifier alone
+    await db.files.create_index([("identifier", ASCENDING)])
+    # /files pages through a user's library in _id order
+    await db.files.create_index([("username", ASCENDING), ("_id", ASCENDING)])
+    # revocations are only needed until the tokens they cover expire
+    await db.revocations.create_index([("expireAt", ASCENDING)], expireAfterSeconds=0)
+    # one queued or running ingestion job per book, across workers; finished jobs expire
+    await db.ingestion_jobs.create_index([("active", ASCENDING)], unique=True, sparse=True)
+    await db.ingestion_jobs.create_index([("expireAt", ASCENDING)], expireAfterSeconds=0)
 
 async def cleanup_resources():
-    print("Cleaning up resources...")
+    logger.info("cleaning up resources")
+    await ingestion_queue.stop()
+    await prefetcher.stop()
+    for pool in (search_pool, summarize_pool, translate_pool):
+        pool.shutdown()
+    library_executor.shutdown(wait=False, cancel_futures=True)
+
+@app.middleware("http")
+async def record_latency(request: Request, call_next):
+    started = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        # label by route template, not the raw path, to keep the series bounded
+        route = request.scope.get("route")
+        REQUEST_LATENCY.labels(request.method, getattr(route, "path", "unmatched"), str(status_code)).observe(
+            time.perf_counter() - started)
+
+@app.get("/metrics")
+async def getMetrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+register_stats("cache", {"search": query_engines.stats, "keyword": keyword_indexes.stats,
+                         "summary": summary_cache.stats, "translation": lambda: get_translator().stats(),
+                         "embedding": embed_model.stats, "epub": epub_archives.stats})
+register_stats("admission", {"search": search_pool.stats, "summarize": summarize_pool.stats,
+                             "translate": translate_pool.stats})
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded):
+    return JSONResponse(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        content={"status": -1, "msg": f"Server busy, retry in {exc.retry_after}s"},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
 
 # Endpoints
 @app.post("/register")
@@ -121,7 +336,15 @@ async def login(
     username = await authenticate_user(form_data.username, form_data.password)
     if not username:
         return {"status": -1, "msg": "Wrong username/ password"}
-    return {"status": 0, "msg": "Login successfully", "access_token": username}
+    return {"status": 0, "msg": "Login successfully", "access_token": sessions.issue(username)}
+
+@app.post("/logout")
+async def logout(
+    claims: dict = Depends(get_current_session)
+):
+    revocations.revoke_token(claims["jti"], claims["exp"])
+    await revoke(revocations.entry_for_token(claims))
+    return {"status": 0, "msg": "Logged out"}
 
 
 
@@ -137,25 +360,65 @@ async def change_password(
     
     hashed_password = await hash_password(new_password)
     await db.users.update_one({"username": username}, {"$set": {"hashed_password": hashed_password}})
-    return {"status": 0, "msg": "Password changed successfully"}
+    # sign out every existing session, then hand this client a fresh token
+    now = datetime.now(timezone.utc).timestamp()
+    revocations.revoke_user(username, now)
+    await revoke(revocations.entry_for_user(username, now))
+    return {"status": 0, "msg": "Password changed successfully", "access_token": sessions.issue(username)}
+
 
 
+# Stored files are content-addressed: uploads/<sha256><ext>, so identical books are kept once
+UPLOAD_EXTENSIONS = (".epub", ".jpg", ".jpeg", ".png", ".webp", ".gif")
+SHA256_PATTERN = re.compile(r"[0-9a-f]{64}")
+
+def content_path(sha256: str, ext: str) -> str:
+    # both parts may come from the client: anything else could name a file outside the store
+    sha256, ext = sha256.lower(), ext.lower()
+    if not SHA256_PATTERN.fullmatch(sha256) or ext not in UPLOAD_EXTENSIONS:
+        raise ValueError("invalid sha256 or file extension")
+    return os.path.join(UPLOAD_DIR, f"{sha256}{ext}")
+
+def _write_chunk(buffer, digest, chunk: bytes):
+    digest.update(chunk)
+    buffer.write(chunk)
+
+@app.get("/upload/exists")
+async def upload_exists(
+    sha256: str,
+    ext: str = ".epub"
+):
+    try:
+        file_path = content_path(sha256, ext)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if os.path.exists(file_path):
+        return {"status": 0, "msg": file_path}
+    return {"status": -1, "msg": "File not found"}
 
 @app.post("/upload")
 async def upload_file(
     file: UploadFile
 ):
-    file_path  = os.path.join(UPLOAD_DIR, file.filename)
-    print(f"filepath is {file_path}")
-    if os.path.exists(file_path):
-        return {"status": -2, "msg": file_path}
-    #cover_path = os.path.join(UPLOAD_DIR, cover.filename)
+    if lifecycle.over_global_quota():
+        return {"status": -1, "msg": "Server storage is full"}
+    ext = os.path.splitext(file.filename or "")[1].lower()
+    if ext not in UPLOAD_EXTENSIONS:
+        raise HTTPException(status_code=422, detail=f"file type must be one of {', '.join(UPLOAD_EXTENSIONS)}")
+    tmp_path = os.path.join(UPLOAD_DIR, f".{uuid4().hex}.part")
+    digest = hashlib.sha256()
     try:
-        # Save the uploaded `file` to the server directory
-        file_content = await file.read()  # Read the file content once
-        with open(file_path, "wb") as buffer:
-            buffer.write(file_content)
-        print("success write file")
+        # Stream the uploaded `file` to disk, hashing it on the way
+        with open(tmp_path, "wb") as buffer:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                await asyncio.to_thread(_write_chunk, buffer, digest, chunk)
+        file_path = content_path(digest.hexdigest(), ext)
+        if os.path.exists(file_path):
+            os.remove(tmp_path)
+            return {"status": -2, "msg": file_path}
+        os.replace(tmp_path, file_path)
+        lifecycle.add_usage(os.path.getsize(file_path))
+        logger.info("stored upload", extra={"path": file_path})
         
         return {
             "status": 0,
@@ -163,9 +426,9 @@ async def upload_file(
         }
         
     except Exception as e:
-        # Delete file if database operation fails
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        # Delete the partial file if writing fails
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
         return {"status":-1, "msg": str(e)}
 
 @app.post("/upload-info")
@@ -174,37 +437,157 @@ async def uploadInfo(
     current_user: str = Depends(get_current_user)               
 ):
     fileInfo.username = current_user
-    print("fileInfo upto server")
-    print(fileInfo)
     file_data = fileInfo.dict()
-    print("data insert to database")
-    print(file_data)
+
+    if lifecycle.user_quota:
+        owned = await db.files.find({"username": current_user}, {"pathOnServer": 1, "cover": 1}).to_list(None)
+        owned.append(file_data)
+        books = {os.path.splitext(os.path.basename(f["pathOnServer"]))[0]: f["pathOnServer"]
+                 for f in owned if f.get("pathOnServer")}
+        used = await asyncio.to_thread(lifecycle.usage, books, [f["cover"] for f in owned if f.get("cover")])
+        if used > lifecycle.user_quota:
+            return {"status": -1, "msg": "Storage quota exceeded"}
 
     # Insert file information into the database
     await db.files.insert_one(file_data)
-    print("success insert data")
+    logger.debug("inserted file info", extra={"identifier": fileInfo.identifier, "path": fileInfo.pathOnServer})
 
     filePath = fileInfo.pathOnServer
     fileName = os.path.splitext(os.path.basename(filePath))[0]
 
-    load_and_storage(fileName)
-    print(f"load_and_storage from fileName: {fileName}")
-    dic = getDicOfChapterContent(filePath)
-    for key in dic.items():
-        print (key)
-    bookContent[fileName] = dic
-    
-    return {"status": 0, "msg": "insert file info success"}
+    # The same book (same content hash) is being ingested for another upload; wait on that job
+    active = await ingestion_queue.active_job(fileName)
+    if active is not None:
+        if active["owner"] != current_user:
+            await ingestion_queue.watch(active["id"], current_user)
+        logger.info("joined ingestion job", extra={"job": active["id"], "book": fileName})
+        return {"status": 0, "msg": "insert file info success", "job_id": active["id"]}
+
+    # ... or was already ingested; reuse it
+    if chapter_store.has_book(fileName) and (has_index(fileName) or lifecycle.is_cold(fileName)):
+        return {"status": 0, "msg": "insert file info success", "job_id": None}
+
+    # another worker may have queued the book meanwhile; then this returns its job
+    job = await ingestion_queue.submit(ingestion_stages(fileName, filePath), owner=current_user, book=fileName)
+    if job["owner"] != current_user:
+        await ingestion_queue.watch(job["id"], current_user)
+    logger.info("queued ingestion job", extra={"job": job["id"], "book": fileName})
+
+    return {"status": 0, "msg": "insert file info success", "job_id": job["id"]}
+
+def ingestion_stages(fileName: str, filePath: str):
+    def parse(ctx: dict):
+        ctx["documents"] = load_documents(fileName)
+
+    def extract_chapters(ctx: dict):
+        chapter_store.save_book(fileName, iterChapters(filePath))
+
+    def embed(ctx: dict):
+        with embed_model.tracking() as embedding_stats:
+            ctx["index"] = build_index(ctx["documents"])
+        ctx["report"]["embedding_cache"] = embedding_stats
+
+    def persist(ctx: dict):
+        persist_index(ctx["index"], fileName)
+
+    def index_keywords(ctx: dict):
+        chapters = ((title, chapter_store.get_chapter(fileName, title)) for title in chapter_store.chapters(fileName))
+        persist_keyword_index(ctx["index"], fileName, chapters)
+
+    return [
+        ("parsed", parse),
+        ("chapters_extracted", extract_chapters),
+        ("embedded", embed),
+        ("persisted", persist),
+        ("keywords_indexed", index_keywords),
+    ]
+
+async def restore_index(fileName: str) -> bool:
+    # one restore per book at a time; later callers find it done
+    lock = index_restores.setdefault(fileName, asyncio.Lock())
+    async with lock:
+        if has_index(fileName):
+            return True
+        return await asyncio.to_thread(lifecycle.restore, fileName)
+
+async def ensure_index(fileName: str, filePath: str) -> Optional[str]:
+    # None once the book's index is on disk; otherwise the id of the job (re)building it,
+    # for books whose index was evicted without an archive or never finished building
+    if has_index(fileName) or await restore_index(fileName):
+        lifecycle.touch(fileName)
+        return None
+    job = await ingestion_queue.active_job(fileName)
+    if job is None:
+        # the chapters, and the summaries made from them, are kept
+        stages = [stage for stage in ingestion_stages(fileName, filePath)
+                  if stage[0] != "chapters_extracted" or not chapter_store.has_book(fileName)]
+        job = await ingestion_queue.submit(stages, book=fileName)
+        logger.info("queued index rebuild", extra={"job": job["id"], "book": fileName})
+    return job["id"]
+
+@app.get("/jobs/{job_id}")
+async def get_job(
+    job_id: str,
+    current_user: str = Depends(get_current_user)
+):
+    job = await ingestion_queue.get(job_id)
+    if not job or not (job["owner"] == current_user or current_user in job["watchers"]
+                       or await has_book(current_user, job["book"])):
+        return {"status": -1, "msg": "Job not found"}
+    return {"status": 0, "msg": {key: value for key, value in job.items() if key not in ("owner", "watchers")}}
+
+async def has_book(username: str, book: Optional[str]) -> bool:
+    # rebuilds of evicted indexes have no owner: anyone whose library holds the book may follow them
+    if not book:
+        return False
+    async for file_info in db.files.find({"username": username}, {"pathOnServer": 1}):
+        if file_info.get("pathOnServer") and os.path.splitext(os.path.basename(file_info["pathOnServer"]))[0] == book:
+            return True
+    return False
 
 @app.get("/files", response_model=list[FileInfo])
 async def list_files(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=FILES_PAGE_MAX),
+    after: Optional[str] = None,
+    lite: bool = False,
     current_user: str = Depends(get_current_user)
 ):
-    user_files = await db.files.find({"username": current_user}).to_list(None)
-    # for file in user_files:
-    #     if file
+    # Pages are ordered by _id; pass the X-Next-Cursor header back as `after` for the next page.
+    # `lite` leaves out bookmarks and highlights.
+    query = {"username": current_user}
+    if after:
+        try:
+            query["_id"] = {"$gt": ObjectId(after)}
+        except InvalidId:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    projection = {"bookmarks": 0, "highlights": 0} if lite else None
+    cursor = db.files.find(query, projection).sort("_id", ASCENDING)
+    if limit:
+        cursor = cursor.limit(limit)
+    user_files = await cursor.to_list(None)
+    if limit and len(user_files) == limit:
+        response.headers["X-Next-Cursor"] = str(user_files[-1]["_id"])
     return [FileInfo(**file) for file in user_files]
 
+@app.get("/files/manifest")
+async def files_manifest(
+    request: Request,
+    current_user: str = Depends(get_current_user)
+):
+    # Every change to a book bumps its rev, so the (identifier, rev) list tells a client which
+    # books to refetch; send the ETag back as If-None-Match to get a bodyless 304 when none did.
+    books = await db.files.find({"username": current_user}, {"identifier": 1, "rev": 1}).sort("_id", ASCENDING).to_list(None)
+    digest = hashlib.sha256()
+    for book in books:
+        # _id tells a re-added book apart from the deleted one it replaces
+        digest.update(f"{book['_id']}:{book.get('identifier')}:{book.get('rev', 0)}\n".encode("utf-8"))
+    etag = f'"{digest.hexdigest()[:32]}"'
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    manifest = [{"identifier": book.get("identifier"), "rev": book.get("rev", 0)} for book in books]
+    return JSONResponse({"status": 0, "msg": {"etag": etag, "books": manifest}}, headers={"ETag": etag})
+
 
 
 
@@ -227,15 +610,186 @@ async def update_file(
     current_user: str = Depends(get_current_user)
 ):
     update_data.username = current_user
-    update_data_fomarted = update_data.dict()
-    result = await db.files.update_one({"username": current_user, "identifier": update_data.identifier}, {"$set": update_data_fomarted})
+    # rev is a server-side counter: every change bumps it, for /sync and /files/manifest.
+    # Bookmarks and highlights only change through /sync, which versions each item.
+    update_data_fomarted = update_data.dict(exclude={"rev", "bookmarks", "highlights"})
+    result = await db.files.update_one({"username": current_user, "identifier": update_data.identifier},
+                                       {"$set": update_data_fomarted, "$inc": {"rev": 1}})
     if result.matched_count == 0:
         return {"status": -1, "msg": "File not found"}
-    
+    if update_data.progression and update_data.pathOnServer:
+        fileName = os.path.splitext(os.path.basename(update_data.pathOnServer))[0]
+        await prefetcher.note_progress(fileName, update_data.progression)
+
     return {"status": 0, "msg": "File info updated"}
 
+@app.post("/files/bulk")
+async def bulk_upsert_files(
+    files: List[FileInfo],
+    current_user: str = Depends(get_current_user)
+):
+    # Applies many /update-file changes (or new records) in one round trip; returns the new revs
+    if len(files) > FILES_BULK_MAX:
+        return {"status": -1, "msg": f"At most {FILES_BULK_MAX} files per request"}
+    if any(not fileInfo.identifier for fileInfo in files):
+        return {"status": -1, "msg": "Every file needs an identifier"}
+    if not files:
+        return {"status": 0, "msg": {"matched": 0, "upserted": 0, "books": []}}
+
+    # the last record for an identifier wins; two upserts of one new book would insert it twice
+    files = list({fileInfo.identifier: fileInfo for fileInfo in files}.values())
+    requests = []
+    for fileInfo in files:
+        fileInfo.username = current_user
+        # annotations of existing books only change through /sync; a new book starts with the
+        # ones sent here, at rev 1 like the book itself
+        annotations = {field: [{**item.dict(exclude_none=True), "itemId": item.itemId or uuid4().hex, "rev": 1}
+                               for item in getattr(fileInfo, field)]
+                       for field, _ in SYNC_KINDS.values()}
+        requests.append(UpdateOne({"username": current_user, "identifier": fileInfo.identifier},
+                                  {"$set": fileInfo.dict(exclude={"rev", "bookmarks", "highlights"}),
+                                   "$setOnInsert": annotations, "$inc": {"rev": 1}}, upsert=True))
+    try:
+        result = await db.files.bulk_write(requests, ordered=False)
+    except BulkWriteError as e:
+        logger.error("bulk upsert failed", extra={"user": current_user, "error": str(e.details)})
+        return {"status": -1, "msg": "Bulk update failed"}
+
+    for fileInfo in files:
+        if fileInfo.progression and fileInfo.pathOnServer:
+            fileName = os.path.splitext(os.path.basename(fileInfo.pathOnServer))[0]
+            await prefetcher.note_progress(fileName, fileInfo.progression)
+    books = await db.files.find({"username": current_user, "identifier": {"$in": [fileInfo.identifier for fileInfo in files]}},
+                                {"_id": 0, "identifier": 1, "rev": 1}).to_list(None)
+    return {"status": 0, "msg": {"matched": result.matched_count, "upserted": result.upserted_count, "books": books}}
+
+
+
+
+# Annotation kinds accepted by /sync, with the FileInfo array and model holding them
+SYNC_KINDS = {"bookmark": ("bookmarks", BookMark), "highlight": ("highlights", HighLight)}
+
+class SyncConflict(Exception):
+    """An update or delete of an item the book doesn't have."""
 
+def sync_apply(book: dict, op: SyncOp, rev: int):
+    # Applies `op`, stamped with `rev`, to `book`'s annotation arrays and tombstones in memory;
+    # raises ValueError / ValidationError for an invalid op, SyncConflict for a missing item.
+    # Items are stored as their model validated them, so a bad value can't make the book unreadable.
+    field, model = SYNC_KINDS[op.kind]
+    items = book[field]
+    index = next((i for i, item in enumerate(items) if item.get("itemId") == op.itemId), None)
+    if op.op == "add":
+        item = model(**{**op.item, "itemId": op.itemId, "rev": rev}).dict(exclude_none=True)
+        # re-adding an item (e.g. a retried batch) replaces it instead of duplicating it
+        if index is not None:
+            del items[index]
+        items.append(item)
+    elif op.op == "update":
+        unknown = (set(op.item) - set(model.__fields__)) | (set(op.item) & {"itemId", "rev"})
+        if unknown:
+            raise ValueError(f"cannot update {', '.join(sorted(unknown))}")
+        if index is None:
+            raise SyncConflict(f"{op.kind} {op.itemId} not found")
+        items[index] = model(**{**items[index], **op.item, "rev": rev}).dict(exclude_none=True)
+    elif op.op == "delete":
+        if index is None:
+            raise SyncConflict(f"{op.kind} {op.itemId} not found")
+        del items[index]
+        # a tombstone lets /sync?since=N report the deletion to other devices
+        book["tombstones"].append({"kind": op.kind, "itemId": op.itemId, "rev": rev})
+    else:
+        raise ValueError(f"unknown op {op.op}")
 
+def sync_error(status_code: int, msg: str) -> JSONResponse:
+    return JSONResponse(status_code=status_code, content={"status": -1, "msg": msg})
+
+@app.post("/sync")
+async def sync_annotations(
+    batch: SyncBatch,
+    current_user: str = Depends(get_current_user)
+):
+    for op in batch.ops:
+        if op.kind not in SYNC_KINDS:
+            return {"status": -1, "msg": f"Unknown kind {op.kind}"}
+        if op.op == "add" and not op.itemId:
+            op.itemId = uuid4().hex
+        elif not op.itemId:
+            return {"status": -1, "msg": f"{op.op} needs an itemId"}
+
+    fields = [field for field, _ in SYNC_KINDS.values()] + ["tombstones"]
+    query = {"username": current_user, "identifier": batch.identifier}
+    for _ in range(SYNC_RETRIES):
+        current = await db.files.find_one(query, {"rev": 1, "pathOnServer": 1, **{field: 1 for field in fields}})
+        if not current:
+            return {"status": -1, "msg": "File not found"}
+        # the batch gets revisions (rev, rev + len(ops)], applied to the book as it is now
+        rev = current.get("rev", 0)
+        book = {field: current.get(field) or [] for field in fields}
+        try:
+            for i, op in enumerate(batch.ops):
+                sync_apply(book, op, rev + i + 1)
+        except (ValueError, ValidationError) as e:
+            return sync_error(status.HTTP_422_UNPROCESSABLE_ENTITY, str(e))
+        except SyncConflict as e:
+            return sync_error(status.HTTP_409_CONFLICT, str(e))
+        book["tombstones"] = book["tombstones"][-SYNC_TOMBSTONES_MAX:]
+
+        # items and the new rev are written together, and only over the book that was read:
+        # every change to a book bumps rev, so a reader never sees a rev without its items
+        seen_rev = {"rev": rev} if "rev" in current else {"rev": {"$exists": False}}
+        result = await db.files.update_one({"_id": current["_id"], **seen_rev},
+                                           {"$set": {**book, "rev": rev + len(batch.ops)}})
+        if result.matched_count:
+            break
+    else:
+        return sync_error(status.HTTP_409_CONFLICT, "Book is changing, retry the sync")
+    applied = [{"itemId": op.itemId, "rev": rev + i + 1} for i, op in enumerate(batch.ops)]
+
+    # a new highlight is the freshest hint of where the reader is
+    progressions = [parse_progression(op.item.get("totalProgression"))
+                    for op in batch.ops if op.op == "add" and op.kind == "highlight"]
+    progressions = [p for p in progressions if p is not None]
+    if progressions and current.get("pathOnServer"):
+        fileName = os.path.splitext(os.path.basename(current["pathOnServer"]))[0]
+        await prefetcher.note_progress(fileName, max(progressions))
+    return {"status": 0, "msg": {"rev": rev + len(batch.ops), "items": applied}}
+
+@app.get("/sync")
+async def sync_changes(
+    identifier: str,
+    since: int = 0,
+    current_user: str = Depends(get_current_user)
+):
+    # filter the arrays inside MongoDB so only changed items leave the server
+    def changed(field: str, since: int):
+        return {"$filter": {"input": {"$ifNull": [f"${field}", []]}, "as": "item",
+                            "cond": {"$gt": [{"$ifNull": ["$$item.rev", 0]}, since]}}}
+
+    def pipeline(since: int):
+        return [
+            {"$match": {"username": current_user, "identifier": identifier}},
+            {"$limit": 1},
+            {"$project": {"_id": 0, "rev": {"$ifNull": ["$rev", 0]}, "bookmarks": changed("bookmarks", since),
+                          "highlights": changed("highlights", since), "deleted": changed("tombstones", since),
+                          "tombstones": {"$size": {"$ifNull": ["$tombstones", []]}},
+                          "oldestTombstone": {"$ifNull": [{"$arrayElemAt": ["$tombstones.rev", 0]}, 0]}}},
+        ]
+
+    changes = await db.files.aggregate(pipeline(since)).to_list(1)
+    if not changes:
+        return {"status": -1, "msg": "File not found"}
+    changes = changes[0]
+    # a full tombstone list may have dropped deletions newer than `since`: send every item
+    # instead, with reset set so the client replaces its copy rather than merging
+    reset = since > 0 and changes["tombstones"] >= SYNC_TOMBSTONES_MAX and since < changes["oldestTombstone"] - 1
+    if reset:
+        changes = (await db.files.aggregate(pipeline(0)).to_list(1))[0]
+        changes["deleted"] = []
+    for key in ("tombstones", "oldestTombstone"):
+        changes.pop(key)
+    changes["reset"] = reset
+    return {"status": 0, "msg": changes}
 
 @app.delete("/delete")
 async def delete_file( 
@@ -246,43 +800,215 @@ async def delete_file(
     if not file_info:
         return {"status": -1, "msg":"File not found"}
         
-    # Delete the file from storage
-    if os.path.exists(file_info["pathOnServer"]):
-        os.remove(file_info["pathOnServer"])
-        print("deleted epub")
-    if os.path.exists(file_info["cover"]):
+    # Delete the file from storage, unless another library entry shares the same content
+    if file_info.get("pathOnServer") and os.path.exists(file_info["pathOnServer"]) and not await is_shared(file_info, "pathOnServer"):
+        epub_archives.forget(file_info["pathOnServer"])
+        fileName = os.path.splitext(os.path.basename(file_info["pathOnServer"]))[0]
+        # the upload together with its indexes, chapters and summaries
+        freed = await asyncio.to_thread(lifecycle.delete_book, fileName, file_info["pathOnServer"])
+        logger.info("deleted book", extra={"path": file_info["pathOnServer"], "bytes": freed})
+    if file_info.get("cover") and os.path.exists(file_info["cover"]) and not await is_shared(file_info, "cover"):
         os.remove(file_info["cover"])
-        print("deleted cover")
-    
+        logger.info("deleted cover", extra={"path": file_info["cover"]})
+
     # Delete the database entry
     await db.files.delete_one({"username": current_user, "identifier": identifier})
     
     return {"status": 0, "msg": "File deleted successfully"}
 
+async def is_shared(file_info: dict, field: str) -> bool:
+    other = await db.files.find_one({field: file_info[field], "_id": {"$ne": file_info["_id"]}})
+    return other is not None
+
+async def open_epub(idf: str):
+    file_info = await db.files.find_one({"identifier": idf}, {"pathOnServer": 1})
+    if not file_info or not file_info.get("pathOnServer"):
+        raise HTTPException(status_code=404, detail="File not found")
+    try:
+        return await asyncio.to_thread(epub_archives.get, file_info["pathOnServer"])
+    except (OSError, zipfile.BadZipFile):
+        raise HTTPException(status_code=404, detail="Not an EPUB")
+
+@app.get("/epub/{idf}")
+async def getEpubPackage(idf: str):
+    package = await open_epub(idf)
+    return {"status": 0, "msg": {"spine": package.spine, "cover": package.cover}}
+
+# One spine item, image or stylesheet of a stored EPUB, read through the zip's central
+# directory; `cover` and `spine/<n>` are aliases for the cover image and the n-th spine item
+@app.get("/epub/{idf}/{resource:path}")
+async def getEpubResource(idf: str, resource: str, request: Request):
+    package = await open_epub(idf)
+    info = package.resolve(resource)
+    if info is None or info.is_dir():
+        raise HTTPException(status_code=404, detail="Resource not found")
+
+    etag = resource_etag(package.path, info)
+    headers = {"ETag": etag, "Accept-Ranges": "bytes", "Cache-Control": "private, no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    byte_range = None
+    if_range = request.headers.get("if-range")
+    if if_range is None or if_range == etag:
+        try:
+            byte_range = parse_range(request.headers.get("range"), info.file_size)
+        except ValueError:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{info.file_size}"})
+    if byte_range is None:
+        start, end, status_code = 0, info.file_size - 1, 200
+    else:
+        (start, end), status_code = byte_range, 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{info.file_size}"
+    headers["Content-Length"] = str(end - start + 1)
+    # a sync iterator: Starlette drives it on its thread pool, one chunk at a time
+    return StreamingResponse(package.read(info, start, end), status_code=status_code,
+                             media_type=package.media_type(info), headers=headers)
+
 @app.get("/summarize")
 async def getSummarize(
     idf: str,
     chapterName: str
 ):
-    
-    print(f"chapterNAme ------ is {chapterName}")
+    logger.debug("summarize", extra={"identifier": idf, "chapter": chapterName})
     file_info = await db.files.find_one({"identifier": idf})
     if not file_info:
         return {"status": -1, "msg":"File not found"}
     fileInfo = FileInfo(**file_info)
     filePath = fileInfo.pathOnServer
     fileName = os.path.splitext(os.path.basename(filePath))[0]
-    content = bookContent[fileName]
-    chapter_content = content[chapterName]
-    print(f"chapter content is: {chapter_content}")
-    page_smrz  = content[f"{chapterName}_smrz"]
-    if (page_smrz is not None and len(page_smrz) > 10): 
-        return {"status": 0, "msg": page_smrz}
-    response = summarize(text=chapter_content, detail=0.75, verbose=True, model="gpt-4o-mini")
-    content[f"{chapterName}_smrz"] = response
-    print(f"summary: {response}")
+    response = await summarize_chapter(fileName, chapterName, admit=True)
+    if response is None:
+        return {"status": -1, "msg": "Chapter not found"}
+    logger.debug("summary ready", extra={"identifier": idf, "chapter": chapterName, "chars": len(response)})
     return {"status": 0, "msg": response}
 
+def cached_chapter_summary(fileName: str, chapterName: str):
+    # Returns (chapter text, ready summary or None); the text is None for an unknown chapter.
+    chapter_content = chapter_store.get_chapter(fileName, chapterName)
+    if chapter_content is None:
+        return None, None
+    page_smrz = chapter_store.get_summary(fileName, chapterName)
+    if (page_smrz is not None and len(page_smrz) > 10): 
+        return chapter_content, page_smrz
+    response = summary_cache.get(summary_key(chapter_content, **SUMMARY_PARAMS))
+    if response is not None:
+        chapter_store.set_summary(fileName, chapterName, response)
+    return chapter_content, response
+
+def store_chapter_summary(fileName: str, chapterName: str, chapter_content: str, response: str):
+    summary_cache.put(summary_key(chapter_content, **SUMMARY_PARAMS), response)
+    chapter_store.set_summary(fileName, chapterName, response)
+
+def summary_ready(fileName: str, chapterName: str) -> bool:
+    # an unknown chapter has nothing to prefetch either
+    chapter_content, response = cached_chapter_summary(fileName, chapterName)
+    return chapter_content is None or response is not None
+
+async def summarize_chapter(fileName: str, chapterName: str, admit: bool = False) -> Optional[str]:
+    # Ready summaries are returned without a slot; `admit` makes a new one wait for a
+    # summarize pool slot (interactive requests), background callers run outside the pool.
+    chapter_content, response = await summarize_pool.offload(cached_chapter_summary, fileName, chapterName)
+    if chapter_content is None or response is not None:
+        return response
+
+    async def compute():
+        if admit:
+            async with summarize_pool.admit():
+                response = await asummarize(text=chapter_content, verbose=True, **SUMMARY_PARAMS)
+        else:
+            response = await asummarize(text=chapter_content, verbose=True, **SUMMARY_PARAMS)
+        await summarize_pool.offload(store_chapter_summary, fileName, chapterName, chapter_content, response)
+        return response
+
+    # readers of the same chapter (in any book with the same text) wait for one summarize() run;
+    # it lands in the shared summary cache, where the other books' chapters pick it up
+    return await summary_flights.do(summary_key(chapter_content, **SUMMARY_PARAMS), compute)
+
+prefetcher = PrefetchScheduler(summarize_chapter, summary_ready, chapter_store.chapters, chapter_store.chapter_sizes,
+                               interactive_busy)
+register_stats("storage", {"lifecycle": lifecycle.stats})
+register_stats("prefetch", {"summaries": prefetcher.stats})
+register_stats("singleflight", {"summarize": summary_flights.stats, "search": search_flights.stats,
+                                "translate": translate_flights.stats})
+
+def sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+@app.get("/summarize-stream")
+async def getSummarizeStream(
+    idf: str,
+    chapterName: str
+):
+    file_info = await db.files.find_one({"identifier": idf})
+    if not file_info:
+        return {"status": -1, "msg":"File not found"}
+    fileName = os.path.splitext(os.path.basename(file_info["pathOnServer"]))[0]
+    chapter_content, response = await summarize_pool.offload(cached_chapter_summary, fileName, chapterName)
+    if chapter_content is None:
+        return {"status": -1, "msg": "Chapter not found"}
+    if response is not None:
+        return StreamingResponse(iter([sse("done", {"summary": response})]), media_type="text/event-stream",
+                                 headers=SSE_HEADERS)
+    # answer 429 before the response starts; the slot itself is taken inside the summarize run
+    summarize_pool.check()
+    partials = asyncio.Queue()
+
+    async def compute():
+        # runs in the singleflight task, so the slot is released however the streams end
+        partial_summaries = {}
+        async with summarize_pool.admit():
+            async for index, total, summary in asummarize_stream(text=chapter_content, **SUMMARY_PARAMS):
+                partial_summaries[index] = summary
+                partials.put_nowait({"index": index, "total": total, "summary": summary})
+        final_summary = "\n\n".join(partial_summaries[index] for index in sorted(partial_summaries))
+        await summarize_pool.offload(store_chapter_summary, fileName, chapterName, chapter_content, final_summary)
+        return final_summary
+
+    async def events():
+        # shares the run with /summarize and other streams of the same chapter text; a stream that
+        # joins a run already in flight gets only the final summary
+        flight = asyncio.ensure_future(summary_flights.do(summary_key(chapter_content, **SUMMARY_PARAMS), compute))
+        partial = None
+        try:
+            while not flight.done():
+                partial = asyncio.ensure_future(partials.get())
+                await asyncio.wait({flight, partial}, return_when=asyncio.FIRST_COMPLETED)
+                if partial.done():
+                    yield sse("partial", partial.result())
+                else:
+                    partial.cancel()
+            while not partials.empty():
+                yield sse("partial", partials.get_nowait())
+            try:
+                final_summary = flight.result()
+            except Overloaded as e:
+                yield sse("error", {"msg": f"Server busy, retry in {e.retry_after}s"})
+                return
+            yield sse("done", {"summary": final_summary})
+        finally:
+            # the run itself goes on for the other readers and the cache
+            flight.cancel()
+            if partial is not None:
+                partial.cancel()
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+@app.post("/summary-cache/warm")
+async def warmSummaryCache(
+    idf: str,
+    current_user: str = Depends(get_current_user)
+):
+    file_info = await db.files.find_one({"username": current_user, "identifier": idf})
+    if not file_info:
+        return {"status": -1, "msg":"File not found"}
+    fileName = os.path.splitext(os.path.basename(file_info["pathOnServer"]))[0]
+    # through the prefetcher, so warming shares its LLM budget and yields to interactive load
+    queued = await prefetcher.queue_book(fileName)
+    return {"status": 0, "msg": f"warming {queued} chapters"}
+
 @app.post("/translate")
 async def getTranslate(
     text: str,
@@ -291,31 +1017,164 @@ async def getTranslate(
     src_lang: str,
     des_lang: str
 ):
-    agent = ContextualLlamaTranslator()
-    response = agent.translate(before, text, after, src_lang, des_lang)
+    async def translate():
+        async with translate_pool.admit():
+            return await get_translator().atranslate(before, text, after, src_lang, des_lang)
+
+    key = flight_key(before, text, after, src_lang, des_lang)
+    response = await translate_flights.do(key, translate)
+    return {"status": 0, "msg": response}
+
+@app.post("/translate-batch")
+async def getTranslateBatch(
+    batch: TranslateBatch
+):
+    if len(batch.items) > TRANSLATE_BATCH_MAX:
+        raise HTTPException(status_code=422, detail=f"At most {TRANSLATE_BATCH_MAX} items per batch")
+    items = [(item.before, item.text, item.after) for item in batch.items]
+    async with translate_pool.admit():
+        response = await get_translator().translate_batch(items, batch.src_lang, batch.des_lang)
     return {"status": 0, "msg": response}
 
 @app.post("/search")
 async def getSearch(
     idf: str,
-    input: str
+    input: str,
+    mode: str = "llm",
+    top_k: int = Query(5, ge=1, le=50)
 ):
+    if mode not in SEARCH_MODES:
+        return {"status": -1, "msg": f"mode must be one of {', '.join(SEARCH_MODES)}"}
     file_info = await db.files.find_one({"identifier": idf})
     if not file_info:
         return {"status": -1, "msg":"File not found"}
     fileInfo = FileInfo(**file_info)
     filePath = fileInfo.pathOnServer
     fileName = os.path.splitext(os.path.basename(filePath))[0]
-    response = search(fileName=fileName, input=input)
+    job_id = await ensure_index(fileName, filePath)
+    if job_id:
+        return {"status": -1, "msg": "Index is being rebuilt", "job_id": job_id}
+    if mode == "keyword":
+        # milliseconds and no model calls: kept out of the search pool's queue
+        response = await asyncio.to_thread(retrieve, fileName, input, mode, top_k)
+    elif mode == "llm":
+        response = await search_flights.do(flight_key(fileName, mode, input),
+                                           lambda: search_pool.run(search, fileName, input))
+    else:
+        response = await search_flights.do(flight_key(fileName, mode, top_k, input),
+                                           lambda: search_pool.run(retrieve, fileName, input, mode, top_k))
     return {"status": 0, "msg": response}
 
-# Utility functions
-async def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+@app.post("/search-library")
+async def searchLibrary(
+    input: str,
+    mode: str = "hybrid",
+    top_k: int = Query(5, ge=1, le=50),
+    answer: bool = False,
+    current_user: str = Depends(get_current_user)
+):
+    if mode not in SEARCH_MODES or mode == "llm":
+        return {"status": -1, "msg": "mode must be one of keyword, vector, hybrid"}
+    # books stored once but listed several times share a shard
+    books = {}
+    async for file_info in db.files.find({"username": current_user}, {"identifier": 1, "filename": 1, "pathOnServer": 1}):
+        if file_info.get("pathOnServer"):
+            fileName = os.path.splitext(os.path.basename(file_info["pathOnServer"]))[0]
+            books.setdefault(fileName, []).append({"identifier": file_info["identifier"], "filename": file_info["filename"]})
+    fanout = asyncio.Semaphore(LIBRARY_SEARCH_FANOUT)
+    failed = []
+
+    async def available(fileName: str) -> bool:
+        # indexes moved to cold storage come back, LIBRARY_SEARCH_FANOUT at a time
+        if has_index(fileName):
+            return True
+        async with fanout:
+            return await restore_index(fileName)
+
+    restored = await asyncio.gather(*(available(fileName) for fileName in books), return_exceptions=True)
+    indexed = []
+    for fileName, ok in zip(list(books), restored):
+        if isinstance(ok, Exception):
+            logger.warning("library search restore failed", extra={"book": fileName, "error": str(ok)})
+            failed.extend(book["identifier"] for book in books[fileName])
+        elif ok:
+            # books with no index are left out
+            indexed.append(fileName)
+            lifecycle.touch(fileName)
+
+    async with search_pool.admit():
+        loop = asyncio.get_running_loop()
+        # embed the query once for every shard
+        query_embedding = None
+        if mode != "keyword":
+            query_embedding = await loop.run_in_executor(library_executor, embed_model.get_query_embedding, input)
+
+        async def shard(fileName: str):
+            async with fanout:
+                return await loop.run_in_executor(library_executor, retrieve_rankings, fileName, input, mode,
+                                                  candidates(mode, top_k), query_embedding, True)
+
+        shards = await asyncio.gather(*(shard(fileName) for fileName in indexed), return_exceptions=True)
+        rankings = {}
+        for fileName, ranking in zip(indexed, shards):
+            if isinstance(ranking, Exception):
+                logger.warning("library search shard failed", extra={"book": fileName, "error": str(ranking)})
+                failed.extend(book["identifier"] for book in books[fileName])
+                continue
+            rankings[fileName] = ranking
+        results = [{"text": passage["text"], "score": score, "metadata": passage["metadata"], "books": books[fileName]}
+                   for fileName, passage, score in merge_rankings(rankings, top_k)]
+        response = None
+        if answer and results:
+            response = await search_pool.offload(synthesize, input, results)
+    return {"status": 0, "msg": {"results": results, "answer": response, "searched": len(indexed), "failed": failed}}
+
+@app.post("/search-stream")
+async def getSearchStream(
+    idf: str,
+    input: str
+):
+    file_info = await db.files.find_one({"identifier": idf})
+    if not file_info:
+        return {"status": -1, "msg":"File not found"}
+    fileName = os.path.splitext(os.path.basename(file_info["pathOnServer"]))[0]
+    job_id = await ensure_index(fileName, file_info["pathOnServer"])
+    if job_id:
+        return {"status": -1, "msg": "Index is being rebuilt", "job_id": job_id}
 
-async def verify_password(password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(password, hashed_password)
+    # answer 429 before the response starts; the slot is only taken once the body is being sent,
+    # so a client that goes away before that never holds one
+    search_pool.check()
 
+    async def events():
+        # search_stream blocks between tokens, so it is driven on the search pool's threads;
+        # iterate releases the slot when the stream ends or the client goes away
+        try:
+            started = await search_pool.acquire()
+        except Overloaded as e:
+            yield sse("error", {"msg": f"Server busy, retry in {e.retry_after}s"})
+            return
+        answer = []
+        tokens = search_pool.iterate(search_stream(fileName=fileName, input=input), started)
+        try:
+            async for event, data in tokens:
+                if event == "token":
+                    answer.append(data)
+                yield sse(event, data)
+        finally:
+            # closing this stream doesn't close the inner one, which holds the slot
+            await tokens.aclose()
+        yield sse("done", {"answer": "".join(answer)})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+@app.get("/cache-stats")
+async def getCacheStats():
+    return {"status": 0, "msg": {"search": query_engines.stats(), "summary": summary_cache.stats(),
+                                   "translation": get_translator().stats(),
+                                   "embedding": embed_model.stats()}}
+
+# Utility functions
 async def get_user(username: str) -> UserCreate:
     return await db.users.find_one({"username": username})
 
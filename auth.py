@@ -0,0 +1,161 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Optional
+
+from passlib.context import CryptContext
+
+logger = logging.getLogger(__name__)
+
+
+# bcrypt is deliberately slow (~100-300 ms); it runs on its own small pool so logins
+# neither block the event loop nor starve the default executor
+BCRYPT_WORKERS = int(os.getenv("BCRYPT_WORKERS", "2"))
+# HMAC key for session tokens; when unset, one is generated once and kept in
+# SESSION_SECRET_PATH, so every worker (and restart) of this host signs with the same key
+SESSION_SECRET = os.getenv("SESSION_SECRET", "")
+SESSION_SECRET_PATH = os.getenv("SESSION_SECRET_PATH", "data/session_secret")
+SESSION_TTL = int(os.getenv("SESSION_TTL", str(30 * 24 * 3600)))
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+_bcrypt_pool = ThreadPoolExecutor(max_workers=BCRYPT_WORKERS, thread_name_prefix="bcrypt")
+
+
+async def hash_password(password: str) -> str:
+    return await asyncio.get_running_loop().run_in_executor(_bcrypt_pool, pwd_context.hash, password)
+
+
+async def verify_password(password: str, hashed_password: str) -> bool:
+    return await asyncio.get_running_loop().run_in_executor(
+        _bcrypt_pool, pwd_context.verify, password, hashed_password
+    )
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def load_session_secret(path: str = SESSION_SECRET_PATH) -> str:
+    """The key stored at `path`, generated on first use; safe for workers starting together."""
+    try:
+        with open(path, encoding="ascii") as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        pass
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    staging = f"{path}.{os.getpid()}.tmp"
+    fd = os.open(staging, os.O_CREAT | os.O_TRUNC | os.O_WRONLY, 0o600)
+    with os.fdopen(fd, "w", encoding="ascii") as f:
+        f.write(secrets.token_hex(32))
+    try:
+        # link, unlike replace, fails if another worker got there first: everyone keeps the first key
+        os.link(staging, path)
+        logger.info("generated session secret", extra={"path": path})
+    except FileExistsError:
+        pass
+    finally:
+        os.remove(staging)
+    with open(path, encoding="ascii") as f:
+        return f.read().strip()
+
+
+class SessionTokens:
+    """Signed, expiring session tokens: base64url(claims) + "." + base64url(HMAC-SHA256).
+
+    Claims are {"sub": username, "iat": issued, "exp": expires, "jti": token id}.
+    Verifying a token needs no database round trip.
+    """
+
+    def __init__(self, secret: str = SESSION_SECRET, ttl: int = SESSION_TTL):
+        if not secret:
+            secret = load_session_secret()
+            if not secret:
+                raise RuntimeError(f"session secret file {SESSION_SECRET_PATH} is empty; set SESSION_SECRET")
+        self._key = secret.encode("utf-8")
+        self.ttl = ttl
+
+    def _sign(self, payload: str) -> str:
+        return _b64encode(hmac.new(self._key, payload.encode("ascii"), hashlib.sha256).digest())
+
+    def issue(self, username: str) -> str:
+        now = time.time()
+        claims = {"sub": username, "iat": now, "exp": now + self.ttl, "jti": secrets.token_hex(8)}
+        payload = _b64encode(json.dumps(claims, separators=(",", ":")).encode("utf-8"))
+        return f"{payload}.{self._sign(payload)}"
+
+    def verify(self, token: str) -> Optional[dict]:
+        """Claims of a well-formed, correctly signed, unexpired token; None otherwise."""
+        payload, _, signature = token.partition(".")
+        if not payload or not signature:
+            return None
+        try:
+            if not hmac.compare_digest(signature, self._sign(payload)):
+                return None
+            claims = json.loads(_b64decode(payload))
+        except (ValueError, UnicodeError):
+            return None
+        if not isinstance(claims, dict) or claims.get("exp", 0) < time.time():
+            return None
+        return claims
+
+
+class RevocationCache:
+    """Revoked sessions, kept in memory so checking a token stays a dict lookup.
+
+    Two kinds of entries: a single token (by jti, e.g. on logout) and every
+    token of a user issued before a point in time (e.g. after a password
+    change). Entries are dropped once the tokens they cover have expired.
+    """
+
+    def __init__(self, ttl: int = SESSION_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._tokens: Dict[str, float] = {}  # jti -> expiry of the token
+        self._users: Dict[str, float] = {}  # username -> tokens issued before this are revoked
+
+    def revoke_token(self, jti: str, expires: float):
+        with self._lock:
+            self._tokens[jti] = expires
+            self._prune()
+
+    def revoke_user(self, username: str, before: float):
+        with self._lock:
+            self._users[username] = max(before, self._users.get(username, 0.0))
+            self._prune()
+
+    def load(self, entries: Iterable[dict]):
+        """Merge entries as stored by `entry_for_token` / `entry_for_user`."""
+        for entry in entries:
+            if entry.get("jti"):
+                self.revoke_token(entry["jti"], entry["expires"])
+            else:
+                self.revoke_user(entry["username"], entry["before"])
+
+    def is_revoked(self, claims: dict) -> bool:
+        with self._lock:
+            return claims["jti"] in self._tokens or claims["iat"] < self._users.get(claims["sub"], 0.0)
+
+    def _prune(self):
+        now = time.time()
+        for jti in [jti for jti, expires in self._tokens.items() if expires < now]:
+            del self._tokens[jti]
+        for username in [name for name, before in self._users.items() if before + self.ttl < now]:
+            del self._users[username]
+
+    def entry_for_token(self, claims: dict) -> dict:
+        return {"jti": claims["jti"], "expires": claims["exp"]}
+
+    def entry_for_user(self, username: str, before: float) -> dict:
+        return {"username": username, "before": before, "expires": before + self.ttl}
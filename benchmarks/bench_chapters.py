@@ -0,0 +1,122 @@
+"""Micro-benchmark: chapter extraction in summary_text, old vs new.
+
+Run from the repository root:
+
+    python benchmarks/bench_chapters.py [--book book.epub] [--pages 1000] [--repeat 3]
+
+Without --book a PDF with a table of contents is generated, whose chapter
+titles share prefixes ("Chapter 1", "Chapter 10", ...) the way real books do.
+For the generated book the script checks that every page lands in the right
+chapter and reports how many pages the previous title-prefix scan
+mis-assigned. The previous implementation went through langchain's
+PyMuPDFLoader; it is emulated here with one document per page.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import pymupdf
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from summary_text import getDicOfChapterContent, iterChapters  # noqa: E402
+
+LINE = "The detective said nothing for a long while, then he asked about the letter."
+
+
+def make_book(path: str, pages: int = 1000, pages_per_chapter: int = 8):
+    doc = pymupdf.open()
+    toc = []
+    for n in range(pages):
+        chapter = n // pages_per_chapter + 1
+        page = doc.new_page()
+        lines = []
+        if n % pages_per_chapter == 0:
+            toc.append([1, f"Chapter {chapter}", n + 1])
+            lines.append(f"Chapter {chapter}")
+        lines.append(f"[page {n + 1}]")
+        lines.extend([LINE] * 40)
+        page.insert_text((50, 50), "\n".join(lines), fontsize=8)
+    doc.set_toc(toc)
+    doc.save(path)
+    doc.close()
+
+
+def legacy_chapters(filePath: str):
+    # The implementation this module replaced, with load_and_split() emulated page by page.
+    chapter_list = pymupdf.Document(filePath).get_toc()
+    with pymupdf.open(filePath) as doc:
+        documents = [page.get_text() for page in doc]
+
+    def check(long: str, short: str) -> bool:
+        l = long[:len(short) + 4]
+        for _s in short.split():
+            if _s not in l:
+                return False
+        return True
+
+    chapter_content = {}
+    current_document = 0
+    for i in range(len(chapter_list) - 1):
+        key = chapter_list[i][1]
+        nextKey = chapter_list[i + 1][1]
+        content = ""
+        while current_document < len(documents) and not check(documents[current_document], key):
+            current_document += 1
+        while current_document < len(documents) and not check(documents[current_document], nextKey):
+            content += documents[current_document]
+            current_document += 1
+        chapter_content[key] = content
+        chapter_content[f"{key}_smrz"] = ""
+    return chapter_content
+
+
+def misplaced_pages(chapters: dict, pages: int, pages_per_chapter: int) -> int:
+    wrong = 0
+    for n in range(pages):
+        key = f"Chapter {n // pages_per_chapter + 1}"
+        if f"[page {n + 1}]" not in chapters.get(key, ""):
+            wrong += 1
+    return wrong
+
+
+def best_of(repeat, fn, *args, **kwargs):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn(*args, **kwargs)
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--book", help="path to an EPUB/PDF; generated when omitted")
+    parser.add_argument("--pages", type=int, default=1000)
+    parser.add_argument("--pages-per-chapter", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.book
+        if path is None:
+            path = os.path.join(tmp, "book.pdf")
+            make_book(path, args.pages, args.pages_per_chapter)
+        with pymupdf.open(path) as doc:
+            print(f"book: {doc.page_count} pages, {len(doc.get_toc())} toc entries")
+
+        old_time, old = best_of(args.repeat, legacy_chapters, path)
+        new_time, new = best_of(args.repeat, getDicOfChapterContent, path)
+        stream_time, _ = best_of(args.repeat, lambda: sum(1 for _ in iterChapters(path)))
+        print(f"old {old_time * 1000:.1f} ms, new {new_time * 1000:.1f} ms "
+              f"(streamed {stream_time * 1000:.1f} ms), speedup {old_time / new_time:.1f}x")
+
+        if args.book is None:
+            assert misplaced_pages(new, args.pages, args.pages_per_chapter) == 0, "new extraction misplaced pages"
+            print(f"pages misplaced: old {misplaced_pages(old, args.pages, args.pages_per_chapter)}, new 0")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""Micro-benchmark: token-aware chunking in summarize_agent, old vs new.
+
+Run from the repository root:
+
+    python benchmarks/bench_chunker.py [--text chapter.txt] [--repeat 3]
+
+Without --text a long novel-like chapter is generated. The script checks that
+the new chunker returns exactly the same chunks, indices and dropped counts as
+the previous implementation before printing timings.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from summarize_agent import combine_chunks_with_no_minimum, tokenize  # noqa: E402
+
+WORDS = (
+    "anh ấy bước chậm qua con phố vắng khi trời đã tối hẳn và những ngọn đèn vàng "
+    "hắt bóng xuống mặt đường còn ướt sau cơn mưa chiều Kaga nhìn lại bản lời khai "
+    "một lần nữa rồi gấp cuốn sổ lại the detective said nothing for a long while "
+    "then he asked about the letter that nobody had seen since the night of the murder"
+).split()
+
+
+def make_chapter(sentences: int = 4000, seed: int = 7) -> str:
+    rng = random.Random(seed)
+    parts = []
+    for i in range(sentences):
+        sentence = " ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 40)))
+        if i % 50 == 49:
+            sentence += "\n\n"
+        parts.append(" " + sentence.capitalize())
+    # a few sentences that alone exceed the chunk size exercise the overflow path
+    for i in range(0, sentences, 997):
+        parts[i] = " " + " ".join(WORDS * 20)
+    return ".".join(parts)
+
+
+def legacy_combine_chunks_with_no_minimum(chunks, max_tokens, chunk_delimiter="\n\n", header=None,
+                                          add_ellipsis_for_overflow=False):
+    # The implementation this module replaced, kept verbatim as the reference.
+    dropped_chunk_count = 0
+    output = []
+    output_indices = []
+    candidate = [] if header is None else [header]
+    candidate_indices = []
+    for chunk_i, chunk in enumerate(chunks):
+        chunk_with_header = [chunk] if header is None else [header, chunk]
+        if len(tokenize(chunk_delimiter.join(chunk_with_header))) > max_tokens:
+            if (
+                    add_ellipsis_for_overflow
+                    and len(tokenize(chunk_delimiter.join(candidate + ["..."]))) <= max_tokens
+            ):
+                candidate.append("...")
+                dropped_chunk_count += 1
+            continue
+        extended_candidate_token_count = len(tokenize(chunk_delimiter.join(candidate + [chunk])))
+        if extended_candidate_token_count > max_tokens:
+            output.append(chunk_delimiter.join(candidate))
+            output_indices.append(candidate_indices)
+            candidate = chunk_with_header
+            candidate_indices = [chunk_i]
+        else:
+            candidate.append(chunk)
+            candidate_indices.append(chunk_i)
+    if (header is not None and len(candidate) > 1) or (header is None and len(candidate) > 0):
+        output.append(chunk_delimiter.join(candidate))
+        output_indices.append(candidate_indices)
+    return output, output_indices, dropped_chunk_count
+
+
+def best_of(repeat, fn, *args, **kwargs):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn(*args, **kwargs)
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--text", help="path to a UTF-8 chapter text; generated when omitted")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.text:
+        with open(args.text, encoding="utf-8") as f:
+            text = f.read()
+    else:
+        text = make_chapter()
+    chunks = text.split(".")
+    print(f"chapter: {len(text)} chars, {len(tokenize(text))} tokens, {len(chunks)} sentences")
+
+    cases = [
+        dict(max_tokens=500, chunk_delimiter=".", add_ellipsis_for_overflow=True),
+        dict(max_tokens=2000, chunk_delimiter=".", add_ellipsis_for_overflow=True),
+        dict(max_tokens=500, chunk_delimiter=".", header="Chapter summary"),
+    ]
+    for case in cases:
+        old_time, old = best_of(args.repeat, legacy_combine_chunks_with_no_minimum, chunks, **case)
+        new_time, new = best_of(args.repeat, combine_chunks_with_no_minimum, chunks, **case)
+        assert new == old, f"chunker output differs for {case}"
+        print(f"{case}: {len(new[0])} chunks, old {old_time * 1000:.1f} ms, "
+              f"new {new_time * 1000:.1f} ms, speedup {old_time / new_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+"""Offline load benchmark of the server with local stand-ins for OpenAI, embeddings and MongoDB.
+
+Run from the repository root (the server's own dependencies must be installed;
+OpenAI and MongoDB are not needed):
+
+    python benchmarks/bench_server.py --out bench.json
+    python benchmarks/bench_server.py --out new.json --compare bench.json
+
+Each endpoint (/upload-info ingestion, /search, /summarize, /translate and
+/files) is driven through the ASGI app by --concurrency clients. The report
+records throughput and p50/p99 latency per endpoint as JSON so runs of two
+versions can be compared. Latencies of the fake backends are configurable,
+so a run measures server overhead on top of a known backend cost.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+from typing import Awaitable, Callable, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+PARAGRAPH_WORDS = (
+    "Kaga đọc lại lời khai của Nonoguchi một lần nữa. Có điều gì đó không khớp trong cách anh ta kể "
+    "về buổi chiều hôm ấy. The detective closed the notebook and looked out at the rain. Nobody had "
+    "seen the letter since the night of the murder, yet everybody seemed to know what it said."
+).split()
+
+
+def make_epub(path: str, title: str, chapters: int = 12, paragraphs: int = 40, seed: int = 0):
+    """Write a small but valid EPUB 3 book with a navigation document and an NCX table of contents."""
+    rng = random.Random(seed)
+    names = [f"chapter{n:03d}.xhtml" for n in range(1, chapters + 1)]
+    with zipfile.ZipFile(path, "w") as book:
+        book.writestr("mimetype", "application/epub+zip", compress_type=zipfile.ZIP_STORED)
+        book.writestr("META-INF/container.xml", (
+            '<?xml version="1.0"?><container version="1.0" '
+            'xmlns="urn:oasis:names:tc:opendocument:xmlns:container"><rootfiles>'
+            '<rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/>'
+            '</rootfiles></container>'))
+        manifest = "".join(f'<item id="c{n}" href="{name}" media-type="application/xhtml+xml"/>'
+                           for n, name in enumerate(names))
+        spine = "".join(f'<itemref idref="c{n}"/>' for n in range(len(names)))
+        book.writestr("OEBPS/content.opf", (
+            '<?xml version="1.0" encoding="utf-8"?><package xmlns="http://www.idpf.org/2007/opf" '
+            'version="3.0" unique-identifier="uid"><metadata xmlns:dc="http://purl.org/dc/elements/1.1/">'
+            f'<dc:identifier id="uid">bench-{seed}</dc:identifier><dc:title>{title}</dc:title>'
+            '<dc:language>vi</dc:language></metadata><manifest>'
+            '<item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>'
+            '<item id="ncx" href="toc.ncx" media-type="application/x-dtbncx+xml"/>'
+            f'{manifest}</manifest><spine toc="ncx">{spine}</spine></package>'))
+        nav_points = "".join(
+            f'<navPoint id="p{n}" playOrder="{n + 1}"><navLabel><text>Chương {n + 1}</text></navLabel>'
+            f'<content src="{name}"/></navPoint>' for n, name in enumerate(names))
+        book.writestr("OEBPS/toc.ncx", (
+            '<?xml version="1.0" encoding="utf-8"?><ncx xmlns="http://www.daisy.org/z3986/2005/ncx/" '
+            f'version="2005-1"><head/><docTitle><text>{title}</text></docTitle><navMap>{nav_points}'
+            '</navMap></ncx>'))
+        nav_items = "".join(f'<li><a href="{name}">Chương {n + 1}</a></li>' for n, name in enumerate(names))
+        book.writestr("OEBPS/nav.xhtml", (
+            '<?xml version="1.0" encoding="utf-8"?><html xmlns="http://www.w3.org/1999/xhtml" '
+            'xmlns:epub="http://www.idpf.org/2007/ops"><head><title>toc</title></head><body>'
+            f'<nav epub:type="toc"><ol>{nav_items}</ol></nav></body></html>'))
+        for n, name in enumerate(names):
+            body = "".join(
+                "<p>" + " ".join(rng.choice(PARAGRAPH_WORDS) for _ in range(rng.randint(40, 120))) + "</p>"
+                for _ in range(paragraphs))
+            book.writestr(f"OEBPS/{name}", (
+                '<?xml version="1.0" encoding="utf-8"?><html xmlns="http://www.w3.org/1999/xhtml">'
+                f'<head><title>Chương {n + 1}</title></head><body><h1>Chương {n + 1}</h1>{body}</body></html>'))
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile; `q` in [0, 100]."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(1, math.ceil(q / 100 * len(ordered))) - 1]
+
+
+def summarize_latencies(latencies: List[float], errors: int, elapsed: float) -> dict:
+    return {
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "mean_ms": round(1000 * sum(latencies) / len(latencies), 2) if latencies else 0.0,
+        "p50_ms": round(1000 * percentile(latencies, 50), 2),
+        "p99_ms": round(1000 * percentile(latencies, 99), 2),
+    }
+
+
+async def load(request: Callable[[int], Awaitable[bool]], requests: int, concurrency: int) -> dict:
+    """Run `requests` calls of `request(i)` with `concurrency` callers; it returns False on error."""
+    latencies, errors = [], 0
+    counter = iter(range(requests))
+
+    async def caller():
+        nonlocal errors
+        for i in counter:
+            started = time.perf_counter()
+            try:
+                ok = await request(i)
+            except Exception as e:
+                print(f"request failed: {type(e).__name__}: {e}")
+                ok = False
+            if ok:
+                latencies.append(time.perf_counter() - started)
+            else:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*[caller() for _ in range(concurrency)])
+    return summarize_latencies(latencies, errors, time.perf_counter() - started)
+
+
+_reported = set()
+
+
+def ok(response) -> bool:
+    failed = response.status_code != 200
+    if not failed and response.headers.get("content-type", "").startswith("application/json"):
+        body = response.json()
+        failed = isinstance(body, dict) and isinstance(body.get("status"), int) and body["status"] < 0
+    if failed:
+        # each distinct failure once, so a broken endpoint is visible without flooding the output
+        reason = f"{response.request.method} {response.request.url.path} -> {response.status_code}: {response.text[:300]}"
+        if reason not in _reported:
+            _reported.add(reason)
+            print(f"request failed: {reason}")
+    return not failed
+
+
+def git_version() -> str:
+    try:
+        return subprocess.check_output(["git", "describe", "--always", "--dirty"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+async def run(args) -> dict:
+    import httpx
+    import fakes
+
+    # the server reads its storage locations at import time and keeps uploads relative to the cwd
+    work_dir = tempfile.mkdtemp(prefix="bench-")
+    os.environ["CHAPTER_STORE_DIR"] = os.path.join(work_dir, "chapters")
+    os.environ["SUMMARY_CACHE_DIR"] = os.path.join(work_dir, "summaries")
+    os.environ["EMBEDDING_CACHE_PATH"] = os.path.join(work_dir, "embeddings.sqlite3")
+    os.environ["INDEX_DIR"] = os.path.join(work_dir, "indexes")
+    os.environ.setdefault("OPENAI_API_KEY", "bench")
+    os.chdir(work_dir)
+
+    from llama_index.core import Settings
+    import app as server
+    import search_explain
+    import summarize_agent
+    import translate
+
+    Settings.llm = fakes.FakeLLM(latency=args.llm_latency)
+    search_explain.embed_model._inner = fakes.FakeEmbedding(latency=args.embed_latency)
+    summarize_agent.get_chat_completion, summarize_agent.aget_chat_completion = \
+        fakes.fake_chat_completion(args.llm_latency)
+    translator = translate.get_translator()
+    translator.llm = fakes.FakeLLM(latency=args.llm_latency)
+    server.db = fakes.FakeDatabase(latency=args.mongo_latency)
+
+    epubs = list(args.epub)
+    for n in range(len(epubs), args.books):
+        path = os.path.join(work_dir, f"bench-book-{n}.epub")
+        make_epub(path, f"Bench book {n}", chapters=args.chapters, seed=n)
+        epubs.append(path)
+
+    results = {}
+    async with server.app.router.lifespan_context(server.app):
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=600) as client:
+            await client.post("/register", json={"username": "bench", "password": "bench-password"})
+            login = await client.post("/login", data={"username": "bench", "password": "bench-password"})
+            headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+
+            books = []
+
+            async def ingest(i: int) -> bool:
+                with open(epubs[i], "rb") as f:
+                    uploaded = await client.post("/upload", files={"file": (os.path.basename(epubs[i]), f)})
+                path = uploaded.json()["msg"]
+                # a complete record, as the reader app sends it; /files and /file reject ones with nulls
+                info = {"creation": str(int(time.time() * 1000)), "filename": os.path.basename(epubs[i]),
+                        "identifier": f"bench-{i}", "pathOnServer": path, "rawMediaType": "application/epub+zip",
+                        "author": f"Bench author {i}", "progression": "0", "cover": "",
+                        "bookmarks": [], "highlights": []}
+                response = await client.post("/upload-info", json=info, headers=headers)
+                if not ok(response):
+                    return False
+                job_id = response.json().get("job_id")
+                while job_id:
+                    job = (await client.get(f"/jobs/{job_id}", headers=headers)).json()["msg"]
+                    if job["status"] == "failed":
+                        return False
+                    if job["status"] == "done":
+                        break
+                    await asyncio.sleep(0.05)
+                books.append((f"bench-{i}", os.path.splitext(os.path.basename(path))[0]))
+                return True
+
+            results["upload-info"] = await load(ingest, len(epubs), min(args.concurrency, len(epubs)))
+            if not books:
+                raise SystemExit("no book was ingested; see the errors above")
+            chapters = [(idf, title) for idf, book in books for title in server.chapter_store.chapters(book)]
+
+            async def search(i: int) -> bool:
+                idf, _ = books[i % len(books)]
+                return ok(await client.post("/search", params={"idf": idf, "input": f"lá thư số {i % 7}"},
+                                            headers=headers))
+
+            async def summarize(i: int) -> bool:
+                idf, title = chapters[i % len(chapters)]
+                return ok(await client.get("/summarize", params={"idf": idf, "chapterName": title},
+                                           headers=headers))
+
+            async def translate_(i: int) -> bool:
+                return ok(await client.post("/translate", params={
+                    "text": f"the letter {i % 50}", "before": "Kaga read", "after": "again.",
+                    "src_lang": "Auto", "des_lang": "Vietnamese"}, headers=headers))
+
+            async def files(i: int) -> bool:
+                return ok(await client.get("/files", headers=headers))
+
+            for name, request in (("search", search), ("summarize", summarize),
+                                  ("translate", translate_), ("files", files)):
+                results[name] = await load(request, args.requests, args.concurrency)
+
+    return {
+        "version": args.label or git_version(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "config": {
+            "books": len(epubs), "chapters": args.chapters, "requests": args.requests,
+            "concurrency": args.concurrency, "llm_latency": args.llm_latency,
+            "embed_latency": args.embed_latency, "mongo_latency": args.mongo_latency,
+        },
+        "results": results,
+    }
+
+
+def compare(report: dict, baseline: dict):
+    print(f"\n{'endpoint':<12} {'metric':<15} {baseline['version']:>14} {report['version']:>14} {'change':>8}")
+    for endpoint, metrics in report["results"].items():
+        before = baseline["results"].get(endpoint)
+        if not before:
+            continue
+        for metric in ("throughput_rps", "p50_ms", "p99_ms"):
+            old, new = before[metric], metrics[metric]
+            change = f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+            print(f"{endpoint:<12} {metric:<15} {old:>14} {new:>14} {change:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--epub", action="append", default=[], help="sample EPUB to ingest (repeatable)")
+    parser.add_argument("--books", type=int, default=4, help="total books; generated ones fill up --epub")
+    parser.add_argument("--chapters", type=int, default=12, help="chapters per generated book")
+    parser.add_argument("--requests", type=int, default=200, help="requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="seconds per fake LLM call")
+    parser.add_argument("--embed-latency", type=float, default=0.02, help="seconds per fake embedding call")
+    parser.add_argument("--mongo-latency", type=float, default=0.0, help="seconds per fake Mongo operation")
+    parser.add_argument("--label", help="version label for the report (default: git describe)")
+    parser.add_argument("--out", help="write the JSON report here")
+    parser.add_argument("--compare", help="baseline JSON report to compare against")
+    parser.add_argument("--allow-errors", action="store_true", help="write the report even if requests failed")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    # latencies of failed requests are not comparable: refuse to produce a report from them
+    failed = {name: result["errors"] for name, result in report["results"].items() if result["errors"]}
+    if failed and not args.allow_errors:
+        raise SystemExit(f"requests failed ({', '.join(f'{name}: {count}' for name, count in failed.items())}); "
+                         "see the errors above, or pass --allow-errors to keep the report")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(report, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,497 @@
+"""Deterministic local stand-ins for OpenAI, embeddings and MongoDB.
+
+They let benchmarks/bench_server.py drive the real FastAPI app without any
+network access: every backend answers from a hash of its input after a
+configurable delay, so runs are repeatable and only the server's own
+overhead varies between versions.
+"""
+import asyncio
+import copy
+import hashlib
+import itertools
+import math
+import time
+from types import SimpleNamespace
+from typing import Any, List, Optional
+
+from bson import ObjectId
+from pymongo import DeleteOne, InsertOne, UpdateMany, UpdateOne
+from pymongo.errors import DuplicateKeyError
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.base.llms.types import CompletionResponse, CompletionResponseGen, LLMMetadata
+from llama_index.core.llms.callbacks import llm_completion_callback
+from llama_index.core.llms.custom import CustomLLM
+
+WORDS = "the reader turned the page and the story went on quietly into the night".split()
+
+
+def _words(seed: str, count: int) -> List[str]:
+    digest = hashlib.sha256(seed.encode("utf-8")).digest()
+    return [WORDS[digest[i % len(digest)] % len(WORDS)] for i in range(count)]
+
+
+class FakeLLM(CustomLLM):
+    """Completion model that waits `latency` seconds and returns `tokens` words."""
+
+    latency: float = 0.05
+    tokens: int = 32
+    stream_delay: float = 0.002
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata(context_window=128000, num_output=512, model_name="fake-llm")
+
+    @llm_completion_callback()
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        time.sleep(self.latency)
+        return CompletionResponse(text=" ".join(_words(prompt, self.tokens)))
+
+    @llm_completion_callback()
+    async def acomplete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        await asyncio.sleep(self.latency)
+        return CompletionResponse(text=" ".join(_words(prompt, self.tokens)))
+
+    @llm_completion_callback()
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponseGen:
+        time.sleep(self.latency)
+        text = ""
+        for word in _words(prompt, self.tokens):
+            time.sleep(self.stream_delay)
+            delta = f" {word}" if text else word
+            text += delta
+            yield CompletionResponse(text=text, delta=delta)
+
+
+class FakeEmbedding(BaseEmbedding):
+    """Unit vectors derived from a hash of the text; each call waits `latency` seconds."""
+
+    dim: int = 256
+    latency: float = 0.02
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "FakeEmbedding"
+
+    def _vector(self, text: str) -> List[float]:
+        values = []
+        for block in itertools.count():
+            digest = hashlib.sha256(f"{block}:{text}".encode("utf-8")).digest()
+            values.extend(b - 127.5 for b in digest)
+            if len(values) >= self.dim:
+                break
+        values = values[:self.dim]
+        norm = math.sqrt(sum(v * v for v in values)) or 1.0
+        return [v / norm for v in values]
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        time.sleep(self.latency)
+        return self._vector(query)
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        await asyncio.sleep(self.latency)
+        return self._vector(query)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._get_text_embeddings([text])[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        time.sleep(self.latency)
+        return [self._vector(text) for text in texts]
+
+
+def fake_chat_completion(latency: float = 0.05, tokens: int = 48):
+    """Sync and async replacements for summarize_agent's chat completion calls."""
+
+    def answer(messages) -> str:
+        return " ".join(_words(messages[-1]["content"], tokens))
+
+    def get_chat_completion(messages, model=None):
+        time.sleep(latency)
+        return answer(messages)
+
+    async def aget_chat_completion(messages, model=None, max_retries=None):
+        await asyncio.sleep(latency)
+        return answer(messages)
+
+    return get_chat_completion, aget_chat_completion
+
+
+# --- MongoDB ---------------------------------------------------------------
+
+_MISSING = object()
+
+
+def _get_path(doc: dict, path: str):
+    value = doc
+    for part in path.split("."):
+        if isinstance(value, dict) and part in value:
+            value = value[part]
+        elif isinstance(value, list) and part.isdigit() and int(part) < len(value):
+            value = value[int(part)]
+        elif isinstance(value, list):
+            # "array.field" matches on the field of any element, as in MongoDB
+            value = [item[part] for item in value if isinstance(item, dict) and part in item]
+        else:
+            return _MISSING
+    return value
+
+
+def _matches_value(value, condition) -> bool:
+    if isinstance(condition, dict) and condition and all(key.startswith("$") for key in condition):
+        for op, arg in condition.items():
+            present = value is not _MISSING
+            if op == "$eq" and not (present and value == arg):
+                return False
+            if op == "$ne" and present and value == arg:
+                return False
+            if op == "$in" and not (present and value in arg):
+                return False
+            if op == "$nin" and present and value in arg:
+                return False
+            if op == "$exists" and present != bool(arg):
+                return False
+            if op in ("$gt", "$gte", "$lt", "$lte"):
+                if not present or value is None:
+                    return False
+                if op == "$gt" and not value > arg:
+                    return False
+                if op == "$gte" and not value >= arg:
+                    return False
+                if op == "$lt" and not value < arg:
+                    return False
+                if op == "$lte" and not value <= arg:
+                    return False
+        return True
+    if isinstance(value, list) and not isinstance(condition, list):
+        return condition in value
+    return value is not _MISSING and value == condition
+
+
+def matches(doc: dict, query: Optional[dict]) -> bool:
+    for key, condition in (query or {}).items():
+        if key == "$and":
+            if not all(matches(doc, sub) for sub in condition):
+                return False
+        elif key == "$or":
+            if not any(matches(doc, sub) for sub in condition):
+                return False
+        elif not _matches_value(_get_path(doc, key), condition):
+            return False
+    return True
+
+
+def project(doc: dict, projection) -> dict:
+    if not projection:
+        return copy.deepcopy(doc)
+    if isinstance(projection, (list, tuple)):
+        projection = {field: 1 for field in projection}
+    include = {k for k, v in projection.items() if v and k != "_id"}
+    if include:
+        result = {k: copy.deepcopy(doc[k]) for k in include if k in doc}
+        if projection.get("_id", 1) and "_id" in doc:
+            result["_id"] = doc["_id"]
+        return result
+    return {k: copy.deepcopy(v) for k, v in doc.items() if projection.get(k, 1)}
+
+
+def _positional(doc: dict, query: Optional[dict], path: str) -> str:
+    """Resolve the `$` in `array.$.field` to the index of the first element the query matched."""
+    if ".$" not in path:
+        return path
+    array, _, rest = path.partition(".$")
+    conditions = {key[len(array) + 1:]: value for key, value in (query or {}).items() if key.startswith(f"{array}.")}
+    for index, item in enumerate(doc.get(array, [])):
+        if isinstance(item, dict) and matches(item, conditions):
+            return f"{array}.{index}{rest}"
+    raise ValueError(f"The positional operator did not find the match needed from the query: {path}")
+
+
+def _parent(doc: dict, path: str):
+    """The container holding the last part of a dotted path (creating dicts on the way) and that part."""
+    *parents, last = path.split(".")
+    for part in parents:
+        doc = doc[int(part)] if isinstance(doc, list) else doc.setdefault(part, {})
+    return doc, (int(last) if isinstance(doc, list) else last)
+
+
+def apply_update(doc: dict, update: dict, inserting: bool = False, query: Optional[dict] = None):
+    for op, fields in update.items():
+        for key, value in fields.items():
+            target, key = _parent(doc, _positional(doc, query, key))
+            if op == "$set" or (op == "$setOnInsert" and inserting):
+                target[key] = copy.deepcopy(value)
+            elif op == "$inc":
+                target[key] = target.get(key, 0) + value
+            elif op == "$unset":
+                target.pop(key, None)
+            elif op == "$push":
+                items = value["$each"] if isinstance(value, dict) and "$each" in value else [value]
+                array = target.setdefault(key, [])
+                array.extend(copy.deepcopy(items))
+                if isinstance(value, dict) and "$slice" in value:
+                    limit = value["$slice"]
+                    target[key] = array[limit:] if limit < 0 else array[:limit]
+            elif op == "$addToSet":
+                array = target.setdefault(key, [])
+                if value not in array:
+                    array.append(copy.deepcopy(value))
+            elif op == "$pull":
+                target[key] = [item for item in target.get(key, [])
+                               if not (matches(item, value) if isinstance(value, dict) else item == value)]
+            elif op not in ("$setOnInsert",):
+                raise NotImplementedError(f"update operator {op}")
+
+
+def evaluate(expression, doc: dict, variables: Optional[dict] = None):
+    """Value of an aggregation expression: field paths, $$variables and the operators the app uses."""
+    variables = variables or {}
+    if isinstance(expression, str) and expression.startswith("$$"):
+        name, _, path = expression[2:].partition(".")
+        value = variables[name]
+        return _get_path(value, path) if path else value
+    if isinstance(expression, str) and expression.startswith("$"):
+        value = _get_path(doc, expression[1:])
+        return None if value is _MISSING else value
+    if isinstance(expression, dict) and len(expression) == 1 and next(iter(expression)).startswith("$"):
+        op, arg = next(iter(expression.items()))
+        if op == "$ifNull":
+            values = [evaluate(item, doc, variables) for item in arg]
+            return next((value for value in values[:-1] if value is not None and value is not _MISSING), values[-1])
+        if op == "$filter":
+            name = arg.get("as", "this")
+            return [item for item in evaluate(arg["input"], doc, variables) or []
+                    if evaluate(arg["cond"], doc, {**variables, name: item})]
+        if op == "$size":
+            return len(evaluate(arg, doc, variables))
+        if op == "$arrayElemAt":
+            array, index = (evaluate(item, doc, variables) for item in arg)
+            return array[index] if isinstance(array, list) and -len(array) <= index < len(array) else None
+        if op in ("$eq", "$ne", "$gt", "$gte", "$lt", "$lte"):
+            left, right = (evaluate(item, doc, variables) for item in arg)
+            if op in ("$eq", "$ne"):
+                return (left == right) == (op == "$eq")
+            left, right = _sort_key(left), _sort_key(right)
+            return {"$gt": left > right, "$gte": left >= right, "$lt": left < right, "$lte": left <= right}[op]
+        raise NotImplementedError(f"expression operator {op}")
+    if isinstance(expression, dict):
+        return {key: evaluate(value, doc, variables) for key, value in expression.items()}
+    return expression
+
+
+def aggregate(docs: List[dict], pipeline: List[dict]) -> List[dict]:
+    docs = [copy.deepcopy(doc) for doc in docs]
+    for stage in pipeline:
+        (name, arg), = stage.items()
+        if name == "$match":
+            docs = [doc for doc in docs if matches(doc, arg)]
+        elif name == "$limit":
+            docs = docs[:arg]
+        elif name == "$sort":
+            for field, order in reversed(list(arg.items())):
+                docs.sort(key=lambda doc: _sort_key(_get_path(doc, field)), reverse=order < 0)
+        elif name == "$project":
+            computed = {key: value for key, value in arg.items() if not isinstance(value, int)}
+            if computed or any(arg.get(key) for key in arg if key != "_id"):
+                docs = [{**({"_id": doc["_id"]} if arg.get("_id", 1) and "_id" in doc else {}),
+                         **{key: doc[key] for key, value in arg.items()
+                            if isinstance(value, int) and value and key != "_id" and key in doc},
+                         **{key: evaluate(value, doc) for key, value in computed.items()}} for doc in docs]
+            else:
+                docs = [project(doc, arg) for doc in docs]
+        else:
+            raise NotImplementedError(f"aggregation stage {name}")
+    return docs
+
+
+def _sort_key(value):
+    if value is _MISSING or value is None:
+        return (0, 0)
+    if isinstance(value, (int, float)):
+        return (1, value)
+    return (2, str(value))
+
+
+class FakeCursor:
+    def __init__(self, docs: List[dict], projection=None):
+        self._docs = docs
+        self._projection = projection
+        self._limit = 0
+
+    def sort(self, key, direction=1):
+        keys = key if isinstance(key, list) else [(key, direction)]
+        for field, order in reversed(keys):
+            self._docs.sort(key=lambda doc: _sort_key(_get_path(doc, field)), reverse=order < 0)
+        return self
+
+    def limit(self, count: int):
+        self._limit = count
+        return self
+
+    def _results(self):
+        docs = self._docs[:self._limit] if self._limit else self._docs
+        return [project(doc, self._projection) for doc in docs]
+
+    async def to_list(self, length=None):
+        results = self._results()
+        return results if length is None else results[:length]
+
+    def __aiter__(self):
+        async def gen():
+            for doc in self._results():
+                yield doc
+        return gen()
+
+
+class FakeCollection:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.docs: List[dict] = []
+        self.indexes: List[Any] = []
+
+    async def _wait(self):
+        await asyncio.sleep(self.latency)
+
+    async def create_index(self, keys, **kwargs):
+        self.indexes.append((keys, kwargs))
+        return kwargs.get("name") or str(keys)
+
+    async def find_one(self, query=None, projection=None, **kwargs):
+        await self._wait()
+        for doc in self.docs:
+            if matches(doc, query):
+                return project(doc, projection)
+        return None
+
+    def find(self, query=None, projection=None, **kwargs):
+        return FakeCursor([doc for doc in self.docs if matches(doc, query)], projection)
+
+    async def count_documents(self, query=None, **kwargs):
+        await self._wait()
+        return sum(1 for doc in self.docs if matches(doc, query))
+
+    def _check_unique(self, doc: dict):
+        # unique indexes on single fields only; sparse ones skip documents without the field
+        for keys, options in self.indexes:
+            if not options.get("unique"):
+                continue
+            field = keys[0][0] if isinstance(keys, list) else keys
+            value = _get_path(doc, field)
+            if value is _MISSING and options.get("sparse"):
+                continue
+            if any(_get_path(other, field) == value for other in self.docs):
+                raise DuplicateKeyError(f"E11000 duplicate key error: {field}")
+
+    async def insert_one(self, doc: dict):
+        await self._wait()
+        doc.setdefault("_id", ObjectId())
+        self._check_unique(doc)
+        self.docs.append(copy.deepcopy(doc))
+        return SimpleNamespace(inserted_id=doc["_id"])
+
+    async def update_one(self, query, update, upsert=False, **kwargs):
+        await self._wait()
+        return self._update_one(query, update, upsert)
+
+    def _update_one(self, query, update, upsert=False):
+        for doc in self.docs:
+            if matches(doc, query):
+                # applied to a copy, so a failing operator leaves the document as it was (like MongoDB)
+                updated = copy.deepcopy(doc)
+                apply_update(updated, update, query=query)
+                doc.clear()
+                doc.update(updated)
+                return SimpleNamespace(matched_count=1, modified_count=1, upserted_id=None)
+        if upsert:
+            doc = {k: v for k, v in query.items() if not k.startswith("$") and not isinstance(v, dict)}
+            doc["_id"] = ObjectId()
+            apply_update(doc, update, inserting=True)
+            self.docs.append(doc)
+            return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=doc["_id"])
+        return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=None)
+
+    async def update_many(self, query, update, **kwargs):
+        await self._wait()
+        matched = [doc for doc in self.docs if matches(doc, query)]
+        for doc in matched:
+            apply_update(doc, update, query=query)
+        return SimpleNamespace(matched_count=len(matched), modified_count=len(matched), upserted_id=None)
+
+    async def find_one_and_update(self, query, update, projection=None, upsert=False, return_document=False,
+                                  **kwargs):
+        # return_document is pymongo's ReturnDocument: AFTER is True, BEFORE is False
+        await self._wait()
+        before = next((copy.deepcopy(doc) for doc in self.docs if matches(doc, query)), None)
+        result = self._update_one(query, update, upsert)
+        if return_document:
+            _id = before["_id"] if before else result.upserted_id
+            after = next((doc for doc in self.docs if doc["_id"] == _id), None)
+            return project(after, projection) if after is not None else None
+        return project(before, projection) if before is not None else None
+
+    async def bulk_write(self, requests, ordered=True, **kwargs):
+        await self._wait()
+        counts = {"inserted_count": 0, "matched_count": 0, "modified_count": 0, "deleted_count": 0,
+                  "upserted_count": 0}
+        upserted_ids = {}
+        for index, request in enumerate(requests):
+            if isinstance(request, InsertOne):
+                doc = copy.deepcopy(request._doc)
+                doc.setdefault("_id", ObjectId())
+                self.docs.append(doc)
+                counts["inserted_count"] += 1
+            elif isinstance(request, UpdateOne):
+                result = self._update_one(request._filter, request._doc, request._upsert)
+                counts["matched_count"] += result.matched_count
+                counts["modified_count"] += result.modified_count
+                if result.upserted_id is not None:
+                    counts["upserted_count"] += 1
+                    upserted_ids[index] = result.upserted_id
+            elif isinstance(request, UpdateMany):
+                matched = [doc for doc in self.docs if matches(doc, request._filter)]
+                for doc in matched:
+                    apply_update(doc, request._doc, query=request._filter)
+                counts["matched_count"] += len(matched)
+                counts["modified_count"] += len(matched)
+            elif isinstance(request, DeleteOne):
+                for i, doc in enumerate(self.docs):
+                    if matches(doc, request._filter):
+                        del self.docs[i]
+                        counts["deleted_count"] += 1
+                        break
+            else:
+                raise NotImplementedError(f"bulk operation {type(request).__name__}")
+        return SimpleNamespace(upserted_ids=upserted_ids, acknowledged=True, **counts)
+
+    def aggregate(self, pipeline, **kwargs):
+        return FakeCursor(aggregate(self.docs, pipeline))
+
+    async def delete_one(self, query):
+        await self._wait()
+        for i, doc in enumerate(self.docs):
+            if matches(doc, query):
+                del self.docs[i]
+                return SimpleNamespace(deleted_count=1)
+        return SimpleNamespace(deleted_count=0)
+
+    async def delete_many(self, query):
+        await self._wait()
+        before = len(self.docs)
+        self.docs = [doc for doc in self.docs if not matches(doc, query)]
+        return SimpleNamespace(deleted_count=before - len(self.docs))
+
+
+class FakeDatabase:
+    def __init__(self, latency: float = 0.0):
+        self._latency = latency
+        self._collections = {}
+
+    def __getattr__(self, name: str) -> FakeCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def __getitem__(self, name: str) -> FakeCollection:
+        if name not in self._collections:
+            self._collections[name] = FakeCollection(self._latency)
+        return self._collections[name]
+
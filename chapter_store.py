@@ -0,0 +1,167 @@
+import json
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+
+CHAPTER_STORE_DIR = os.getenv("CHAPTER_STORE_DIR", "data/chapters")
+# Upper bound on chapter text (in characters) kept in memory across all books.
+CHAPTER_CACHE_CHARS = int(os.getenv("CHAPTER_CACHE_CHARS", str(20_000_000)))
+
+SUMMARY_SUFFIX = "_smrz"
+
+
+def _staging_name(path: str) -> str:
+    # Per-writer, so two processes or threads writing the same target never share a file.
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+
+def _write_atomic(path: str, data: str):
+    tmp_path = _staging_name(path)
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class ChapterStore:
+    """Disk-backed chapter texts and summaries, keyed by book and chapter title.
+
+    Layout: <root>/<book>/manifest.json lists the chapters in reading order and
+    maps each title to a numbered text file; a chapter's summary lives next to
+    it as <n>.smrz.txt. Chapter texts are read on demand and kept in an LRU
+    bounded by `max_cached_chars`.
+    """
+
+    def __init__(self, root: str = CHAPTER_STORE_DIR, max_cached_chars: int = CHAPTER_CACHE_CHARS):
+        self.root = root
+        self.max_cached_chars = max_cached_chars
+        self._lock = threading.Lock()
+        self._manifests: Dict[str, dict] = {}
+        self._cache: "OrderedDict[tuple, str]" = OrderedDict()
+        self._cached_chars = 0
+        os.makedirs(self.root, exist_ok=True)
+
+    def _book_dir(self, book: str) -> str:
+        return os.path.join(self.root, book)
+
+    def _manifest(self, book: str) -> Optional[dict]:
+        manifest = self._manifests.get(book)
+        if manifest is None:
+            path = os.path.join(self._book_dir(book), "manifest.json")
+            if not os.path.exists(path):
+                return None
+            with open(path, encoding="utf-8") as f:
+                manifest = json.load(f)
+            self._manifests[book] = manifest
+        return manifest
+
+    def _chapter_path(self, book: str, title: str, suffix: str = ".txt") -> Optional[str]:
+        manifest = self._manifest(book)
+        if manifest is None or title not in manifest["files"]:
+            return None
+        return os.path.join(self._book_dir(book), manifest["files"][title] + suffix)
+
+    def save_book(self, book: str, chapters: Union[Dict[str, str], Iterable[Tuple[str, str]]]):
+        """Replace the stored chapters of `book`.
+
+        `chapters` is a title -> text dict (`<title>_smrz` keys are skipped) or
+        an iterable of (title, text) pairs, which is written out as it is consumed.
+        """
+        if isinstance(chapters, dict):
+            chapters = ((title, text) for title, text in chapters.items() if not title.endswith(SUMMARY_SUFFIX))
+        book_dir = self._book_dir(book)
+        tmp_dir = _staging_name(book_dir)
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        titles = []
+        files = {}
+        for title, text in chapters:
+            if title not in files:
+                titles.append(title)
+                files[title] = f"{len(files):04d}"
+            _write_atomic(os.path.join(tmp_dir, f"{files[title]}.txt"), text)
+        manifest = {"book": book, "chapters": titles, "files": files}
+        _write_atomic(os.path.join(tmp_dir, "manifest.json"), json.dumps(manifest, ensure_ascii=False))
+        with self._lock:
+            shutil.rmtree(book_dir, ignore_errors=True)
+            try:
+                os.replace(tmp_dir, book_dir)
+            except OSError:
+                # Another worker put the book in place in between; its copy is as good as ours.
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                if not os.path.isdir(book_dir):
+                    raise
+            self._manifests[book] = manifest
+            self._evict_book(book)
+
+    def has_book(self, book: str) -> bool:
+        with self._lock:
+            return self._manifest(book) is not None
+
+    def chapters(self, book: str) -> List[str]:
+        with self._lock:
+            manifest = self._manifest(book)
+            return list(manifest["chapters"]) if manifest else []
+
+    def chapter_sizes(self, book: str) -> List[int]:
+        """Size on disk of each chapter text, in reading order (0 for a missing file)."""
+        with self._lock:
+            manifest = self._manifest(book)
+            if not manifest:
+                return []
+            paths = [self._chapter_path(book, title) for title in manifest["chapters"]]
+        return [os.path.getsize(path) if os.path.exists(path) else 0 for path in paths]
+
+    def get_chapter(self, book: str, title: str) -> Optional[str]:
+        key = (book, title)
+        with self._lock:
+            text = self._cache.get(key)
+            if text is not None:
+                self._cache.move_to_end(key)
+                return text
+            path = self._chapter_path(book, title)
+        if path is None or not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            text = f.read()
+        with self._lock:
+            if key not in self._cache and len(text) <= self.max_cached_chars:
+                self._cache[key] = text
+                self._cached_chars += len(text)
+                while self._cached_chars > self.max_cached_chars:
+                    _, old = self._cache.popitem(last=False)
+                    self._cached_chars -= len(old)
+        return text
+
+    def get_summary(self, book: str, title: str) -> Optional[str]:
+        with self._lock:
+            path = self._chapter_path(book, title, ".smrz.txt")
+        if path is None or not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            return f.read()
+
+    def set_summary(self, book: str, title: str, summary: str):
+        with self._lock:
+            path = self._chapter_path(book, title, ".smrz.txt")
+        if path is None:
+            raise KeyError(f"{book}/{title}")
+        _write_atomic(path, summary)
+
+    def delete_book(self, book: str):
+        with self._lock:
+            shutil.rmtree(self._book_dir(book), ignore_errors=True)
+            self._manifests.pop(book, None)
+            self._evict_book(book)
+
+    def forget(self, book: str):
+        """Drop what is held in memory for `book`, e.g. after its files were removed."""
+        with self._lock:
+            self._manifests.pop(book, None)
+            self._evict_book(book)
+
+    def _evict_book(self, book: str):
+        for key in [key for key in self._cache if key[0] == book]:
+            self._cached_chars -= len(self._cache.pop(key))
@@ -0,0 +1,162 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, Iterable, List
+
+import tiktoken
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from pydantic import PrivateAttr
+
+from metrics import record_llm_usage
+
+
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "data/embeddings.sqlite3")
+# Texts per embedding request for cache misses, and how many requests may run at once
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "256"))
+EMBED_PARALLELISM = int(os.getenv("EMBED_PARALLELISM", "4"))
+
+# Tokenizer of the text-embedding-3 models, used to report tokens saved by cache hits
+_encoding = tiktoken.get_encoding("cl100k_base")
+
+
+class EmbeddingStore:
+    """Embedding vectors persisted in SQLite, keyed by a hash of model and text."""
+
+    def __init__(self, path: str = EMBEDDING_CACHE_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+        self._conn.commit()
+        self._lock = threading.Lock()
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, List[float]]:
+        keys = list(keys)
+        found = {}
+        with self._lock:
+            # stay under SQLite's limit on bound parameters
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+                )
+                for key, blob in rows:
+                    found[key] = array("f", blob).tolist()
+        return found
+
+    def put_many(self, items: Dict[str, List[float]]):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, array("f", vector).tobytes()) for key, vector in items.items()],
+            )
+            self._conn.commit()
+
+
+class CachedEmbedding(BaseEmbedding):
+    """Wraps an embedding model with a persistent cache of text embeddings.
+
+    Only texts that were never embedded with this model are sent to the inner
+    model, in batches of `batch_size` with up to `parallelism` requests in
+    flight. Query embeddings are passed through uncached.
+    """
+
+    _inner: BaseEmbedding = PrivateAttr()
+    _store: EmbeddingStore = PrivateAttr()
+    _parallelism: int = PrivateAttr()
+    _local: threading.local = PrivateAttr()
+    _stats_lock: threading.Lock = PrivateAttr()
+    _stats: dict = PrivateAttr()
+
+    def __init__(self, inner: BaseEmbedding, store: EmbeddingStore, batch_size: int = EMBED_BATCH_SIZE,
+                 parallelism: int = EMBED_PARALLELISM, **kwargs):
+        # hand the whole node list of an index build to _get_text_embeddings in one call
+        super().__init__(model_name=inner.model_name, embed_batch_size=2048, **kwargs)
+        inner.embed_batch_size = batch_size
+        self._inner = inner
+        self._store = store
+        self._parallelism = parallelism
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self._stats = _empty_stats()
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedEmbedding"
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\x00{text}".encode("utf-8")).hexdigest()
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        record_llm_usage("query_embedding", self.model_name, len(_encoding.encode(query)))
+        return self._inner.get_query_embedding(query)
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        record_llm_usage("query_embedding", self.model_name, len(_encoding.encode(query)))
+        return await self._inner.aget_query_embedding(query)
+
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        vectors = self._inner.get_text_embedding_batch(texts)
+        record_llm_usage("embedding", self.model_name, sum(len(_encoding.encode(text)) for text in texts))
+        return vectors
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._get_text_embeddings([text])[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key(text) for text in texts]
+        vectors = self._store.get_many(set(keys))
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors:
+                missing[key] = text
+        if missing:
+            missing_keys = list(missing)
+            batches = [missing_keys[i:i + self._inner.embed_batch_size]
+                       for i in range(0, len(missing_keys), self._inner.embed_batch_size)]
+            with ThreadPoolExecutor(max_workers=self._parallelism) as pool:
+                results = pool.map(lambda batch: self._embed_batch([missing[key] for key in batch]), batches)
+                fresh = {}
+                for batch, batch_vectors in zip(batches, results):
+                    fresh.update(zip(batch, batch_vectors))
+            self._store.put_many(fresh)
+            vectors.update(fresh)
+
+        hits = [text for key, text in zip(keys, texts) if key not in missing]
+        self._record(len(texts), len(hits), sum(len(_encoding.encode(text)) for text in hits))
+        return [vectors[key] for key in keys]
+
+    def _record(self, texts: int, hits: int, tokens_saved: int):
+        targets = [self._stats]
+        tracked = getattr(self._local, "stats", None)
+        if tracked is not None:
+            targets.append(tracked)
+        with self._stats_lock:
+            for stats in targets:
+                stats["texts"] += texts
+                stats["hits"] += hits
+                stats["misses"] += texts - hits
+                stats["tokens_saved"] += tokens_saved
+                stats["hit_rate"] = round(stats["hits"] / stats["texts"], 4) if stats["texts"] else 0.0
+
+    @contextmanager
+    def tracking(self):
+        """Collect cache statistics for embeddings requested by the current thread only."""
+        stats = _empty_stats()
+        self._local.stats = stats
+        try:
+            yield stats
+        finally:
+            self._local.stats = None
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return dict(self._stats)
+
+
+def _empty_stats() -> dict:
+    return {"texts": 0, "hits": 0, "misses": 0, "hit_rate": 0.0, "tokens_saved": 0}
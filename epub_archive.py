@@ -0,0 +1,174 @@
+import hashlib
+import mimetypes
+import os
+import posixpath
+import threading
+import zipfile
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Optional, Tuple
+from urllib.parse import unquote
+from xml.etree import ElementTree
+
+# Open EPUB zips kept around, so a page of images doesn't re-read the central directory each time
+EPUB_OPEN_ARCHIVES = int(os.getenv("EPUB_OPEN_ARCHIVES", "16"))
+EPUB_READ_CHUNK = 64 * 1024
+
+_CONTAINER_NS = "{urn:oasis:names:tc:opendocument:xmlns:container}"
+_OPF_NS = "{http://www.idpf.org/2007/opf}"
+
+
+class EpubPackage:
+    """One opened EPUB: the zip handle plus its OPF manifest, spine and cover."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.zip = zipfile.ZipFile(path)
+        self.members = {info.filename: info for info in self.zip.infolist()}
+        self.media_types: Dict[str, str] = {}
+        self.spine: List[str] = []
+        self.cover: Optional[str] = None
+        try:
+            self._read_package()
+        except (KeyError, ElementTree.ParseError):
+            # not a well-formed EPUB: plain member paths still work, the aliases don't
+            pass
+
+    def _read_package(self):
+        container = ElementTree.fromstring(self.zip.read("META-INF/container.xml"))
+        rootfile = container.find(f"{_CONTAINER_NS}rootfiles/{_CONTAINER_NS}rootfile")
+        opf_path = rootfile.get("full-path")
+        opf_dir = posixpath.dirname(opf_path)
+        opf = ElementTree.fromstring(self.zip.read(opf_path))
+
+        items = {}
+        for item in opf.iter(f"{_OPF_NS}item"):
+            href = posixpath.normpath(posixpath.join(opf_dir, unquote(item.get("href", ""))))
+            items[item.get("id")] = href
+            if item.get("media-type"):
+                self.media_types[href] = item.get("media-type")
+            if "cover-image" in (item.get("properties") or "").split():
+                self.cover = href
+        self.spine = [items[ref.get("idref")] for ref in opf.iter(f"{_OPF_NS}itemref") if ref.get("idref") in items]
+        if self.cover is None:
+            # EPUB 2: <meta name="cover" content="<manifest id>"/>
+            for meta in opf.iter(f"{_OPF_NS}meta"):
+                if meta.get("name") == "cover" and meta.get("content") in items:
+                    self.cover = items[meta.get("content")]
+                    break
+
+    def resolve(self, resource: str) -> Optional[zipfile.ZipInfo]:
+        """Zip member for a path inside the archive, `cover`, or `spine/<n>`."""
+        if resource == "cover":
+            resource = self.cover or ""
+        elif resource.startswith("spine/") and resource[6:].isdigit():
+            index = int(resource[6:])
+            resource = self.spine[index] if index < len(self.spine) else ""
+        return self.members.get(unquote(resource).lstrip("/"))
+
+    def media_type(self, info: zipfile.ZipInfo) -> str:
+        return (self.media_types.get(info.filename) or mimetypes.guess_type(info.filename)[0]
+                or "application/octet-stream")
+
+    def read(self, info: zipfile.ZipInfo, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        """Bytes [start, end] of a member, inflated on the fly in EPUB_READ_CHUNK pieces."""
+        end = info.file_size - 1 if end is None else end
+        remaining = end - start + 1
+        with self.zip.open(info) as member:
+            if start:
+                member.seek(start)
+            while remaining > 0:
+                chunk = member.read(min(EPUB_READ_CHUNK, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+    def close(self):
+        self.zip.close()
+
+
+class EpubArchives:
+    """LRU of open EpubPackages, keyed by file path.
+
+    Stored books are content-addressed and never rewritten in place, so an
+    open handle stays valid until the file is deleted (see `forget`).
+    """
+
+    def __init__(self, max_open: int = EPUB_OPEN_ARCHIVES):
+        self.max_open = max_open
+        self._lock = threading.Lock()
+        self._open: "OrderedDict[str, EpubPackage]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path: str) -> EpubPackage:
+        """Open (or reuse) the EPUB at `path`; raises OSError / zipfile.BadZipFile."""
+        with self._lock:
+            package = self._open.get(path)
+            if package is not None:
+                self._open.move_to_end(path)
+                self.hits += 1
+                return package
+            self.misses += 1
+        package = EpubPackage(path)
+        with self._lock:
+            current = self._open.get(path)
+            if current is not None:
+                package.close()
+                return current
+            self._open[path] = package
+            while len(self._open) > self.max_open:
+                # readers still streaming from an evicted zip keep their own member handles
+                _, old = self._open.popitem(last=False)
+                old.close()
+        return package
+
+    def forget(self, path: str):
+        with self._lock:
+            package = self._open.pop(path, None)
+        if package is not None:
+            package.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._open), "max_entries": self.max_open, "hits": self.hits,
+                    "misses": self.misses}
+
+
+def resource_etag(path: str, info: zipfile.ZipInfo) -> str:
+    # stored books are content-addressed, so the book's path and the member's path, CRC and
+    # size pin the bytes; hashed, as a header value must stay ASCII and free of quotes
+    digest = hashlib.sha1(f"{path}\0{info.filename}".encode("utf-8")).hexdigest()
+    return f'"{digest[:16]}-{info.CRC:08x}-{info.file_size:x}"'
+
+
+def etag_matches(header: Optional[str], etag: str) -> bool:
+    if not header:
+        return False
+    tags = [tag.strip() for tag in header.split(",")]
+    # If-None-Match compares weakly: W/"x" matches "x"
+    return "*" in tags or any(tag.removeprefix("W/") == etag for tag in tags)
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """(start, end) of a single `bytes=` range; None to send the whole body.
+
+    Raises ValueError for a range that can't be satisfied. Multi-range requests
+    get the whole body, which RFC 9110 allows.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, _, last = header[6:].strip().partition("-")
+    try:
+        if first:
+            start = int(first)
+            end = int(last) if last else size - 1
+        elif last:
+            start, end = max(size - int(last), 0), size - 1
+        else:
+            return None
+    except ValueError:
+        return None
+    if start >= size or start > end:
+        raise ValueError(header)
+    return start, min(end, size - 1)
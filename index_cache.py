@@ -0,0 +1,76 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict
+
+
+class QueryEngineCache:
+    """LRU of ready-to-use query engines keyed by book.
+
+    `build(book)` loads the persisted index and assembles the engine on a miss;
+    `size_of(book)` estimates what the entry costs in memory (the persisted index
+    size on disk). Least recently used books are dropped once the summed sizes
+    exceed `max_bytes`.
+    """
+
+    def __init__(self, build: Callable[[str], Any], size_of: Callable[[str], int], max_bytes: int):
+        self.build = build
+        self.size_of = size_of
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._build_locks: Dict[str, threading.Lock] = {}
+        self._generations: Dict[str, int] = {}
+
+    def get(self, book: str) -> Any:
+        with self._lock:
+            entry = self._entries.get(book)
+            if entry is not None:
+                self._entries.move_to_end(book)
+                self.hits += 1
+                return entry[0]
+            build_lock = self._build_locks.setdefault(book, threading.Lock())
+        # Only one thread loads a given book; the others wait and reuse its result.
+        with build_lock:
+            with self._lock:
+                entry = self._entries.get(book)
+                if entry is not None:
+                    self._entries.move_to_end(book)
+                    self.hits += 1
+                    return entry[0]
+                self.misses += 1
+                generation = self._generations.get(book, 0)
+            value = self.build(book)
+            size = self.size_of(book)
+            with self._lock:
+                # The book was re-ingested or deleted while we were loading it.
+                if self._generations.get(book, 0) != generation:
+                    return value
+                self._entries[book] = (value, size)
+                self._bytes += size
+                while self._bytes > self.max_bytes and len(self._entries) > 1:
+                    _, (_, old_size) = self._entries.popitem(last=False)
+                    self._bytes -= old_size
+                    self.evictions += 1
+            return value
+
+    def invalidate(self, book: str):
+        with self._lock:
+            entry = self._entries.pop(book, None)
+            if entry is not None:
+                self._bytes -= entry[1]
+            self._generations[book] = self._generations.get(book, 0) + 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,231 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from uuid import uuid4
+
+from pymongo.errors import DuplicateKeyError
+
+from metrics import STAGE_LATENCY
+
+logger = logging.getLogger(__name__)
+
+
+# A stage is a (name, callable) pair. Stages of one job run in order on the
+# worker pool and share the job's `context` dict to hand results forward;
+# anything a stage puts in context["report"] is kept and shown with the job.
+Stage = Tuple[str, Callable[[dict], None]]
+
+
+class IngestionJob:
+    def __init__(self, stages: List[Stage], owner: Optional[str] = None, book: Optional[str] = None):
+        self.id = uuid4().hex
+        self.owner = owner
+        self.book = book
+        self.status = "queued"
+        self.error: Optional[str] = None
+        self.created = time.time()
+        self.updated = self.created
+        self.report: dict = {}
+        self.context: dict = {"report": self.report}
+        self.stages = stages
+        self.stage_info: Dict[str, dict] = {
+            name: {"status": "pending", "attempts": 0, "seconds": None, "error": None}
+            for name, _ in stages
+        }
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "book": self.book,
+            "status": self.status,
+            "error": self.error,
+            "created": self.created,
+            "updated": self.updated,
+            "stages": [dict(name=name, **self.stage_info[name]) for name, _ in self.stages],
+            "report": self.report,
+        }
+
+
+def _view(document: dict) -> dict:
+    # a stored job as get() and friends hand it out; `watchers` are other users whose
+    # upload of the same book is waiting on it
+    view = {key: value for key, value in document.items() if key not in ("_id", "active", "heartbeat", "expireAt")}
+    view["id"] = document["_id"]
+    view.setdefault("watchers", [])
+    return view
+
+
+class IngestionQueue:
+    """Runs ingestion jobs on a bounded worker pool, off the event loop.
+
+    At most `workers` jobs run at once; each stage of a job is retried up to
+    `max_retries` times with exponential backoff before the job is failed.
+
+    Job state lives in a MongoDB collection so that every server worker can
+    answer a poll and see what is being ingested. A job runs on the worker that
+    queued it and claims its book through the unique `active` field until it
+    finishes, renewing its `heartbeat` every `lease / 3` seconds; a claim whose
+    heartbeat is older than `lease` was left by a worker that went away and is
+    taken over by the next submit for the book. Finished jobs are kept for
+    `retention` seconds.
+    """
+
+    def __init__(self, workers: int = 2, max_retries: int = 3, retry_delay: float = 2.0,
+                 lease: float = 60.0, retention: float = 7 * 24 * 3600):
+        self.workers = workers
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.lease = lease
+        self.retention = retention
+        self._collection = None
+        self._jobs: Dict[str, IngestionJob] = {}  # queued or running on this worker
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    async def start(self, collection):
+        self._collection = collection
+        self._queue = asyncio.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="ingest")
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._heartbeat()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def submit(self, stages: List[Stage], owner: Optional[str] = None, book: Optional[str] = None) -> dict:
+        """Queue a job for `book`; if another job holds the book already, that one is returned instead."""
+        for _ in range(3):
+            job = IngestionJob(stages, owner=owner, book=book)
+            document = self._document(job)
+            if book:
+                document["active"] = book
+            try:
+                await self._collection.insert_one(document)
+            except DuplicateKeyError:
+                holder = await self._collection.find_one({"active": book})
+                if holder is None:
+                    continue  # finished in between
+                if holder["heartbeat"] >= time.time() - self.lease:
+                    return _view(holder)
+                # the worker running it went away: fail the job and take its book over
+                await self._collection.update_one(
+                    {"_id": holder["_id"], "heartbeat": holder["heartbeat"]},
+                    {"$set": {"status": "failed", "error": "worker lost", "updated": time.time()},
+                     "$unset": {"active": ""}})
+                logger.warning("took over ingestion job", extra={"job": holder["_id"], "book": book})
+                continue
+            self._jobs[job.id] = job
+            self._queue.put_nowait(job)
+            return _view(document)
+        raise RuntimeError(f"could not claim book {book} for ingestion")
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        document = await self._collection.find_one({"_id": job_id})
+        return _view(document) if document else None
+
+    async def watch(self, job_id: str, username: str):
+        await self._collection.update_one({"_id": job_id}, {"$addToSet": {"watchers": username}})
+
+    async def active_job(self, book: str) -> Optional[dict]:
+        """A queued or running job for `book`, on any worker, if there is one."""
+        document = await self._collection.find_one({"active": book, "heartbeat": {"$gte": time.time() - self.lease}})
+        return _view(document) if document else None
+
+    async def active_books(self) -> Set[str]:
+        cursor = self._collection.find({"active": {"$exists": True}, "heartbeat": {"$gte": time.time() - self.lease}},
+                                       {"active": 1})
+        return {document["active"] async for document in cursor}
+
+    def _document(self, job: IngestionJob) -> dict:
+        document = job.to_dict()
+        document["_id"] = document.pop("id")
+        document.update(owner=job.owner, watchers=[], heartbeat=time.time())
+        return document
+
+    async def _save(self, job: IngestionJob):
+        state = job.to_dict()
+        update = {"$set": {key: state[key] for key in ("status", "error", "updated", "stages", "report")}}
+        update["$set"]["heartbeat"] = time.time()
+        if job.status in ("done", "failed"):
+            update["$set"]["expireAt"] = datetime.now(timezone.utc) + timedelta(seconds=self.retention)
+            update["$unset"] = {"active": ""}
+        try:
+            await self._collection.update_one({"_id": job.id}, update)
+        except Exception as e:
+            # the job goes on; its claim lapses with the heartbeat if the finish can't be recorded
+            logger.warning("saving ingestion job failed", extra={"job": job.id, "error": str(e)})
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            if not self._jobs:
+                continue
+            try:
+                await self._collection.update_many({"_id": {"$in": list(self._jobs)}},
+                                                   {"$set": {"heartbeat": time.time()}})
+            except Exception as e:
+                logger.warning("renewing ingestion jobs failed", extra={"error": str(e)})
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._run(job)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job: IngestionJob):
+        job.status = "running"
+        try:
+            await self._execute(job)
+        finally:
+            self._jobs.pop(job.id, None)
+            # Drop parsed documents / built index; the stored job keeps the report.
+            job.context.clear()
+            await self._save(job)
+
+    async def _execute(self, job: IngestionJob):
+        loop = asyncio.get_running_loop()
+        await self._save(job)
+        for name, fn in job.stages:
+            info = job.stage_info[name]
+            info["status"] = "running"
+            while True:
+                info["attempts"] += 1
+                started = time.perf_counter()
+                try:
+                    await loop.run_in_executor(self._executor, fn, job.context)
+                except Exception as e:
+                    STAGE_LATENCY.labels(name, "error").observe(time.perf_counter() - started)
+                    info["error"] = f"{type(e).__name__}: {e}"
+                    logger.warning("ingestion stage failed", extra={"job": job.id, "stage": name,
+                                                                     "attempt": info["attempts"], "error": info["error"]})
+                    if info["attempts"] >= self.max_retries:
+                        info["status"] = "failed"
+                        job.status = "failed"
+                        job.error = info["error"]
+                        job.updated = time.time()
+                        return
+                    await self._save(job)
+                    await asyncio.sleep(self.retry_delay * 2 ** (info["attempts"] - 1))
+                    continue
+                elapsed = time.perf_counter() - started
+                STAGE_LATENCY.labels(name, "ok").observe(elapsed)
+                info["status"] = "done"
+                info["error"] = None
+                info["seconds"] = round(elapsed, 3)
+                job.updated = time.time()
+                await self._save(job)
+                break
+        job.status = "done"
+        job.updated = time.time()
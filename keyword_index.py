@@ -0,0 +1,123 @@
+import heapq
+import json
+import math
+import os
+import re
+import threading
+import unicodedata
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+_WORD = re.compile(r"\w+")
+
+
+def tokenize_words(text: str) -> List[str]:
+    return _WORD.findall(unicodedata.normalize("NFC", text).casefold())
+
+
+def _normalize_space(text: str) -> str:
+    return " ".join(text.split())
+
+
+class BM25Index:
+    """Okapi BM25 over the passages of one book, answered without any model call.
+
+    Passages are dicts with "id", "text" and "metadata"; the ids are the
+    vector index's node ids, so keyword and vector results can be fused.
+    """
+
+    def __init__(self, passages: List[dict], postings: Dict[str, List[List[int]]], doc_len: List[int],
+                 k1: float = 1.5, b: float = 0.75):
+        self.passages = passages
+        self.by_id = {passage["id"]: passage for passage in passages}
+        self.postings = postings  # term -> [[passage number, term frequency], ...]
+        self.doc_len = doc_len
+        self.k1 = k1
+        self.b = b
+        self.avg_len = sum(doc_len) / len(doc_len) if doc_len else 0.0
+        n = len(passages)
+        self.idf = {term: math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5)) for term, docs in postings.items()}
+
+    @classmethod
+    def build(cls, passages: Iterable[dict]) -> "BM25Index":
+        passages = list(passages)
+        postings: Dict[str, List[List[int]]] = {}
+        doc_len = []
+        for number, passage in enumerate(passages):
+            counts = Counter(tokenize_words(passage["text"]))
+            doc_len.append(sum(counts.values()))
+            for term, tf in counts.items():
+                postings.setdefault(term, []).append([number, tf])
+        return cls(passages, postings, doc_len)
+
+    def search(self, query: str, top_k: int = 5) -> List[Tuple[dict, float]]:
+        scores: Dict[int, float] = {}
+        for term in set(tokenize_words(query)):
+            docs = self.postings.get(term)
+            if not docs:
+                continue
+            idf = self.idf[term]
+            for number, tf in docs:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_len[number] / self.avg_len)
+                scores[number] = scores.get(number, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        best = heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+        return [(self.passages[number], score) for number, score in best]
+
+    def max_score(self, query: str) -> float:
+        """What a passage matching every query term as strongly as BM25 allows would score here.
+
+        Raw scores of different indexes aren't comparable (idf and passage
+        lengths differ per book); divided by this they are all on a 0..1 scale.
+        A term the book doesn't contain counts with the idf of an unseen term.
+        """
+        unseen = math.log(1 + (len(self.passages) + 0.5) / 0.5)
+        return sum(self.idf.get(term, unseen) for term in set(tokenize_words(query))) * (self.k1 + 1)
+
+    def save(self, path: str):
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"k1": self.k1, "b": self.b, "passages": self.passages, "postings": self.postings,
+                       "doc_len": self.doc_len}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["passages"], data["postings"], data["doc_len"], data["k1"], data["b"])
+
+
+def assign_chapters(passages: List[dict], chapters: Iterable[Tuple[str, Optional[str]]], probe_chars: int = 60):
+    """Best-effort: tag each passage with the chapter whose text contains its opening words.
+
+    Passages and chapters come from different parsers, so whitespace is
+    normalized before matching and passages that can't be found are left
+    untagged. Passages are assumed to be in reading order; the search for each
+    one resumes from the chapter the previous passage was found in.
+    """
+    chapters = [(title, _normalize_space(text or "")) for title, text in chapters]
+    current = 0
+    for passage in passages:
+        probe = _normalize_space(passage["text"])[:probe_chars]
+        if not probe:
+            continue
+        for i in range(current, len(chapters)):
+            title, text = chapters[i]
+            offset = text.find(probe)
+            if offset >= 0:
+                passage["metadata"]["chapter"] = title
+                passage["metadata"]["chapter_progress"] = round(offset / max(len(text), 1), 4)
+                current = i
+                break
+
+
+def reciprocal_rank_fusion(rankings: Iterable[List[Tuple[dict, float]]], top_k: int = 5, k: int = 60):
+    """Merge ranked passage lists by summing 1 / (k + rank) for each passage id."""
+    fused: Dict[str, float] = {}
+    passages: Dict[str, dict] = {}
+    for ranking in rankings:
+        for rank, (passage, _) in enumerate(ranking, start=1):
+            fused[passage["id"]] = fused.get(passage["id"], 0.0) + 1.0 / (k + rank)
+            passages.setdefault(passage["id"], passage)
+    best = heapq.nlargest(top_k, fused.items(), key=lambda item: item[1])
+    return [(passages[passage_id], score) for passage_id, score in best]
@@ -0,0 +1,312 @@
+import logging
+import os
+import shutil
+import tarfile
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# Evicted indexes are archived here and restored on the next search; when empty they are
+# deleted instead and rebuilt from the stored EPUB
+COLD_STORAGE_DIR = os.getenv("COLD_STORAGE_DIR", "data/cold")
+# Indexes not searched for this many days are moved to cold storage
+COLD_AFTER_DAYS = float(os.getenv("COLD_AFTER_DAYS", "30"))
+# Disk quotas in bytes; 0 means unlimited
+USER_QUOTA_BYTES = int(os.getenv("USER_QUOTA_BYTES", "0"))
+GLOBAL_QUOTA_BYTES = int(os.getenv("GLOBAL_QUOTA_BYTES", "0"))
+# Unreferenced artifacts younger than this are left alone (uploads awaiting /upload-info,
+# ingestion that has not registered yet)
+GC_GRACE_SECONDS = float(os.getenv("GC_GRACE_SECONDS", "3600"))
+
+# Searching a book refreshes its index's mtime at most this often
+TOUCH_INTERVAL = 600.0
+TEMP_SUFFIXES = (".tmp", ".part", ".restoring")
+
+
+def path_size(path: Optional[str]) -> int:
+    """Bytes of a file, or of everything under a directory; 0 when missing."""
+    if not path:
+        return 0
+    try:
+        if os.path.isfile(path):
+            return os.path.getsize(path)
+        total = 0
+        for directory, _, files in os.walk(path):
+            for name in files:
+                try:
+                    total += os.path.getsize(os.path.join(directory, name))
+                except OSError:
+                    pass
+        return total
+    except OSError:
+        return 0
+
+
+def _age(path: str) -> float:
+    try:
+        return time.time() - os.path.getmtime(path)
+    except OSError:
+        return 0.0
+
+
+def _remove(path: str) -> int:
+    size = path_size(path)
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.exists(path):
+        os.remove(path)
+    return size
+
+
+class StorageLifecycle:
+    """Tracks the on-disk artifacts of each book and keeps them bounded.
+
+    A book is named after its upload (the content hash) and owns:
+      upload    <upload_dir>/<book>.<ext>
+      index     <index_dir>/<book>, the vector and keyword indexes (derived data)
+      chapters  <chapter_dir>/<book>, chapter texts and their summaries
+      cold      <cold_dir>/<book>.tar.gz, an evicted index
+    plus, for books indexed before INDEX_DIR existed, the `legacy_index(book)`
+    directory. Covers are plain files in the upload dir, owned by the FileInfo
+    records that point at them.
+
+    `sweep` garbage-collects artifacts no FileInfo references, drops
+    half-built indexes, moves indexes unused for `cold_after_days` to cold
+    storage and, over the global quota, evicts the least recently used ones.
+    `forget(book)` is called whenever a book's artifacts go away, so the
+    app can drop what it caches in memory.
+    """
+
+    def __init__(self, upload_dir: str, index_dir: str, chapter_dir: str, cold_dir: str = COLD_STORAGE_DIR,
+                 cold_after_days: float = COLD_AFTER_DAYS, user_quota: int = USER_QUOTA_BYTES,
+                 global_quota: int = GLOBAL_QUOTA_BYTES, grace_seconds: float = GC_GRACE_SECONDS,
+                 forget: Callable[[str], None] = lambda book: None,
+                 legacy_index: Optional[Callable[[str], str]] = None):
+        self.upload_dir = upload_dir
+        self.index_dir = index_dir
+        self.chapter_dir = chapter_dir
+        self.cold_dir = cold_dir
+        self.cold_after = cold_after_days * 86400
+        self.user_quota = user_quota
+        self.global_quota = global_quota
+        self.grace_seconds = grace_seconds
+        self.forget = forget
+        self.legacy_index = legacy_index
+        self._lock = threading.Lock()
+        self._touched: Dict[str, float] = {}
+        self.usage_bytes = 0  # as of the last sweep, plus uploads since
+        self.evictions = 0
+        self.restores = 0
+        self.collected = 0
+        self.bytes_freed = 0
+        if cold_dir:
+            os.makedirs(cold_dir, exist_ok=True)
+
+    def index_path(self, book: str) -> str:
+        return os.path.join(self.index_dir, book)
+
+    def cold_path(self, book: str) -> Optional[str]:
+        return os.path.join(self.cold_dir, f"{book}.tar.gz") if self.cold_dir else None
+
+    def is_cold(self, book: str) -> bool:
+        path = self.cold_path(book)
+        return path is not None and os.path.exists(path)
+
+    def artifacts(self, book: str, upload_path: Optional[str] = None) -> Dict[str, str]:
+        paths = {"index": self.index_path(book), "chapters": os.path.join(self.chapter_dir, book)}
+        if upload_path:
+            paths["upload"] = upload_path
+        if self.cold_dir:
+            paths["cold"] = self.cold_path(book)
+        if self.legacy_index and book:
+            legacy = self.legacy_index(book)
+            # only ever a directory that really holds an index
+            if os.path.isfile(os.path.join(legacy, "docstore.json")):
+                paths["legacy_index"] = legacy
+        return paths
+
+    def usage(self, books: Dict[str, Optional[str]], files: Iterable[str] = ()) -> int:
+        """Bytes used by `books` (book -> upload path) and extra `files` such as covers."""
+        total = sum(path_size(path) for book, upload_path in books.items()
+                    for path in self.artifacts(book, upload_path).values())
+        return total + sum(path_size(path) for path in set(files))
+
+    def over_global_quota(self) -> bool:
+        return bool(self.global_quota) and self.usage_bytes >= self.global_quota
+
+    def add_usage(self, size: int):
+        with self._lock:
+            self.usage_bytes += size
+
+    def delete_book(self, book: str, upload_path: Optional[str] = None) -> int:
+        """Remove every artifact of `book`; returns the bytes freed."""
+        freed = sum(_remove(path) for path in self.artifacts(book, upload_path).values())
+        self._forgotten(book, freed)
+        return freed
+
+    def _forgotten(self, book: str, freed: int):
+        with self._lock:
+            self._touched.pop(book, None)
+            self.usage_bytes = max(0, self.usage_bytes - freed)
+            self.bytes_freed += freed
+        self.forget(book)
+
+    # --- hot / cold ----------------------------------------------------------
+
+    def touch(self, book: str):
+        """Mark the book's index as used; its directory mtime is the last-use time."""
+        now = time.time()
+        if now - self._touched.get(book, 0.0) < TOUCH_INTERVAL:
+            return
+        self._touched[book] = now
+        try:
+            os.utime(self.index_path(book))
+        except OSError:
+            pass
+
+    def evict(self, book: str) -> int:
+        """Move the book's index to cold storage (or delete it); returns the bytes freed."""
+        directory = self.index_path(book)
+        if not os.path.isdir(directory):
+            return 0
+        archive = self.cold_path(book)
+        if archive:
+            tmp_archive = f"{archive}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with tarfile.open(tmp_archive, "w:gz") as tar:
+                tar.add(directory, arcname=book)
+            os.replace(tmp_archive, archive)
+        freed = _remove(directory)
+        if archive:
+            freed -= path_size(archive)
+        with self._lock:
+            self.evictions += 1
+        self._forgotten(book, max(freed, 0))
+        logger.info("evicted index", extra={"book": book, "archived": bool(archive)})
+        return freed
+
+    def restore(self, book: str) -> bool:
+        """Bring an evicted index back from cold storage; False when there is no archive."""
+        archive = self.cold_path(book)
+        if not archive or not os.path.exists(archive):
+            return False
+        staging = os.path.join(self.index_dir, f"{book}.{os.getpid()}.{threading.get_ident()}.restoring")
+        shutil.rmtree(staging, ignore_errors=True)
+        try:
+            with tarfile.open(archive, "r:gz") as tar:
+                tar.extractall(staging, filter="data")
+        except FileNotFoundError:
+            # another worker restored it and removed the archive meanwhile
+            return os.path.isdir(self.index_path(book))
+        try:
+            os.replace(os.path.join(staging, book), self.index_path(book))
+        except OSError:
+            # another worker restored it first
+            if not os.path.isdir(self.index_path(book)):
+                raise
+        shutil.rmtree(staging, ignore_errors=True)
+        archived = path_size(archive)
+        try:
+            os.remove(archive)
+        except FileNotFoundError:
+            pass
+        os.utime(self.index_path(book))
+        with self._lock:
+            self.restores += 1
+            self.usage_bytes += max(0, path_size(self.index_path(book)) - archived)
+        logger.info("restored index", extra={"book": book})
+        return True
+
+    def _hot_books(self) -> List[str]:
+        if not os.path.isdir(self.index_dir):
+            return []
+        return [name for name in os.listdir(self.index_dir)
+                if not name.endswith(TEMP_SUFFIXES) and os.path.isdir(os.path.join(self.index_dir, name))]
+
+    # --- garbage collection ----------------------------------------------------
+
+    def sweep(self, books: Set[str], files: Set[str], busy: Set[str] = frozenset()) -> dict:
+        """One pass of GC, cold eviction and quota enforcement.
+
+        `books` are the book names and `files` the upload and cover paths that
+        FileInfo records reference; `busy` books are being ingested and left alone.
+        """
+        report = {"collected": 0, "incomplete": 0, "evicted": 0, "bytes_freed": 0}
+        keep = {os.path.abspath(path) for path in files}
+
+        def collect(path: str, book: Optional[str] = None):
+            if _age(path) < self.grace_seconds:
+                return
+            freed = _remove(path)
+            report["collected"] += 1
+            report["bytes_freed"] += freed
+            if book:
+                self._forgotten(book, freed)
+            else:
+                with self._lock:
+                    self.bytes_freed += freed
+            logger.info("collected orphaned artifact", extra={"path": path})
+
+        # nothing referenced at all more likely means the wrong database than an empty library
+        collecting = bool(books or files)
+        if collecting and os.path.isdir(self.upload_dir):
+            for name in os.listdir(self.upload_dir):
+                path = os.path.join(self.upload_dir, name)
+                if os.path.isfile(path) and os.path.abspath(path) not in keep:
+                    collect(path)
+        for root in (self.index_dir, self.chapter_dir):
+            if not collecting or not os.path.isdir(root):
+                continue
+            for name in os.listdir(root):
+                if name.endswith(TEMP_SUFFIXES):
+                    collect(os.path.join(root, name))
+                elif name not in books and name not in busy:
+                    collect(os.path.join(root, name), name)
+        if collecting and self.cold_dir and os.path.isdir(self.cold_dir):
+            for name in os.listdir(self.cold_dir):
+                book = name[:-len(".tar.gz")] if name.endswith(".tar.gz") else None
+                if book is None or (book not in books and book not in busy):
+                    collect(os.path.join(self.cold_dir, name), book)
+
+        hot = [book for book in self._hot_books() if book in books and book not in busy]
+        for book in hot:
+            # ingestion that failed part way; the index is rebuilt on the next search
+            if not _index_complete(self.index_path(book)) and _age(self.index_path(book)) >= self.grace_seconds:
+                freed = _remove(self.index_path(book))
+                report["incomplete"] += 1
+                report["bytes_freed"] += freed
+                self._forgotten(book, freed)
+        hot = sorted((book for book in hot if os.path.isdir(self.index_path(book))),
+                     key=lambda book: os.path.getmtime(self.index_path(book)))
+        for book in list(hot):
+            if self.cold_after and _age(self.index_path(book)) >= self.cold_after:
+                report["bytes_freed"] += self.evict(book)
+                report["evicted"] += 1
+                hot.remove(book)
+
+        usage = sum(path_size(root) for root in (self.upload_dir, self.index_dir, self.chapter_dir, self.cold_dir)
+                    if root)
+        # over the global quota: least recently used indexes go first
+        while self.global_quota and usage > self.global_quota and hot:
+            freed = self.evict(hot.pop(0))
+            usage -= freed
+            report["bytes_freed"] += freed
+            report["evicted"] += 1
+        with self._lock:
+            self.usage_bytes = usage
+            self.collected += report["collected"] + report["incomplete"]
+        report["usage_bytes"] = usage
+        return report
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"usage_bytes": self.usage_bytes, "global_quota_bytes": self.global_quota,
+                    "user_quota_bytes": self.user_quota, "evictions": self.evictions, "restores": self.restores,
+                    "collected": self.collected, "bytes_freed": self.bytes_freed}
+
+
+def _index_complete(directory: str) -> bool:
+    names = set(os.listdir(directory))
+    vectors = "default__vector_store.npy" in names or "default__vector_store.json" in names
+    return vectors and {"docstore.json", "index_store.json"} <= names
@@ -0,0 +1,165 @@
+import logging
+import os
+import threading
+from typing import Any, Callable, Dict, Optional
+
+from llama_index.core.callbacks import CBEventType, EventPayload
+from llama_index.core.callbacks.base_handler import BaseCallbackHandler
+from prometheus_client import REGISTRY, Counter, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from pymongo import monitoring
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "Time to produce the response headers, by route template",
+    ["method", "route", "status"],
+)
+MONGO_LATENCY = Histogram(
+    "mongo_command_duration_seconds", "MongoDB command round trips", ["command", "collection", "outcome"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+LLM_CALLS = Counter("llm_calls_total", "OpenAI requests, by calling function", ["function", "model"])
+LLM_TOKENS = Counter("llm_tokens_total", "OpenAI tokens, by calling function", ["function", "model", "kind"])
+STAGE_LATENCY = Histogram(
+    "ingest_stage_duration_seconds", "Ingestion stage attempts", ["stage", "outcome"],
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600),
+)
+
+
+def record_llm_usage(function: str, model: str, prompt_tokens: int = 0, completion_tokens: int = 0):
+    LLM_CALLS.labels(function, model).inc()
+    if prompt_tokens:
+        LLM_TOKENS.labels(function, model, "prompt").inc(prompt_tokens)
+    if completion_tokens:
+        LLM_TOKENS.labels(function, model, "completion").inc(completion_tokens)
+
+
+def record_openai_response(function: str, response: Any):
+    usage = getattr(response, "usage", None)
+    record_llm_usage(function, getattr(response, "model", None) or "unknown",
+                     getattr(usage, "prompt_tokens", 0) or 0, getattr(usage, "completion_tokens", 0) or 0)
+
+
+class LLMUsageHandler(BaseCallbackHandler):
+    """llama_index callback that records the OpenAI usage of every LLM call under `function`."""
+
+    def __init__(self, function: str):
+        super().__init__(event_starts_to_ignore=[], event_ends_to_ignore=[])
+        self.function = function
+
+    def on_event_start(self, event_type, payload=None, event_id="", parent_id="", **kwargs) -> str:
+        return event_id
+
+    def on_event_end(self, event_type, payload=None, event_id="", **kwargs) -> None:
+        if event_type != CBEventType.LLM or not payload:
+            return
+        response = payload.get(EventPayload.RESPONSE) or payload.get(EventPayload.COMPLETION)
+        raw = getattr(response, "raw", None)
+        if isinstance(raw, dict):
+            usage = raw.get("usage")
+            model = raw.get("model")
+        else:
+            usage = getattr(raw, "usage", None)
+            model = getattr(raw, "model", None)
+        if isinstance(usage, dict):
+            prompt_tokens, completion_tokens = usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+        else:
+            prompt_tokens, completion_tokens = getattr(usage, "prompt_tokens", 0), getattr(usage, "completion_tokens", 0)
+        record_llm_usage(self.function, model or "unknown", prompt_tokens or 0, completion_tokens or 0)
+
+    def start_trace(self, trace_id: Optional[str] = None) -> None:
+        pass
+
+    def end_trace(self, trace_id: Optional[str] = None, trace_map=None) -> None:
+        pass
+
+
+class MongoCommandTimer(monitoring.CommandListener):
+    """Times every MongoDB command; pass it to the client through `event_listeners`."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._collections: Dict[tuple, str] = {}
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        if not isinstance(collection, str):
+            collection = ""
+        with self._lock:
+            self._collections[(event.request_id, event.connection_id)] = collection
+
+    def _finished(self, event, outcome: str):
+        with self._lock:
+            collection = self._collections.pop((event.request_id, event.connection_id), "")
+        MONGO_LATENCY.labels(event.command_name, collection, outcome).observe(event.duration_micros / 1e6)
+
+    def succeeded(self, event):
+        self._finished(event, "ok")
+
+    def failed(self, event):
+        self._finished(event, "error")
+
+
+class StatsCollector:
+    """Exposes the stats() dicts of the in-process caches and pools as metrics.
+
+    Counting keys (hits, misses, ...) become `<prefix>_<key>_total` counters,
+    every other numeric key a `<prefix>_<key>` gauge, labelled by source name.
+    """
+
+    COUNTERS = ("hits", "misses", "evictions", "completed", "rejected", "texts", "tokens_saved", "queued",
+                "already_ready", "failed", "pauses", "budget_waits", "restores", "collected", "bytes_freed",
+                "computed", "coalesced", "shared")
+
+    def __init__(self, prefix: str, sources: Dict[str, Callable[[], dict]]):
+        self.prefix = prefix
+        self.sources = sources
+
+    def collect(self):
+        families = {}
+        for name, stats in self.sources.items():
+            try:
+                values = stats()
+            except Exception:
+                logging.getLogger(__name__).exception("stats source failed", extra={"source": name})
+                continue
+            for key, value in values.items():
+                if not isinstance(value, (int, float)) or isinstance(value, bool):
+                    continue
+                family = families.get(key)
+                if family is None:
+                    if key in self.COUNTERS:
+                        family = CounterMetricFamily(f"{self.prefix}_{key}", f"{self.prefix} {key}", labels=["name"])
+                    else:
+                        family = GaugeMetricFamily(f"{self.prefix}_{key}", f"{self.prefix} {key}", labels=["name"])
+                    families[key] = family
+                family.add_metric([name], value)
+        return list(families.values())
+
+
+def register_stats(prefix: str, sources: Dict[str, Callable[[], dict]]):
+    REGISTRY.register(StatsCollector(prefix, sources))
+
+
+# --- logging ---------------------------------------------------------------
+
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+class KeyValueFormatter(logging.Formatter):
+    """`time level logger message key=value ...`, where the pairs come from `extra=`."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = " ".join(f"{key}={value!r}" if isinstance(value, str) and " " in value else f"{key}={value}"
+                          for key, value in record.__dict__.items() if key not in _RECORD_FIELDS)
+        return f"{line} {fields}" if fields else line
+
+
+def configure_logging(level: str = LOG_LEVEL):
+    handler = logging.StreamHandler()
+    handler.setFormatter(KeyValueFormatter("%(asctime)s %(levelname)s %(name)s %(message)s"))
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(level.upper())
@@ -0,0 +1,162 @@
+import json
+import os
+import threading
+from typing import Any, List, Optional, Sequence
+
+import numpy as np
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.schema import BaseNode
+from llama_index.core.vector_stores.types import (
+    BasePydanticVectorStore,
+    VectorStoreQuery,
+    VectorStoreQueryResult,
+)
+
+# float16 halves the file and the page cache it occupies, at some cost in query speed
+VECTOR_DTYPE = os.getenv("VECTOR_DTYPE", "float32")
+
+VECTORS_FNAME = "default__vector_store.npy"
+IDS_FNAME = "default__vector_store.ids.json"
+
+
+class NumpyVectorStore(BasePydanticVectorStore):
+    """Vector store backed by one contiguous (n, dim) matrix saved as a .npy file.
+
+    Rows are L2-normalized on insert, so a query is a single matrix-vector
+    product followed by argpartition for the top k (cosine similarity, like
+    the default SimpleVectorStore). Persisted stores are opened with mmap,
+    which makes loading a book's index independent of its size. Node texts
+    stay in the docstore.
+    """
+
+    stores_text: bool = False
+
+    _matrix: np.ndarray = PrivateAttr()
+    _ids: List[str] = PrivateAttr()
+    _ref_doc_ids: List[str] = PrivateAttr()
+    _pending: List[np.ndarray] = PrivateAttr()
+    _dtype: str = PrivateAttr()
+
+    def __init__(self, matrix: Optional[np.ndarray] = None, ids: Optional[List[str]] = None,
+                 ref_doc_ids: Optional[List[str]] = None, dtype: str = VECTOR_DTYPE, **kwargs: Any):
+        super().__init__(**kwargs)
+        self._dtype = dtype
+        self._matrix = matrix if matrix is not None else np.zeros((0, 0), dtype=dtype)
+        self._ids = list(ids or [])
+        self._ref_doc_ids = list(ref_doc_ids or [])
+        self._pending = []
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "NumpyVectorStore"
+
+    @property
+    def client(self) -> None:
+        return None
+
+    @classmethod
+    def from_persist_dir(cls, persist_dir: str, dtype: str = VECTOR_DTYPE) -> "NumpyVectorStore":
+        """Open a persisted store; raises FileNotFoundError when there is none."""
+        with open(os.path.join(persist_dir, IDS_FNAME), encoding="utf-8") as f:
+            meta = json.load(f)
+        matrix = np.load(os.path.join(persist_dir, VECTORS_FNAME), mmap_mode="r")
+        return cls(matrix, meta["ids"], meta["ref_doc_ids"], dtype=str(matrix.dtype))
+
+    @classmethod
+    def from_embeddings(cls, embeddings: dict, ref_doc_ids: dict, dtype: str = VECTOR_DTYPE) -> "NumpyVectorStore":
+        """Build from node id -> embedding and node id -> ref doc id, e.g. a SimpleVectorStore's data."""
+        store = cls(dtype=dtype)
+        ids = list(embeddings)
+        if ids:
+            store._append(ids, [ref_doc_ids.get(node_id, "None") for node_id in ids],
+                          np.asarray([embeddings[node_id] for node_id in ids], dtype=np.float32))
+        return store
+
+    def _append(self, ids: List[str], ref_doc_ids: List[str], vectors: np.ndarray):
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        self._pending.append((vectors / norms).astype(self._dtype))
+        self._ids.extend(ids)
+        self._ref_doc_ids.extend(ref_doc_ids)
+
+    def _consolidate(self) -> np.ndarray:
+        if self._pending:
+            parts = ([self._matrix] if len(self._matrix) else []) + self._pending
+            self._matrix = np.ascontiguousarray(np.vstack(parts))
+            self._pending = []
+        return self._matrix
+
+    def add(self, nodes: Sequence[BaseNode], **add_kwargs: Any) -> List[str]:
+        if not nodes:
+            return []
+        ids = [node.node_id for node in nodes]
+        vectors = np.asarray([node.get_embedding() for node in nodes], dtype=np.float32)
+        self._append(ids, [node.ref_doc_id or "None" for node in nodes], vectors)
+        return ids
+
+    def _keep(self, keep: np.ndarray):
+        matrix = self._consolidate()
+        self._matrix = np.ascontiguousarray(matrix[keep])
+        self._ids = [node_id for node_id, kept in zip(self._ids, keep) if kept]
+        self._ref_doc_ids = [ref for ref, kept in zip(self._ref_doc_ids, keep) if kept]
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        self._keep(np.array([ref != ref_doc_id for ref in self._ref_doc_ids], dtype=bool))
+
+    def delete_nodes(self, node_ids: Optional[List[str]] = None, filters=None, **delete_kwargs: Any) -> None:
+        if filters is not None:
+            raise NotImplementedError("NumpyVectorStore does not support metadata filters")
+        drop = set(node_ids or [])
+        self._keep(np.array([node_id not in drop for node_id in self._ids], dtype=bool))
+
+    def clear(self) -> None:
+        self._keep(np.zeros(len(self._ids), dtype=bool))
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        if query.filters is not None:
+            raise NotImplementedError("NumpyVectorStore does not support metadata filters")
+        matrix = self._consolidate()
+        if not len(matrix) or query.query_embedding is None:
+            return VectorStoreQueryResult(similarities=[], ids=[])
+        q = np.asarray(query.query_embedding, dtype=np.float32)
+        q /= np.linalg.norm(q) or 1.0
+        scores = matrix @ q.astype(matrix.dtype)
+
+        restrict = None
+        if query.node_ids:
+            restrict = set(query.node_ids)
+            allowed = [i for i, node_id in enumerate(self._ids) if node_id in restrict]
+        elif query.doc_ids:
+            restrict = set(query.doc_ids)
+            allowed = [i for i, ref in enumerate(self._ref_doc_ids) if ref in restrict]
+        if restrict is not None:
+            candidates = np.asarray(allowed, dtype=np.int64)
+            scores = scores[candidates]
+        k = min(query.similarity_top_k, len(scores))
+        if k == 0:
+            return VectorStoreQueryResult(similarities=[], ids=[])
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        rows = candidates[top] if restrict is not None else top
+        return VectorStoreQueryResult(
+            similarities=[float(scores[i]) for i in top],
+            ids=[self._ids[i] for i in rows],
+        )
+
+    def persist(self, persist_path: str, fs: Any = None) -> None:
+        # StorageContext hands us <dir>/default__vector_store.json; the matrix and ids go next to it
+        persist_dir = os.path.dirname(persist_path)
+        os.makedirs(persist_dir, exist_ok=True)
+        matrix = self._consolidate()
+        if not len(matrix):
+            matrix = np.zeros((0, 0), dtype=self._dtype)
+        # staging names are per writer, so two workers persisting the same index can't mix their files
+        staging = f"{os.getpid()}.{threading.get_ident()}.tmp"
+        vectors_path = os.path.join(persist_dir, VECTORS_FNAME)
+        with open(f"{vectors_path}.{staging}", "wb") as f:
+            np.save(f, np.ascontiguousarray(matrix, dtype=self._dtype))
+        os.replace(f"{vectors_path}.{staging}", vectors_path)
+        ids_path = os.path.join(persist_dir, IDS_FNAME)
+        with open(f"{ids_path}.{staging}", "w", encoding="utf-8") as f:
+            json.dump({"ids": self._ids, "ref_doc_ids": self._ref_doc_ids}, f)
+        os.replace(f"{ids_path}.{staging}", ids_path)
@@ -0,0 +1,218 @@
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import os
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# How many chapters past the reader's position to summarize ahead of time
+PREFETCH_LOOKAHEAD = int(os.getenv("PREFETCH_LOOKAHEAD", "2"))
+# Estimated LLM input tokens prefetching may spend per hour, across all readers
+PREFETCH_TOKEN_BUDGET = int(os.getenv("PREFETCH_TOKEN_BUDGET", "2000000"))
+PREFETCH_WORKERS = int(os.getenv("PREFETCH_WORKERS", "1"))
+# Seconds to back off while interactive traffic is high
+PREFETCH_PAUSE_SECONDS = float(os.getenv("PREFETCH_PAUSE_SECONDS", "5"))
+
+BUDGET_WINDOW = 3600.0
+# The heap is rebuilt from the pending chapters once superseded entries outnumber them
+# (and there are at least this many), so readers re-syncing often don't grow it without bound
+COMPACT_MIN = 64
+
+
+def parse_progression(value) -> Optional[float]:
+    """Reading position in [0, 1] from a plain number or a Readium locator (JSON)."""
+    if value is None or value == "":
+        return None
+    try:
+        progression = float(value)
+    except (TypeError, ValueError):
+        try:
+            locator = json.loads(value) if isinstance(value, str) else value
+        except ValueError:
+            return None
+        if not isinstance(locator, dict):
+            return None
+        locations = locator.get("locations") if isinstance(locator.get("locations"), dict) else locator
+        progression = locations.get("totalProgression", locations.get("progression"))
+        if progression is None:
+            return None
+        try:
+            progression = float(progression)
+        except (TypeError, ValueError):
+            return None
+    return min(max(progression, 0.0), 1.0)
+
+
+class PrefetchScheduler:
+    """Summarizes the chapters just ahead of each active reader in the background.
+
+    `note_progress(book, progression)` queues the reader's current chapter and
+    the next `lookahead` ones; `queue_book(book)` queues a whole book behind
+    them (cache warming). Work is taken from a priority queue ordered by
+    distance from the reader (nearest first), then by how recently the book
+    was synced (latest first). Each summary is charged an estimated token
+    cost against a rolling hourly budget, and workers back off while `busy()`
+    reports interactive load.
+
+    The callables are injected by the app:
+      summarize(book, chapter)  coroutine that computes and stores the summary
+      ready(book, chapter)      blocking check whether a summary already exists
+      sizes(book)               blocking list of chapter sizes in reading order
+      busy()                    whether interactive traffic should take priority
+    Chapter sizes locate the reader's chapter and double as the cost estimate
+    (about four characters per token).
+    """
+
+    def __init__(self, summarize: Callable[[str, str], Awaitable], ready: Callable[[str, str], bool],
+                 chapters: Callable[[str], List[str]], sizes: Callable[[str], List[int]], busy: Callable[[], bool],
+                 lookahead: int = PREFETCH_LOOKAHEAD, token_budget: int = PREFETCH_TOKEN_BUDGET,
+                 workers: int = PREFETCH_WORKERS, pause_seconds: float = PREFETCH_PAUSE_SECONDS):
+        self.summarize = summarize
+        self.ready = ready
+        self.chapters = chapters
+        self.sizes = sizes
+        self.busy = busy
+        self.lookahead = lookahead
+        self.token_budget = token_budget
+        self.workers = workers
+        self.pause_seconds = pause_seconds
+        self._heap: List[Tuple] = []
+        self._pending: Dict[Tuple[str, str], Tuple] = {}
+        self._costs: Dict[Tuple[str, str], int] = {}
+        self._spent: deque = deque()  # (time, tokens) charged within the budget window
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+        self._stats = {"queued": 0, "completed": 0, "already_ready": 0, "failed": 0, "pauses": 0,
+                       "budget_waits": 0}
+
+    async def start(self):
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def note_progress(self, book: str, progression) -> int:
+        """Queue the chapters around `progression`; returns how many were (re)queued."""
+        progression = parse_progression(progression)
+        if progression is None:
+            return 0
+        titles = await asyncio.to_thread(self.chapters, book)
+        sizes = await asyncio.to_thread(self.sizes, book)
+        if not titles or len(sizes) != len(titles):
+            return 0
+        current = _chapter_at(sizes, progression)
+        return self._push(book, titles, sizes, range(current, min(current + self.lookahead + 1, len(titles))))
+
+    async def queue_book(self, book: str) -> int:
+        """Queue every chapter of `book`, in reading order, behind the readers' next chapters."""
+        titles = await asyncio.to_thread(self.chapters, book)
+        sizes = await asyncio.to_thread(self.sizes, book)
+        if not titles or len(sizes) != len(titles):
+            return 0
+        return self._push(book, titles, sizes, range(len(titles)), first_distance=self.lookahead + 1)
+
+    def _push(self, book: str, titles: List[str], sizes: List[int], indexes: range, first_distance: int = 0) -> int:
+        synced_at = time.time()
+        queued = 0
+        for distance, index in enumerate(indexes, start=first_distance):
+            key = (book, titles[index])
+            priority = (distance, -synced_at, next(self._seq))
+            self._pending[key] = priority
+            self._costs[key] = max(1, sizes[index] // 4)
+            heapq.heappush(self._heap, (*priority, key))
+            queued += 1
+        self._compact()
+        self._stats["queued"] += queued
+        if queued and self._wakeup is not None:
+            self._wakeup.set()
+        return queued
+
+    def _pop(self) -> Optional[Tuple[str, str]]:
+        while self._heap:
+            *priority, key = heapq.heappop(self._heap)
+            # entries superseded by a newer note_progress for the same chapter are skipped
+            if self._pending.get(key) == tuple(priority):
+                del self._pending[key]
+                return key
+        return None
+
+    def _spent_tokens(self) -> int:
+        cutoff = time.time() - BUDGET_WINDOW
+        while self._spent and self._spent[0][0] < cutoff:
+            self._spent.popleft()
+        return sum(tokens for _, tokens in self._spent)
+
+    async def _worker(self):
+        while True:
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            if self.busy():
+                self._stats["pauses"] += 1
+                await asyncio.sleep(self.pause_seconds)
+                continue
+            key = self._pop()
+            if key is None:
+                continue
+            book, chapter = key
+            cost = self._costs.pop(key, 1)
+            try:
+                if await asyncio.to_thread(self.ready, book, chapter):
+                    self._stats["already_ready"] += 1
+                    continue
+                spent = self._spent_tokens()
+                if spent and spent + cost > self.token_budget:
+                    # over budget: put the chapter back and wait for the window to roll
+                    self._stats["budget_waits"] += 1
+                    self._requeue(key, cost)
+                    await asyncio.sleep(min(BUDGET_WINDOW, self._spent[0][0] + BUDGET_WINDOW - time.time() + 1))
+                    continue
+                self._spent.append((time.time(), cost))
+                await self.summarize(book, chapter)
+                self._stats["completed"] += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._stats["failed"] += 1
+                logger.warning("prefetch failed", extra={"book": book, "chapter": chapter, "error": str(e)})
+
+    def _requeue(self, key: Tuple[str, str], cost: int):
+        if key in self._pending:
+            return
+        priority = (0, -time.time(), next(self._seq))
+        self._pending[key] = priority
+        self._costs[key] = cost
+        heapq.heappush(self._heap, (*priority, key))
+
+    def _compact(self):
+        if len(self._heap) - len(self._pending) < max(COMPACT_MIN, len(self._pending)):
+            return
+        self._heap = [(*priority, key) for key, priority in self._pending.items()]
+        heapq.heapify(self._heap)
+
+    def stats(self) -> dict:
+        return {**self._stats, "pending": len(self._pending), "heap": len(self._heap),
+                "tokens_spent": self._spent_tokens(), "token_budget": self.token_budget}
+
+
+def _chapter_at(sizes: List[int], progression: float) -> int:
+    total = sum(sizes)
+    if total <= 0:
+        return min(int(progression * len(sizes)), len(sizes) - 1)
+    position = progression * total
+    for index, size in enumerate(sizes):
+        position -= size
+        if position < 0:
+            return index
+    return len(sizes) - 1
@@ -3,48 +3,131 @@ from llama_index.llms.openai import OpenAI
 from llama_index.embeddings.openai import OpenAIEmbedding
 from llama_index.llms.gemini import Gemini
 from llama_index.core import Settings
+import heapq
+import logging
 import os
+import shutil
 from sentence_transformers import SentenceTransformer
 from llama_index.core import VectorStoreIndex
 from llama_index.core import SimpleDirectoryReader
 from llama_index.core.node_parser import SentenceSplitter
 from llama_index.core import StorageContext, load_index_from_storage
 from llama_index.core.prompts import PromptTemplate
+from llama_index.core.schema import NodeWithScore, QueryBundle, TextNode
+from llama_index.core.vector_stores import SimpleVectorStore
 
 from llama_index.core import get_response_synthesizer
 from llama_index.core.retrievers import VectorIndexRetriever
 from llama_index.core.query_engine import RetrieverQueryEngine
+from index_cache import QueryEngineCache
+from embedding_cache import CachedEmbedding, EmbeddingStore
+from keyword_index import BM25Index, assign_chapters, reciprocal_rank_fusion
+from numpy_vector_store import NumpyVectorStore
+from metrics import LLMUsageHandler
+
+logger = logging.getLogger(__name__)
 
 
 
 
 # Setting global parameter
 #Settings.embed_model = HuggingFaceEmbedding('BAAI/bge-large-en-v1.5', trust_remote_code=True)
-Settings.embed_model = OpenAIEmbedding(model="text-embedding-3-large")
+embed_model = CachedEmbedding(OpenAIEmbedding(model="text-embedding-3-large"), EmbeddingStore())
+Settings.embed_model = embed_model
 #Settings.llm = Gemini(model_name="models/gemini-pro")
 Settings.llm = OpenAI(model="gpt-4o-mini")
+# Settings hands its callback manager to the global LLM, so usage is recorded there
+Settings.callback_manager.add_handler(LLMUsageHandler("search"))
 
+# Memory budget for loaded indexes, measured as their persisted size on disk
+SEARCH_CACHE_BYTES = int(os.getenv("SEARCH_CACHE_BYTES", str(1024 * 1024 * 1024)))
+KEYWORD_CACHE_BYTES = int(os.getenv("KEYWORD_CACHE_BYTES", str(256 * 1024 * 1024)))
 
+# Persisted indexes live in INDEX_DIR/<fileName>; they used to be written to /<fileName>
+INDEX_DIR = os.getenv("INDEX_DIR", "data/indexes")
 
+# /search modes: "llm" synthesizes an answer, the others only return ranked passages
+SEARCH_MODES = ("llm", "keyword", "vector", "hybrid")
 
-def load_and_storage(fileName: str):
-    documents = SimpleDirectoryReader(input_files=[f'uploads/{fileName}.epub']).load_data()
+
+
+
+def load_documents(fileName: str):
+    return SimpleDirectoryReader(input_files=[f'uploads/{fileName}.epub']).load_data()
+
+
+def build_index(documents):
     text_splitter = SentenceSplitter(chunk_size=512, chunk_overlap=10)
     Settings.text_splitter = text_splitter
-    index = VectorStoreIndex.from_documents(documents, transformations=[text_splitter])
-    index.storage_context.persist(persist_dir=f"/{fileName}")
+    storage_context = StorageContext.from_defaults(vector_store=NumpyVectorStore())
+    return VectorStoreIndex.from_documents(documents, storage_context=storage_context, transformations=[text_splitter])
 
 
+def persist_dir(fileName: str) -> str:
+    return os.path.join(INDEX_DIR, fileName)
 
 
-def search(fileName: str, input: str):
+def legacy_persist_dir(fileName: str) -> str:
+    return f"/{fileName}"
+
+
+def has_index(fileName: str) -> bool:
+    return os.path.exists(persist_dir(fileName)) or os.path.exists(legacy_persist_dir(fileName))
+
+
+def persist_index(index, fileName: str):
+    index.storage_context.persist(persist_dir=persist_dir(fileName))
+    query_engines.invalidate(fileName)
+
+
+def load_and_storage(fileName: str):
+    persist_index(build_index(load_documents(fileName)), fileName)
+
+
+
+
+def convert_legacy_vectors(directory: str) -> NumpyVectorStore:
+    # indexes persisted with the JSON SimpleVectorStore are converted once; the JSON is
+    # removed only after the matrix and ids have been written
+    legacy = os.path.join(directory, "default__vector_store.json")
+    try:
+        simple = SimpleVectorStore.from_persist_dir(directory)
+    except FileNotFoundError:
+        # another worker converted it in the meantime
+        return NumpyVectorStore.from_persist_dir(directory)
+    vector_store = NumpyVectorStore.from_embeddings(simple.data.embedding_dict, simple.data.text_id_to_ref_doc_id)
+    vector_store.persist(legacy)
+    try:
+        os.remove(legacy)
+    except FileNotFoundError:
+        pass
+    logger.info("converted legacy vector store", extra={"directory": directory})
+    return vector_store
+
+
+def load_search_engines(fileName: str) -> dict:
     # rebuild storage context
-    print(f"search from storage fileName: {fileName}")
-    storage_context = StorageContext.from_defaults(persist_dir=f"/{fileName}")
+    logger.info("loading index", extra={"book": fileName})
+    directory = persist_dir(fileName)
+    if not os.path.exists(directory) and os.path.exists(legacy_persist_dir(fileName)):
+        shutil.copytree(legacy_persist_dir(fileName), directory)
+    try:
+        vector_store = NumpyVectorStore.from_persist_dir(directory)
+    except FileNotFoundError:
+        vector_store = convert_legacy_vectors(directory)
+    storage_context = StorageContext.from_defaults(persist_dir=directory, vector_store=vector_store)
 
     # load index
     index = load_index_from_storage(storage_context)
 
+    return {
+        "index": index,
+        "query": build_query_engine(index),
+        "stream": build_query_engine(index, streaming=True),
+    }
+
+
+def answer_prompt() -> PromptTemplate:
     template = """
     Use the provided context to answer the query. If no context is provided, answer the question using your internal knowledge to the best of your ability.
 
@@ -56,10 +139,14 @@ def search(fileName: str, input: str):
 
 
 
-    prompt_tmpl = PromptTemplate(
+    return PromptTemplate(
         template=template,
         template_var_mappings={"query_str": "question", "context_str": "context"},
     )
+
+
+def build_query_engine(index, streaming: bool = False):
+    prompt_tmpl = answer_prompt()
     # configure retriever
     retriever = VectorIndexRetriever(
         index=index,
@@ -67,7 +154,7 @@ def search(fileName: str, input: str):
         verbose=True
     )
     # configure response synthesizer
-    response_synthesizer = get_response_synthesizer()
+    response_synthesizer = get_response_synthesizer(streaming=streaming)
 
     # assemble query engine
     query_engine = RetrieverQueryEngine(
@@ -78,7 +165,111 @@ def search(fileName: str, input: str):
     query_engine.update_prompts(
         {"response_synthesizer:text_qa_template":prompt_tmpl}
     )
+    return query_engine
+
+
+def persisted_size(fileName: str) -> int:
+    total = 0
+    for root, _, files in os.walk(persist_dir(fileName)):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
 
+query_engines = QueryEngineCache(load_search_engines, persisted_size, SEARCH_CACHE_BYTES)
+
+
+def keyword_index_path(fileName: str) -> str:
+    return os.path.join(persist_dir(fileName), "keywords.json")
+
+
+def write_keyword_index(index, fileName: str, chapters=()):
+    # the BM25 passages are the vector index's nodes, so both rankings share ids
+    passages = [
+        {"id": node.node_id, "text": node.get_content(),
+         "metadata": {"start_char": node.start_char_idx, "end_char": node.end_char_idx}}
+        for node in index.docstore.docs.values()
+    ]
+    assign_chapters(passages, chapters)
+    os.makedirs(persist_dir(fileName), exist_ok=True)
+    BM25Index.build(passages).save(keyword_index_path(fileName))
+
+
+def persist_keyword_index(index, fileName: str, chapters=()):
+    write_keyword_index(index, fileName, chapters)
+    keyword_indexes.invalidate(fileName)
+
+
+def load_keyword_index(fileName: str) -> BM25Index:
+    if not os.path.exists(keyword_index_path(fileName)):
+        # books indexed before keyword search existed: derive it from the stored nodes
+        write_keyword_index(query_engines.get(fileName)["index"], fileName)
+    return BM25Index.load(keyword_index_path(fileName))
+
+
+def keyword_index_size(fileName: str) -> int:
+    path = keyword_index_path(fileName)
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+keyword_indexes = QueryEngineCache(load_keyword_index, keyword_index_size, KEYWORD_CACHE_BYTES)
+
+
+def candidates(mode: str, top_k: int) -> int:
+    # fusion works best when each side contributes more candidates than are returned
+    return top_k * 2 if mode == "hybrid" else top_k
+
+
+def retrieve_rankings(fileName: str, input: str, mode: str = "hybrid", count: int = 5, query_embedding=None,
+                      normalize: bool = False) -> dict:
+    # The book's own rankings before fusion, {"keyword": [(passage, BM25 score)], "vector":
+    # [(passage, cosine similarity)]}, with the sides `mode` uses; `normalize` divides the
+    # BM25 scores by the book's max_score for the query, so they compare across books
+    keywords = keyword_indexes.get(fileName)
+    rankings = {}
+    if mode in ("keyword", "hybrid"):
+        rankings["keyword"] = keywords.search(input, count)
+        if normalize and rankings["keyword"]:
+            best = keywords.max_score(input)
+            rankings["keyword"] = [(passage, score / best) for passage, score in rankings["keyword"]]
+    if mode in ("vector", "hybrid"):
+        retriever = query_engines.get(fileName)["index"].as_retriever(similarity_top_k=count)
+        nodes = retriever.retrieve(QueryBundle(query_str=input, embedding=query_embedding))
+        rankings["vector"] = [(keywords.by_id[node.node.node_id], node.score)
+                              for node in nodes if node.node.node_id in keywords.by_id]
+    return rankings
+
+
+def retrieve(fileName: str, input: str, mode: str = "hybrid", top_k: int = 5, query_embedding=None):
+    # Ranked passages with their chapter and location, without any LLM call; "keyword"
+    # needs no embedding either, "vector" and "hybrid" embed the query once (or use
+    # `query_embedding` when the caller already has it, e.g. across a whole library).
+    rankings = list(retrieve_rankings(fileName, input, mode, candidates(mode, top_k), query_embedding).values())
+    ranked = reciprocal_rank_fusion(rankings, top_k) if len(rankings) > 1 else rankings[0]
+    return [{"text": passage["text"], "score": score, "metadata": passage["metadata"]} for passage, score in ranked]
+
+
+def merge_rankings(shards: dict, top_k: int = 5) -> list:
+    # One ranking across books from each book's retrieve_rankings(normalize=True) ({fileName:
+    # rankings}). Each side is merged on its scores first (cosine similarity from one embedding
+    # model, BM25 normalized per book), so a hybrid search fuses global ranks: per-book fused
+    # scores would give every book's best passage the same score.
+    # Returns [(fileName, passage, score)], best first.
+    merged = {}
+    for fileName, rankings in shards.items():
+        for side, ranking in rankings.items():
+            merged.setdefault(side, []).extend(
+                ({**passage, "id": (fileName, passage["id"]), "book": fileName}, score) for passage, score in ranking)
+    depth = candidates("hybrid", top_k) if len(merged) > 1 else top_k
+    sides = [heapq.nlargest(depth, ranking, key=lambda item: item[1]) for ranking in merged.values()]
+    if not sides:
+        return []
+    ranked = reciprocal_rank_fusion(sides, top_k) if len(sides) > 1 else sides[0][:top_k]
+    return [(passage["book"], passage, score) for passage, score in ranked]
+
+
+def search(fileName: str, input: str):
+    query_engine = query_engines.get(fileName)["query"]
 
     ## Input
     query = ""
@@ -93,6 +284,28 @@ def search(fileName: str, input: str):
     return str(response)
 
 
+def synthesize(input: str, passages: list) -> str:
+    # One answer from passages gathered elsewhere (e.g. across books), with /search's prompt
+    synthesizer = get_response_synthesizer(text_qa_template=answer_prompt())
+    nodes = [NodeWithScore(node=TextNode(text=passage["text"]), score=passage["score"]) for passage in passages]
+    return str(synthesizer.synthesize(f"tìm thông tin về {input}", nodes))
+
+
+def search_stream(fileName: str, input: str):
+    # Yields ("sources", [passages]) once retrieval is done, then ("token", text) for every
+    # token of the synthesized answer as the LLM produces it.
+    query_engine = query_engines.get(fileName)["stream"]
+    query_bundle = QueryBundle(f"tìm thông tin về {input}")
+    nodes = query_engine.retrieve(query_bundle)
+    yield "sources", [
+        {"text": node.node.get_content(), "score": node.score, "metadata": node.node.metadata}
+        for node in nodes
+    ]
+    response = query_engine.synthesize(query_bundle, nodes)
+    for token in response.response_gen:
+        yield "token", token
+
+
 if __name__ == "__main__":
     fileName = "Ác Ý - Higashino Keigo"
     load_and_storage(fileName)
@@ -0,0 +1,180 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Awaitable, Callable, Dict, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Shared by the uvicorn workers of one host: lease files mark a computation in progress,
+# result files hand its result to the other workers
+SINGLEFLIGHT_DIR = os.getenv("SINGLEFLIGHT_DIR", "data/singleflight")
+# How long a finished result is handed out to late arrivals from other workers
+SINGLEFLIGHT_RESULT_TTL = float(os.getenv("SINGLEFLIGHT_RESULT_TTL", "10"))
+# A lease older than this (or held by a dead process) is taken over
+SINGLEFLIGHT_LEASE_TTL = float(os.getenv("SINGLEFLIGHT_LEASE_TTL", "600"))
+SINGLEFLIGHT_POLL = float(os.getenv("SINGLEFLIGHT_POLL", "0.2"))
+
+_MISSING = object()
+
+
+def flight_key(*parts) -> str:
+    return hashlib.sha256(json.dumps(parts, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class SingleFlight:
+    """Runs each distinct computation once, however many callers ask for it at the same time.
+
+    Within a process, callers with the same key await one shared task; a
+    caller going away doesn't cancel it for the others. Across processes,
+    the first to create <key>.lease computes while the rest poll for
+    <key>.json, which the leader writes when done (results must be JSON).
+    A follower whose leader failed or died takes over the lease and computes
+    it itself; errors are only shared within a process.
+    """
+
+    def __init__(self, name: str, directory: str = SINGLEFLIGHT_DIR, result_ttl: float = SINGLEFLIGHT_RESULT_TTL,
+                 lease_ttl: float = SINGLEFLIGHT_LEASE_TTL, poll: float = SINGLEFLIGHT_POLL):
+        self.name = name
+        self.directory = os.path.join(directory, name)
+        self.result_ttl = result_ttl
+        self.lease_ttl = lease_ttl
+        self.poll = poll
+        self._flights: Dict[str, asyncio.Task] = {}
+        self._pruned = 0.0
+        self.computed = 0
+        self.coalesced = 0
+        self.shared = 0
+        os.makedirs(self.directory, exist_ok=True)
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        """`await fn()`, or the result of an identical call already in flight."""
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = asyncio.create_task(self._run(key, fn))
+            self._flights[key] = flight
+            flight.add_done_callback(lambda task: self._done(key, task))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(flight)
+
+    def _done(self, key: str, task: asyncio.Task):
+        self._flights.pop(key, None)
+        if not task.cancelled() and task.exception() is not None:
+            logger.debug("coalesced computation failed", extra={"flight": self.name, "error": str(task.exception())})
+
+    async def _run(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        lease = os.path.join(self.directory, f"{key}.lease")
+        result_path = os.path.join(self.directory, f"{key}.json")
+        while True:
+            result = await asyncio.to_thread(self._read_result, result_path)
+            if result is not _MISSING:
+                self.shared += 1
+                return result
+            if await asyncio.to_thread(self._acquire, lease):
+                break
+            # another worker is computing it
+            await asyncio.sleep(self.poll)
+        try:
+            # the previous leader may have finished between our last look and taking the lease
+            result = await asyncio.to_thread(self._read_result, result_path)
+            if result is not _MISSING:
+                self.shared += 1
+                return result
+            self.computed += 1
+            result = await fn()
+            await asyncio.to_thread(self._write_result, result_path, result)
+            return result
+        finally:
+            try:
+                os.remove(lease)
+            except FileNotFoundError:
+                pass
+
+    def _acquire(self, lease: str) -> bool:
+        for _ in range(2):
+            try:
+                fd = os.open(lease, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if not self._take_over(lease):
+                    return False
+                continue
+            with os.fdopen(fd, "w") as f:
+                f.write(str(os.getpid()))
+            return True
+        return False
+
+    def _take_over(self, lease: str) -> bool:
+        # True when the lease was abandoned and has been removed
+        try:
+            with open(lease) as f:
+                holder = f.read()
+            age = time.time() - os.path.getmtime(lease)
+        except FileNotFoundError:
+            return True
+        if age < self.lease_ttl and (not holder.isdigit() or _alive(int(holder))):
+            # an empty lease is one being written right now
+            return False
+        try:
+            with open(lease) as f:
+                if f.read() != holder:
+                    return False
+            os.remove(lease)
+        except FileNotFoundError:
+            pass
+        logger.info("took over abandoned lease", extra={"flight": self.name, "lease": lease})
+        return True
+
+    def _read_result(self, path: str):
+        try:
+            if time.time() - os.path.getmtime(path) > self.result_ttl:
+                return _MISSING
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)["result"]
+        except (OSError, ValueError, KeyError):
+            return _MISSING
+
+    def _write_result(self, path: str, result):
+        try:
+            data = json.dumps({"result": result}, ensure_ascii=False)
+        except (TypeError, ValueError):
+            return
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        self._prune()
+
+    def _prune(self):
+        now = time.time()
+        if now - self._pruned < self.result_ttl:
+            return
+        self._pruned = now
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                if now - os.path.getmtime(path) > self.result_ttl:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        return {"in_flight": len(self._flights), "computed": self.computed, "coalesced": self.coalesced,
+                "shared": self.shared}
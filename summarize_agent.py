@@ -1,8 +1,21 @@
+import asyncio
+import logging
 import os
+import random
 from typing import List, Tuple, Optional
-from openai import OpenAI
+from openai import (
+    OpenAI,
+    AsyncOpenAI,
+    APIConnectionError,
+    APITimeoutError,
+    InternalServerError,
+    RateLimitError,
+)
 import tiktoken
 from tqdm import tqdm
+from metrics import record_openai_response
+
+logger = logging.getLogger(__name__)
 
 model_name = "gpt-4o-mini"
 # load encoding and check the length of dataset
@@ -18,35 +31,110 @@ def get_chat_completion(messages, model=model_name):
         messages=messages,
         temperature=0,
     )
+    record_openai_response("get_chat_completion", response)
     return response.choices[0].message.content
 
 
+# Async client for the concurrent summarization mode; retries are handled by aget_chat_completion.
+async_client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
+SUMMARY_CONCURRENCY = int(os.getenv("SUMMARY_CONCURRENCY", "8"))
+SUMMARY_MAX_RETRIES = int(os.getenv("SUMMARY_MAX_RETRIES", "6"))
+REDUCE_SYSTEM_MESSAGE = "Combine these partial summaries of consecutive passages into one coherent summary."
+
+
+def _retry_delay(error: Exception, attempt: int) -> float:
+    # honour the Retry-After header sent with 429s, otherwise back off exponentially with jitter
+    response = getattr(error, "response", None)
+    if response is not None:
+        try:
+            return float(response.headers.get("retry-after"))
+        except (TypeError, ValueError):
+            pass
+    return min(60.0, 2 ** attempt) * (0.5 + random.random() / 2)
+
+
+async def aget_chat_completion(messages, model=model_name, max_retries=SUMMARY_MAX_RETRIES):
+    for attempt in range(max_retries + 1):
+        try:
+            response = await async_client.chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=0,
+            )
+            record_openai_response("aget_chat_completion", response)
+            return response.choices[0].message.content
+        except (RateLimitError, APITimeoutError, APIConnectionError, InternalServerError) as e:
+            if attempt == max_retries:
+                raise
+            await asyncio.sleep(_retry_delay(e, attempt))
+
+
 def tokenize(text: str) -> List[str]:
-    encoding = tiktoken.encoding_for_model(model_name)
     return encoding.encode(text)
 
 
+# Returns the last position i >= lo where text splits into two independently tokenized halves, or 0.
+# A single space between two letters always starts a new pre-token in the GPT tokenizers, so
+# len(tokenize(text)) == len(tokenize(text[:i])) + len(tokenize(text[i:])), and anything appended
+# after text leaves the tokens of text[:i] unchanged.
+def _token_split_point(text: str, lo: int) -> int:
+    i = text.rfind(" ", max(lo, 1), len(text) - 1)
+    while i > 0:
+        if text[i - 1].isalpha() and text[i + 1].isalpha():
+            return i
+        i = text.rfind(" ", max(lo, 1), i)
+    return 0
+
+
+# Exact running token count of a string that only grows at the end. Only the part after the
+# last split point is ever re-tokenized, so extending the string costs time proportional to the
+# appended text rather than to the whole string.
+class _TokenCounter:
+    def __init__(self, text: str = ""):
+        self._frozen = 0  # token count of everything before self._tail
+        self._tail = ""
+        self.extend(text)
+
+    def count_with(self, suffix: str) -> int:
+        return self._frozen + len(tokenize(self._tail + suffix))
+
+    def extend(self, suffix: str, total: Optional[int] = None):
+        scan_from = len(self._tail) - 1
+        self._tail += suffix
+        if total is None:
+            total = self.count_with("")
+        split = _token_split_point(self._tail, scan_from)
+        if split:
+            self._tail = self._tail[split:]
+            self._frozen = total - len(tokenize(self._tail))
+
+
 # This function chunks a text into smaller pieces based on a maximum token count and a delimiter.
 def chunk_on_delimiter(input_string: str,
-                       max_tokens: int, delimiter: str) -> List[str]:
+                       max_tokens: int, delimiter: str,
+                       chunk_token_counts: Optional[List[int]] = None) -> List[str]:
     chunks = input_string.split(delimiter)
     combined_chunks, _, dropped_chunk_count = combine_chunks_with_no_minimum(
-        chunks, max_tokens, chunk_delimiter=delimiter, add_ellipsis_for_overflow=True
+        chunks, max_tokens, chunk_delimiter=delimiter, add_ellipsis_for_overflow=True,
+        chunk_token_counts=chunk_token_counts,
     )
     if dropped_chunk_count > 0:
-        print(f"warning: {dropped_chunk_count} chunks were dropped due to overflow")
+        logger.warning("chunks dropped due to overflow", extra={"dropped": dropped_chunk_count})
     combined_chunks = [f"{chunk}{delimiter}" for chunk in combined_chunks]
     return combined_chunks
 
 
 # This function combines text chunks into larger blocks without exceeding a specified token count. 
 # It returns the combined text blocks, their original indices, and the count of chunks dropped due to overflow.
+# Token counts are kept as running totals (see _TokenCounter), so each chunk is tokenized a bounded
+# number of times; `chunk_token_counts` may carry precomputed len(tokenize(chunk)) values when there is no header.
 def combine_chunks_with_no_minimum(
         chunks: List[str],
         max_tokens: int,
         chunk_delimiter="\n\n",
         header: Optional[str] = None,
         add_ellipsis_for_overflow=False,
+        chunk_token_counts: Optional[List[int]] = None,
 ) -> Tuple[List[str], List[int]]:
     dropped_chunk_count = 0
     output = []
@@ -54,29 +142,38 @@ def combine_chunks_with_no_minimum(
     candidate = (
         [] if header is None else [header]
     )  # list to hold the current combined chunk candidate
+    candidate_tokens = _TokenCounter(chunk_delimiter.join(candidate))
     candidate_indices = []
     for chunk_i, chunk in enumerate(chunks):
         chunk_with_header = [chunk] if header is None else [header, chunk]
-        if len(tokenize(chunk_delimiter.join(chunk_with_header))) > max_tokens:
+        if header is None and chunk_token_counts is not None:
+            chunk_token_count = chunk_token_counts[chunk_i]
+        else:
+            chunk_token_count = len(tokenize(chunk_delimiter.join(chunk_with_header)))
+        if chunk_token_count > max_tokens:
             # print(f"warning: chunk overflow")
-            if (
-                    add_ellipsis_for_overflow
-                    and len(tokenize(chunk_delimiter.join(candidate + ["..."]))) <= max_tokens
-            ):
-                candidate.append("...")
-                dropped_chunk_count += 1
+            if add_ellipsis_for_overflow:
+                suffix = f"{chunk_delimiter}..." if candidate else "..."
+                extended_candidate_token_count = candidate_tokens.count_with(suffix)
+                if extended_candidate_token_count <= max_tokens:
+                    candidate.append("...")
+                    candidate_tokens.extend(suffix, extended_candidate_token_count)
+                    dropped_chunk_count += 1
             continue  # this case would break downstream assumptions
         # estimate token count with the current chunk added
-        extended_candidate_token_count = len(tokenize(chunk_delimiter.join(candidate + [chunk])))
+        suffix = f"{chunk_delimiter}{chunk}" if candidate else chunk
+        extended_candidate_token_count = candidate_tokens.count_with(suffix)
         # If the token count exceeds max_tokens, add the current candidate to output and start a new candidate
         if extended_candidate_token_count > max_tokens:
             output.append(chunk_delimiter.join(candidate))
             output_indices.append(candidate_indices)
             candidate = chunk_with_header  # re-initialize candidate
+            candidate_tokens = _TokenCounter(chunk_delimiter.join(candidate))
             candidate_indices = [chunk_i]
         # otherwise keep extending the candidate
         else:
             candidate.append(chunk)
+            candidate_tokens.extend(suffix, extended_candidate_token_count)
             candidate_indices.append(chunk_i)
     # add the remaining candidate to output if it's not empty
     if (header is not None and len(candidate) > 1) or (header is None and len(candidate) > 0):
@@ -85,48 +182,67 @@ def combine_chunks_with_no_minimum(
     return output, output_indices, dropped_chunk_count
 
 
-def summarize(text: str,
-              detail: float = 0,
-              model: str = 'gpt-4-turbo',
-              additional_instructions: Optional[str] = None,
-              minimum_chunk_size: Optional[int] = 500,
-              chunk_delimiter: str = ".",
-              summarize_recursively=False,
-              verbose=False):
+def split_for_summary(text: str,
+                      detail: float = 0,
+                      minimum_chunk_size: Optional[int] = 500,
+                      chunk_delimiter: str = ".") -> List[str]:
+    # tokenize every sentence once and share the counts between both chunking passes
+    chunk_token_counts = [len(tokenize(chunk)) for chunk in text.split(chunk_delimiter)]
 
     # interpolate the number of chunks based to get specified level of detail
-    max_chunks = len(chunk_on_delimiter(text, minimum_chunk_size, chunk_delimiter))
+    smallest_chunks = chunk_on_delimiter(text, minimum_chunk_size, chunk_delimiter, chunk_token_counts)
+    max_chunks = len(smallest_chunks)
     min_chunks = 1
     num_chunks = int(min_chunks + detail * (max_chunks - min_chunks))
 
     # adjust chunk_size based on interpolated number of chunks
     document_length = len(tokenize(text))
     chunk_size = max(minimum_chunk_size, document_length // num_chunks)
-    text_chunks = chunk_on_delimiter(text, chunk_size, chunk_delimiter)
-    # if verbose:
-    #     print(f"Splitting the text into {len(text_chunks)} chunks to be summarized.")
-    #     print(f"Chunk lengths are {[len(tokenize(x)) for x in text_chunks]}")
+    if chunk_size == minimum_chunk_size:
+        return smallest_chunks
+    return chunk_on_delimiter(text, chunk_size, chunk_delimiter, chunk_token_counts)
+
 
+def summary_messages(chunk: str,
+                     additional_instructions: Optional[str] = None,
+                     previous_summaries: Optional[List[str]] = None,
+                     system_message_content: str = "Rewrite this text in summarized form.") -> List[dict]:
     # set system message
-    system_message_content = "Rewrite this text in summarized form."
     if additional_instructions is not None:
         system_message_content += f"\n\n{additional_instructions}"
 
+    if previous_summaries:
+        # Creating a structured prompt for recursive summarization
+        accumulated_summaries_string = '\n\n'.join(previous_summaries)
+        user_message_content = f"Previous summaries:\n\n{accumulated_summaries_string}\n\nText to summarize next:\n\n{chunk}"
+    else:
+        # Directly passing the chunk for summarization without recursive context
+        user_message_content = chunk
+
+    return [
+        {"role": "system", "content": system_message_content},
+        {"role": "user", "content": user_message_content}
+    ]
+
+
+def summarize(text: str,
+              detail: float = 0,
+              model: str = 'gpt-4-turbo',
+              additional_instructions: Optional[str] = None,
+              minimum_chunk_size: Optional[int] = 500,
+              chunk_delimiter: str = ".",
+              summarize_recursively=False,
+              verbose=False):
+
+    text_chunks = split_for_summary(text, detail, minimum_chunk_size, chunk_delimiter)
+    # if verbose:
+    #     print(f"Splitting the text into {len(text_chunks)} chunks to be summarized.")
+    #     print(f"Chunk lengths are {[len(tokenize(x)) for x in text_chunks]}")
+
     accumulated_summaries = []
     for chunk in tqdm(text_chunks):
-        if summarize_recursively and accumulated_summaries:
-            # Creating a structured prompt for recursive summarization
-            accumulated_summaries_string = '\n\n'.join(accumulated_summaries)
-            user_message_content = f"Previous summaries:\n\n{accumulated_summaries_string}\n\nText to summarize next:\n\n{chunk}"
-        else:
-            # Directly passing the chunk for summarization without recursive context
-            user_message_content = chunk
-
-        # Constructing messages based on whether recursive summarization is applied
-        messages = [
-            {"role": "system", "content": system_message_content},
-            {"role": "user", "content": user_message_content}
-        ]
+        previous_summaries = accumulated_summaries if summarize_recursively else None
+        messages = summary_messages(chunk, additional_instructions, previous_summaries)
 
         # Assuming this function gets the completion and works as expected
         response = get_chat_completion(messages, model=model)
@@ -137,6 +253,119 @@ def summarize(text: str,
 
     return final_summary
 
+
+# Async mode: chunk summaries are requested concurrently (at most `max_concurrency` in flight),
+# results keep chunk order, and `reduce=True` merges the partial summaries hierarchically into one.
+async def asummarize(text: str,
+                     detail: float = 0,
+                     model: str = 'gpt-4-turbo',
+                     additional_instructions: Optional[str] = None,
+                     minimum_chunk_size: Optional[int] = 500,
+                     chunk_delimiter: str = ".",
+                     summarize_recursively=False,
+                     max_concurrency: int = SUMMARY_CONCURRENCY,
+                     reduce=False,
+                     reduce_max_tokens: int = 3000,
+                     verbose=False):
+
+    partial_summaries = {}
+    async for index, _, summary in asummarize_stream(
+            text, detail, model, additional_instructions, minimum_chunk_size, chunk_delimiter,
+            summarize_recursively, max_concurrency, verbose):
+        partial_summaries[index] = summary
+    accumulated_summaries = [partial_summaries[index] for index in sorted(partial_summaries)]
+
+    if reduce:
+        return await reduce_summaries(accumulated_summaries, model, reduce_max_tokens, max_concurrency)
+
+    # Compile final summary from partial summaries
+    return '\n\n'.join(accumulated_summaries)
+
+
+# Yields (chunk index, number of chunks, partial summary) as soon as each chunk summary completes,
+# which is not necessarily in chunk order. Pending requests are cancelled if the consumer stops early.
+async def asummarize_stream(text: str,
+                            detail: float = 0,
+                            model: str = 'gpt-4-turbo',
+                            additional_instructions: Optional[str] = None,
+                            minimum_chunk_size: Optional[int] = 500,
+                            chunk_delimiter: str = ".",
+                            summarize_recursively=False,
+                            max_concurrency: int = SUMMARY_CONCURRENCY,
+                            verbose=False):
+
+    # chunking is CPU-bound tokenization, keep it off the event loop
+    text_chunks = await asyncio.to_thread(split_for_summary, text, detail, minimum_chunk_size, chunk_delimiter)
+    if verbose:
+        logger.debug("split text for summary", extra={"chunks": len(text_chunks)})
+
+    if summarize_recursively:
+        # every chunk is summarized in the light of the previous summaries, so this stays serial
+        accumulated_summaries = []
+        for index, chunk in enumerate(text_chunks):
+            messages = summary_messages(chunk, additional_instructions, accumulated_summaries)
+            accumulated_summaries.append(await aget_chat_completion(messages, model=model))
+            yield index, len(text_chunks), accumulated_summaries[-1]
+        return
+
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def indexed(index: int, chunk: str):
+        messages = summary_messages(chunk, additional_instructions)
+        return index, await _bounded_completion(semaphore, messages, model)
+
+    tasks = [asyncio.create_task(indexed(index, chunk)) for index, chunk in enumerate(text_chunks)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            index, summary = await next_done
+            yield index, len(text_chunks), summary
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def reduce_summaries(summaries: List[str],
+                           model: str = model_name,
+                           max_tokens: int = 3000,
+                           max_concurrency: int = SUMMARY_CONCURRENCY) -> str:
+    # Merge neighbouring partial summaries in groups that fit `max_tokens`, level by level,
+    # until one summary is left. Every group of a level is merged concurrently.
+    semaphore = asyncio.Semaphore(max_concurrency)
+    while len(summaries) > 1:
+        groups = await asyncio.to_thread(_group_summaries, summaries, max_tokens)
+        if len(groups) >= len(summaries):
+            # every summary already fills a group on its own; merging can't make progress
+            break
+        summaries = await asyncio.gather(*[
+            _bounded_completion(
+                semaphore,
+                summary_messages(group, system_message_content=REDUCE_SYSTEM_MESSAGE),
+                model,
+            )
+            for group in groups
+        ])
+    return '\n\n'.join(summaries)
+
+
+def _group_summaries(summaries: List[str], max_tokens: int) -> List[str]:
+    # unlike combine_chunks_with_no_minimum, an oversized summary is kept as its own group, never dropped
+    groups, group, group_tokens = [], [], 0
+    for summary in summaries:
+        summary_tokens = len(tokenize(summary))
+        if group and group_tokens + summary_tokens > max_tokens:
+            groups.append('\n\n'.join(group))
+            group, group_tokens = [], 0
+        group.append(summary)
+        group_tokens += summary_tokens
+    if group:
+        groups.append('\n\n'.join(group))
+    return groups
+
+
+async def _bounded_completion(semaphore: asyncio.Semaphore, messages, model: str) -> str:
+    async with semaphore:
+        return await aget_chat_completion(messages, model=model)
+
 # if __name__ == "__main__":
 #     summary_with_detail_0 = summarize(artificial_intelligence_wikipedia_text, detail=0, verbose=True)
 
@@ -0,0 +1,135 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Optional
+
+
+SUMMARY_CACHE_DIR = os.getenv("SUMMARY_CACHE_DIR", "data/summaries")
+SUMMARY_CACHE_TTL = float(os.getenv("SUMMARY_CACHE_TTL", str(30 * 24 * 3600)))
+SUMMARY_CACHE_BYTES = int(os.getenv("SUMMARY_CACHE_BYTES", str(512 * 1024 * 1024)))
+
+
+def summary_key(text: str,
+                model: str,
+                detail: float,
+                minimum_chunk_size: Optional[int] = 500,
+                chunk_delimiter: str = ".",
+                additional_instructions: Optional[str] = None,
+                summarize_recursively: bool = False,
+                reduce: bool = False) -> str:
+    # Everything that changes the output of summarize() is part of the key, so the same
+    # chapter text hits the same entry whichever user or file name it came from.
+    params = json.dumps([model, detail, minimum_chunk_size, chunk_delimiter,
+                         additional_instructions, summarize_recursively, reduce])
+    return hashlib.sha256(f"{params}\n{text}".encode("utf-8")).hexdigest()
+
+
+class SummaryCache:
+    """Content-addressed summaries persisted on disk.
+
+    Each entry is <root>/<key[:2]>/<key>.json. Its mtime is refreshed on every
+    hit and is the one clock for both limits: entries unread for longer than
+    `ttl` seconds are treated as misses and removed, and when the cache grows
+    past `max_bytes` the least recently read entries are evicted.
+    """
+
+    def __init__(self, root: str = SUMMARY_CACHE_DIR, ttl: float = SUMMARY_CACHE_TTL,
+                 max_bytes: int = SUMMARY_CACHE_BYTES):
+        self.root = root
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+        self._bytes = sum(os.path.getsize(path) for path, _ in self._entries())
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], f"{key}.json")
+
+    def _entries(self):
+        for bucket in os.listdir(self.root):
+            bucket_dir = os.path.join(self.root, bucket)
+            if not os.path.isdir(bucket_dir):
+                continue
+            for name in os.listdir(bucket_dir):
+                if name.endswith(".json"):
+                    path = os.path.join(bucket_dir, name)
+                    yield path, os.path.getmtime(path)
+
+    def get(self, key: str) -> Optional[str]:
+        path = self._path(key)
+        entry = None
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                self._remove(path)
+            else:
+                with open(path, encoding="utf-8") as f:
+                    entry = json.load(f)
+        except (OSError, ValueError):
+            pass
+        if entry is None:
+            with self._lock:
+                self.misses += 1
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass  # evicted meanwhile; the summary read is still good
+        with self._lock:
+            self.hits += 1
+        return entry["summary"]
+
+    def put(self, key: str, summary: str):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = json.dumps({"created": time.time(), "summary": summary}, ensure_ascii=False)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(data)
+        with self._lock:
+            old_size = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(tmp_path, path)
+            self._bytes += os.path.getsize(path) - old_size
+            over_budget = self._bytes > self.max_bytes
+        if over_budget:
+            self.evict()
+
+    def _remove(self, path: str):
+        with self._lock:
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+            except OSError:
+                return
+            self._bytes -= size
+            self.evictions += 1
+
+    def evict(self):
+        """Drop entries unread for longer than `ttl`, then the least recently used ones until under budget."""
+        now = time.time()
+        entries = sorted(self._entries(), key=lambda entry: entry[1])
+        live = []
+        for path, mtime in entries:
+            if now - mtime > self.ttl:
+                self._remove(path)
+            else:
+                live.append(path)
+        for path in live:
+            if self._bytes <= self.max_bytes:
+                break
+            self._remove(path)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
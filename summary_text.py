@@ -1,60 +1,39 @@
-from langchain.document_loaders import PyMuPDFLoader
-from llama_index.readers import file
 import pymupdf
-from pprint import pprint
-from summarize_agent import summarize
 
 filename = "Thôn Tám Mộ.epub"
 filename2 = "Bốc án.epub"
 filename3 = "Ác Ý - Higashino Keigo.epub"
 filename4 = "Mua La Rung Trong Vuon - Ma Van Khang.epub"
 
-def getDicOfChapterContent(filePath: str):
-    doc3 = pymupdf.Document(filePath)
-    pprint(doc3.get_toc())
-
-    loader = PyMuPDFLoader(filePath)
-    documents = loader.load_and_split()
-    #from pprint import pprint
-    # pprint(documents)
+def iterChapters(filePath: str):
+    """Yield (title, text) for every table-of-contents entry, in reading order.
+
+    The book is opened once and each TOC entry is mapped to its page range: an
+    entry runs from its own page up to the page where the next entry starts
+    (at least its own page), and the last one runs to the end of the book.
+    Pages before the first entry are skipped. Chapters are produced one at a
+    time, so callers can write them out without holding the whole book.
+    """
+    with pymupdf.open(filePath) as doc:
+        chapter_list = doc.get_toc()
+        page_count = doc.page_count
+        starts = []
+        previous = 1
+        for _, _, page in chapter_list:
+            # unresolved (-1) or backwards entries start where the previous one did
+            previous = max(page, previous)
+            starts.append(previous)
+
+        for i, (_, key, _) in enumerate(chapter_list):
+            start = starts[i]
+            end = starts[i + 1] if i + 1 < len(starts) else page_count + 1
+            end = min(max(end, start + 1), page_count + 1)
+            yield key, "".join(doc[page - 1].get_text() for page in range(start, end))
 
 
+def getDicOfChapterContent(filePath: str):
     chapter_content = {}
-    chapter_list = doc3.get_toc()
-
-    def check(long: str, short: str) -> bool:
-        l = long[:len(short) + 4]
-        _short = short.split()
-        # pprint(_short)
-        for _s in _short:
-            if _s not in l:
-                return False
-        return True
-
-    current_document = 0
-    for i in range(len(chapter_list)-1):
-        key = chapter_list[i][1]
-        # print("-------------------------------------------------------------------")
-        # print(f'key is {key}')
-        nextKey = chapter_list[i+1][1]
-        # print(f'nextkey is {nextKey}')
-        content = ""
-        while (current_document < len(documents) and not check(documents[current_document].page_content, key)):
-            current_document += 1
-        while(current_document < len(documents) and not check (documents[current_document].page_content, nextKey)):
-            content += documents[current_document].page_content
-            current_document += 1
-
-        # print(f'content is {content}')
-        # print("-------------------------------------------------------------------")
+    for key, content in iterChapters(filePath):
         chapter_content[key] = content
-        chapter_content[f"{key}_smrz"]=""
-
-    chapter_content[chapter_list[-1][1]] = ""
-    chapter_content[f"{chapter_list[-1][1]}_smrz"] = ""
-    while current_document < len(documents):
-        chapter_content[chapter_list[-1][1]] += documents[current_document].page_content
-        current_document += 1
-
-    # pprint(chapter_content)
+        chapter_content[f"{key}_smrz"] = ""
     return chapter_content
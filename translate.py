@@ -1,13 +1,24 @@
 from llama_index.llms.openai import OpenAI
 from llama_index.core.prompts import Prompt
-from llama_index.core import Settings
+from llama_index.core.callbacks import CallbackManager
+from metrics import LLMUsageHandler
+from collections import OrderedDict
+import asyncio
+import hashlib
 import os
+import threading
 
 
+TRANSLATION_MEMORY_SIZE = int(os.getenv("TRANSLATION_MEMORY_SIZE", "10000"))
+TRANSLATE_CONCURRENCY = int(os.getenv("TRANSLATE_CONCURRENCY", "8"))
+
 
 class ContextualLlamaTranslator:
-    def __init__(self, model_name="gpt-4o-mini"):
-        Settings.llm = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), model=model_name, temperature=0)
+    def __init__(self, model_name="gpt-4o-mini", memory_size=TRANSLATION_MEMORY_SIZE):
+        # Keep a private LLM instead of overwriting the global Settings.llm that search_explain relies on.
+        # The OpenAI wrapper reuses its underlying client, so connections are shared between requests.
+        self.llm = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), model=model_name, temperature=0,
+                          callback_manager=CallbackManager([LLMUsageHandler("translator")]))
         # Define a prompt template
         self.prompt_template = Prompt(
             template=(
@@ -21,8 +32,40 @@ class ContextualLlamaTranslator:
             "Translation:"
             )
         )
+        # Translation memory: (highlight, hash of before/after context, src, des) -> translation
+        self.memory_size = memory_size
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _memory_key(before_text, highlight_text, after_text, src_lang, des_lang):
+        context = hashlib.sha256(f"{before_text}\x00{after_text}".encode("utf-8")).hexdigest()
+        return (highlight_text, context, src_lang, des_lang)
+
+    def _recall(self, key):
+        with self._lock:
+            translation = self._memory.get(key)
+            if translation is None:
+                self.misses += 1
+                return None
+            self._memory.move_to_end(key)
+            self.hits += 1
+            return translation
+
+    def _remember(self, key, translation):
+        with self._lock:
+            self._memory[key] = translation
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
 
     def translate(self, before_text, highlight_text, after_text, src_lang, des_lang):
+        key = self._memory_key(before_text, highlight_text, after_text, src_lang, des_lang)
+        translation = self._recall(key)
+        if translation is not None:
+            return translation
         # Format the prompt
         prompt_variables = {
             "before_text": before_text,
@@ -33,8 +76,54 @@ class ContextualLlamaTranslator:
         }
         
         # Predict the response
-        response = Settings.llm.predict(prompt=self.prompt_template, **prompt_variables)
-        return str(response)
+        response = self.llm.predict(prompt=self.prompt_template, **prompt_variables)
+        translation = str(response)
+        self._remember(key, translation)
+        return translation
+
+    async def atranslate(self, before_text, highlight_text, after_text, src_lang, des_lang):
+        key = self._memory_key(before_text, highlight_text, after_text, src_lang, des_lang)
+        translation = self._recall(key)
+        if translation is not None:
+            return translation
+        response = await self.llm.apredict(
+            prompt=self.prompt_template,
+            before_text=before_text,
+            highlight_text=highlight_text,
+            after_text=after_text,
+            src_lang=src_lang,
+            des_lang=des_lang,
+        )
+        translation = str(response)
+        self._remember(key, translation)
+        return translation
+
+    async def translate_batch(self, items, src_lang, des_lang, max_concurrency=TRANSLATE_CONCURRENCY):
+        # items: iterable of (before_text, highlight_text, after_text); results keep the input order
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def one(before_text, highlight_text, after_text):
+            async with semaphore:
+                return await self.atranslate(before_text, highlight_text, after_text, src_lang, des_lang)
+
+        return await asyncio.gather(*[one(*item) for item in items])
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._memory), "max_entries": self.memory_size,
+                    "hits": self.hits, "misses": self.misses}
+
+
+_translator = None
+_translator_lock = threading.Lock()
+
+
+def get_translator() -> ContextualLlamaTranslator:
+    global _translator
+    with _translator_lock:
+        if _translator is None:
+            _translator = ContextualLlamaTranslator()
+        return _translator
 
 # Usage
 if __name__ == "__main__":